@@ -1,6 +1,14 @@
 import { PythAttestation } from './basetypes'
+import { ProofUpdate } from '../../lib/pricecaster'
 import tools from '../../tools/app-tools'
 
+export type AccumulatorUpdate = { vaa: Buffer, updates: ProofUpdate[] }
+
+const ACCUMULATOR_MAGIC = Buffer.from('PNAU')
+const ACCUMULATOR_MAJOR_VERSION = 1
+const ACCUMULATOR_WORMHOLE_MERKLE = 0
+const MERKLE_HASH_SIZE = 20
+
 /*
 * Get attestations from payload
 */
@@ -47,3 +55,36 @@ export function getPriceIdsInVaa (vaaPayload: Buffer): string[] {
   }
   return priceIds
 }
+
+/*
+* Parse Pyth accumulator update data: the VAA carrying the Merkle root, then the price messages, each
+* with its proof.
+*/
+export function parseAccumulatorUpdate (data: Buffer): AccumulatorUpdate {
+  if (!data.subarray(0, 4).equals(ACCUMULATOR_MAGIC) || data.readUInt8(4) !== ACCUMULATOR_MAJOR_VERSION) {
+    throw new Error('Not a Pyth accumulator update')
+  }
+  let offset = 7 + data.readUInt8(6)
+  if (data.readUInt8(offset) !== ACCUMULATOR_WORMHOLE_MERKLE) {
+    throw new Error(`Unsupported accumulator update type ${data.readUInt8(offset)}`)
+  }
+  const vaaSize = data.readUInt16BE(offset + 1)
+  const vaa = tools.extract3(data, offset + 3, vaaSize)
+  offset += 3 + vaaSize
+
+  const updates: ProofUpdate[] = []
+  const numUpdates = data.readUInt8(offset++)
+  for (let i = 0; i < numUpdates; ++i) {
+    const messageSize = data.readUInt16BE(offset)
+    const message = tools.extract3(data, offset + 2, messageSize)
+    offset += 2 + messageSize
+    const proof: Buffer[] = []
+    const numNodes = data.readUInt8(offset++)
+    for (let j = 0; j < numNodes; ++j) {
+      proof.push(tools.extract3(data, offset, MERKLE_HASH_SIZE))
+      offset += MERKLE_HASH_SIZE
+    }
+    updates.push({ priceId: tools.extract3(message, 1, 32).toString('hex'), message, proof })
+  }
+  return { vaa, updates }
+}
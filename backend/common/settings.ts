@@ -55,9 +55,11 @@ export interface IAppSettings extends Record<string, unknown> {
     dumpFailedTx: boolean,
     dumpFailedTxDirectory?: string,
     getNetworkTxParamsCycleInterval: number,
+    storeMulti?: boolean,
   },
   apps: {
     pricecasterAppId: number,
+    budgetPadAppId?: number,
     ownerMnemonic: string
   },
   debug?: {
@@ -182,10 +184,12 @@ export function loadFromEnvironment (): IAppSettings {
       port: env.ALGO_PORT ?? '',
       dumpFailedTx: env.ALGO_DUMPFAILEDTX === 'true',
       dumpFailedTxDirectory: env.ALGO_DUMPFAILEDTX_DIRECTORY,
-      getNetworkTxParamsCycleInterval: Number(env.ALGO_GET_NETWORK_TX_PARAMS_CYCLE_INTERVAL)
+      getNetworkTxParamsCycleInterval: Number(env.ALGO_GET_NETWORK_TX_PARAMS_CYCLE_INTERVAL),
+      storeMulti: env.ALGO_STORE_MULTI === 'true'
     },
     apps: {
       pricecasterAppId: Number(env.APPS_PRICECASTER_APPID),
+      budgetPadAppId: env.APPS_BUDGETPAD_APPID ? Number(env.APPS_BUDGETPAD_APPID) : undefined,
       ownerMnemonic: env.APPS_OWNER_KEY_MNEMO
     },
     debug: {
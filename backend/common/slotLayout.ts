@@ -19,7 +19,7 @@
  */
 
 import { IAppSettings } from './settings'
-import PricecasterLib, { PRICECASTER_CI } from '../../lib/pricecaster'
+import PricecasterLib, { PRICECASTER_CI, BUDGETPAD_CI } from '../../lib/pricecaster'
 import algosdk, { Account } from 'algosdk'
 import { SlotInfo } from './basetypes'
 import * as Logger from '@randlabs/js-logger'
@@ -49,17 +49,21 @@ async function askCriticalStep (s: string) {
 export class SlotLayout {
   private pclib: PricecasterLib
   private fetcher!: PythPriceServiceFetcher
+  private asaIndex = false
   constructor (readonly algodClient: algosdk.Algodv2,
     readonly ownerAccount: Account,
     readonly settings: IAppSettings,
     readonly pcDatabase: PricecasterDatabase) {
     this.pclib = new PricecasterLib(algodClient, this.ownerAccount.addr)
     this.pclib.setAppId(PRICECASTER_CI, this.settings.apps.pricecasterAppId)
+    this.pclib.setAppId(BUDGETPAD_CI, this.settings.apps.budgetPadAppId ?? 0)
   }
 
   async init (): Promise<boolean> {
     let ok = true
     try {
+      this.asaIndex = await this.pclib.readAsaIndexEnabled()
+      this.pclib.setSlotLayout(await this.pclib.readSlotLayout(), await this.pclib.readSlotFormat(), this.asaIndex)
       if (process.env.BOOTSTRAPDB === '1') {
         await askCriticalStep('\nThis will clear contract onchain state and database!')
         Logger.warn('Bootstrapping process starting')
@@ -96,7 +100,8 @@ export class SlotLayout {
   private async resetContractSlots () {
     Logger.warn('Resetting contract.')
     const txParams = await this.algodClient.getTransactionParams().do()
-    txParams.fee = 2000
+    txParams.flatFee = true
+    txParams.fee = this.pclib.resetFee((await this.pclib.readSystemSlot()).entryCount)
     const tx = this.pclib.makeResetTx(this.ownerAccount.addr, txParams)
     const { txId } = await this.algodClient.sendRawTransaction(tx.signTxn(this.ownerAccount.sk)).do()
     await this.pclib.waitForTransactionResponse(txId)
@@ -120,9 +125,9 @@ export class SlotLayout {
     if (!layout) {
       throw new Error(`There is no slot layout available for network '${this.settings.network}'`)
     }
-    for (const e of layout) {
-      const slotId = await this.allocSlot(e.asaId, e.priceId)
-      Logger.info(`Added slot ${slotId} for ASA ID: ${e.asaId}, PriceId: ${e.priceId}`)
+    const slotIds = await this.allocSlots(layout)
+    for (const [i, e] of layout.entries()) {
+      Logger.info(`Added slot ${slotIds[i]} for ASA ID: ${e.asaId}, PriceId: ${e.priceId}`)
     }
     Logger.info('Bootstrapped slot layout')
   }
@@ -168,21 +173,55 @@ export class SlotLayout {
    */
   async allocSlot (asaId: number, priceId: string): Promise<number> {
     const txParams = await this.algodClient.getTransactionParams().do()
-    const tx = this.pclib.makeAllocSlotTx(this.ownerAccount.addr, asaId, txParams)
+    const [nextSlot] = await this.pclib.nextAllocSlots(1)
+    const tx = this.pclib.makeAllocSlotTx(this.ownerAccount.addr, asaId, txParams, nextSlot)
     const { txId } = await this.algodClient.sendRawTransaction(tx.signTxn(this.ownerAccount.sk)).do()
     const txResponse = await this.pclib.waitForTransactionResponse(txId)
 
     // Extract from log
-    const slotId = Number(txResponse.logs[0].readBigUInt64BE('ALLOC@'.length))
+    const [slotId] = this.pclib.parseAllocLog(txResponse.logs)
     this.pcDatabase.addSlotLayoutEntry(slotId, priceId, asaId)
     return slotId
   }
 
   /**
-   * Ensures that the database and contract slot layouts are consistent.
+   * Allocates contract price slots for several assets, as many per call as fit, and updates internal structure
+   */
+  async allocSlots (entries: SlotInfo[]): Promise<number[]> {
+    const priceIds = new Map(entries.map(e => [e.asaId, e.priceId]))
+    const slotIds = []
+    for (const batch of await this.pclib.planAllocBatches(entries.map(e => e.asaId))) {
+      const txParams = await this.algodClient.getTransactionParams().do()
+      txParams.flatFee = true
+      txParams.fee = this.pclib.allocManyFee(batch.asaids.length)
+      const tx = this.pclib.makeAllocManySlotsTx(this.ownerAccount.addr, batch.asaids, txParams, batch.slots)
+      const { txId } = await this.algodClient.sendRawTransaction(tx.signTxn(this.ownerAccount.sk)).do()
+      const txResponse = await this.pclib.waitForTransactionResponse(txId)
+
+      for (const [i, slotId] of this.pclib.parseAllocLog(txResponse.logs).entries()) {
+        this.pcDatabase.addSlotLayoutEntry(slotId, priceIds.get(batch.asaids[i])!, batch.asaids[i])
+        slotIds.push(slotId)
+      }
+    }
+    return slotIds
+  }
+
+  /**
+   * Ensures that the database and contract slot layouts are consistent.  With the ASA index, store
+   * looks slots up onchain, so only the database ASA IDs must be allocated.
    */
   private async preflightConsistencyCheck (): Promise<boolean> {
     Logger.info('Pre-flight consistency check running')
+    if (this.asaIndex) {
+      const indexed = new Set((await this.pclib.fetchAsaIndex()).map(e => e.asaid))
+      for (const row of this.pcDatabase.getSlotLayoutRowIterator()) {
+        if (!indexed.has(row.AsaId)) {
+          Logger.error(`Database ASA ${row.AsaId} has no slot in the Pricecaster ASA index`)
+          return false
+        }
+      }
+      return true
+    }
     const sysSlot = await this.pclib.readSystemSlot()
     const rowCount = this.pcDatabase.getSlotLayoutRowCount()
     Logger.info(`Pricecaster onchain entry count: ${sysSlot.entryCount}, database count: ${rowCount}`)
@@ -18,14 +18,14 @@
  * limitations under the License.
  */
 
-import PricecasterLib, { PRICECASTER_CI, PriceSlotData } from '../../lib/pricecaster'
+import PricecasterLib, { PRICECASTER_CI, GlobalStateSnapshot } from '../../lib/pricecaster'
 import algosdk, { Account } from 'algosdk'
 import * as Logger from '@randlabs/js-logger'
 
 export class GlobalStateCache {
   private lastRound: number
   private running: boolean = false
-  private cached: PriceSlotData[] | undefined
+  private cached: GlobalStateSnapshot | undefined
   private pclib: PricecasterLib
   constructor (readonly algodClient: algosdk.Algodv2, owner: Account, readonly appId: number) {
     this.lastRound = 0
@@ -59,10 +59,11 @@ export class GlobalStateCache {
   }
 
   public async update () {
-    this.cached = await this.pclib.readParseGlobalState()
+    // Only the slots changed since the cached snapshot are parsed again.
+    this.cached = await this.pclib.readParseGlobalStateChanges(this.cached)
   }
 
   public read () {
-    return this.cached
+    return this.cached?.slots
   }
 }
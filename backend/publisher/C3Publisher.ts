@@ -25,10 +25,17 @@ import algosdk, { Account, Algodv2, assignGroupID, SuggestedParams } from 'algos
 import { getPriceIdsInVaa } from '../common/pythPayload'
 import { getWormholeCoreAppId, IAppSettings } from '../common/settings'
 import { SlotLayout } from '../common/slotLayout'
-import PricecasterLib, { PRICECASTER_CI, AsaIdSlot } from '../../lib/pricecaster'
+import PricecasterLib, { PRICECASTER_CI, BUDGETPAD_CI, AsaIdSlot, StoreBatch, MAX_APP_ARGS, MAX_APP_ARGS_SIZE } from '../../lib/pricecaster'
 import { IPublisher } from './IPublisher'
 import { Statistics } from 'backend/engine/Stats'
 
+const MAX_GROUP_SIZE = 16
+
+/**
+ * A VAA ready to publish: its verification transactions and the store arguments.
+ */
+type PreparedVaa = { txs: TransactionSignerPair[], batch: StoreBatch }
+
 export class PricecasterPublisher implements IPublisher {
   private active: boolean
   private algodClient: algosdk.Algodv2
@@ -46,12 +53,14 @@ export class PricecasterPublisher implements IPublisher {
     this.pclib.enableDumpFailedTx(this.settings.algo.dumpFailedTx)
     this.pclib.setDumpFailedTxDirectory(this.settings.algo.dumpFailedTxDirectory ?? '/.')
     this.pclib.setAppId(PRICECASTER_CI, this.settings.apps.pricecasterAppId)
+    this.pclib.setAppId(BUDGETPAD_CI, this.settings.apps.budgetPadAppId ?? 0)
     this.active = false
     this.cyclesToNextTxParamsUpdate = 0
   }
 
   async start () {
     this.active = true
+    this.pclib.setSlotLayout(await this.pclib.readSlotLayout(), await this.pclib.readSlotFormat(), await this.pclib.readAsaIndexEnabled())
     const ssi = await this.pclib.readSystemSlot()
     this.testModeFlag = (ssi.flags & 128) !== 0
     if (this.testModeFlag) {
@@ -77,8 +86,15 @@ export class PricecasterPublisher implements IPublisher {
       this.txParams.lastRound++
     }
     const publishCalls: Promise<any>[] = []
-    for (const vaa of vaaList) {
-      publishCalls.push(this.submit(this.txParams, vaa))
+    if (this.settings.algo.storeMulti) {
+      const prepared = await Promise.all(vaaList.map(vaa => this.prepare(vaa)))
+      for (const group of this.packGroups(prepared)) {
+        publishCalls.push(this.submitGroup(this.txParams, group))
+      }
+    } else {
+      for (const vaa of vaaList) {
+        publishCalls.push(this.submit(this.txParams, vaa))
+      }
     }
 
     const pricesPublish = await Promise.allSettled(publishCalls)
@@ -112,14 +128,13 @@ export class PricecasterPublisher implements IPublisher {
   }
 
   /**
-   * Submit the prices using the VAA.
+   * Build the verification transactions and store arguments of a VAA.
    */
-  async submit (txParams: SuggestedParams, vaa: Uint8Array): Promise<any> {
+  async prepare (vaa: Uint8Array): Promise<PreparedVaa> {
     const vaaParsed = parseVaa(vaa)
     const priceIdsInVaa = getPriceIdsInVaa(vaaParsed.payload)
     const asaIdSlots = this.buildAsaIdSlots(priceIdsInVaa)
     const txs: TransactionSignerPair[] = []
-    const signedGroupedTxns: Uint8Array[] = []
 
     if (!this.testModeFlag) {
       const submitVaaState = await submitVAAHeader(this.algodClient, BigInt(getWormholeCoreAppId(this.settings)),
@@ -128,20 +143,62 @@ export class PricecasterPublisher implements IPublisher {
       txs.push(...submitVaaState.txs)
     }
 
-    txParams.fee = 2000 * (priceIdsInVaa.length - 1)
-    const tx = this.pclib.makePriceStoreTx(this.senderAccount.addr,
-      asaIdSlots,
-      vaaParsed.payload,
-      txParams)
+    return { txs, batch: { asaIdSlots, payload: vaaParsed.payload } }
+  }
+
+  /**
+   * Pack prepared VAAs, in order, into as few groups as the group size and the storemulti
+   * argument limits allow.
+   */
+  packGroups (prepared: PreparedVaa[]): PreparedVaa[][] {
+    const groups: PreparedVaa[][] = []
+    let group: PreparedVaa[] = []
+    let groupSize = 1
+    for (const p of prepared) {
+      const batches = [...group, p].map(g => g.batch)
+      if (group.length > 0 && (groupSize + p.txs.length > MAX_GROUP_SIZE ||
+          1 + 2 * batches.length > MAX_APP_ARGS ||
+          this.pclib.storeMultiArgsSize(batches) > MAX_APP_ARGS_SIZE)) {
+        groups.push(group)
+        group = []
+        groupSize = 1
+      }
+      group.push(p)
+      groupSize += p.txs.length
+    }
+    if (group.length > 0) {
+      groups.push(group)
+    }
+    return groups
+  }
+
+  /**
+   * Submit the prices using the VAA.
+   */
+  async submit (txParams: SuggestedParams, vaa: Uint8Array): Promise<any> {
+    return this.submitGroup(txParams, [await this.prepare(vaa)])
+  }
+
+  /**
+   * Submit the prices of several prepared VAAs in one group: the verification transactions of
+   * each VAA, then a single store call, or storemulti call for more than one VAA.
+   */
+  async submitGroup (txParams: SuggestedParams, group: PreparedVaa[]): Promise<any> {
+    const txs: TransactionSignerPair[] = group.flatMap(p => p.txs)
+    const batches = group.map(p => p.batch)
+
+    // Budget is topped up on demand per published attestation, so ignored entries need no fee.
+    const published = batches.reduce((n, batch) => n + batch.asaIdSlots.filter(v => v.asaid !== -1).length, 0)
+    txParams.fee = this.pclib.storeFee(published)
+    const tx = batches.length === 1
+      ? this.pclib.makePriceStoreTx(this.senderAccount.addr, batches[0].asaIdSlots, batches[0].payload, txParams)
+      : this.pclib.makePriceStoreMultiTx(this.senderAccount.addr, batches, txParams)
 
     txs.push({ tx, signer: null })
 
     assignGroupID(txs.map((tx) => tx.tx))
     const signedTxns = await sign(txs, this.senderAccount)
-
-    signedGroupedTxns.push(...signedTxns)
-    const txReq = this.algodClient.sendRawTransaction(signedGroupedTxns).do()
-    return txReq
+    return this.algodClient.sendRawTransaction(signedTxns).do()
   }
 }
 
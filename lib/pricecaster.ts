@@ -64,6 +64,28 @@ export const PRICECASTER_CI: ContractInfo = {
   appId: 0
 }
 
+// Budget pad Contract Info. Set its appId before creating or calling a Pricecaster
+// built with the "pad" budget pool, so calls carry it in their foreign apps array.
+export const BUDGETPAD_CI: ContractInfo = {
+  schema: {
+    globalInts: 0,
+    globalBytes: 0,
+    localInts: 0,
+    localBytes: 0
+  },
+  approvalProgramFile: 'teal/build/budgetpad-approval.teal',
+  clearStateProgramFile: 'teal/build/budgetpad-clear.teal',
+  compiledApproval: {
+    bytes: new Uint8Array(),
+    hash: ''
+  },
+  compiledClearState: {
+    bytes: new Uint8Array(),
+    hash: ''
+  },
+  appId: 0
+}
+
 // Mapper Contract Info
 export const MAPPER_CI: ContractInfo = {
   schema: {
@@ -97,15 +119,214 @@ export type PriceSlotData = {
   pubTime: bigint,
   prevPubTime: bigint,
   prevPrice: bigint,
-  prevConf: bigint
+  prevConf: bigint,
+  decimals: number
 }
 
 export type AsaIdSlot = { asaid: number, slot: number }
-export type SystemSlotInfo = { entryCount: number, flags: number }
+export type StoreBatch = { asaIdSlots: AsaIdSlot[], payload: Buffer }
+export type SystemSlotInfo = { entryCount: number, flags: number, deviationBps: number, heartbeat: number, updateSeq: bigint, freeListHead: number, merkleRoot: Buffer }
+export type AllocBatch = { asaids: number[], slots: number[] }
+export type GlobalStateSnapshot = { updateSeq: bigint, slots: PriceSlotData[] }
+export type DeviationConfig = { thresholdBps: number, heartbeat: number }
+export type PriceUpdate = { slot: number, asaId: number, normalizedPrice: bigint, pubTime: bigint }
+export type ProofUpdate = { priceId: string, message: Buffer, proof: Buffer[] }
+export type AsaAlias = { asaid: number, canonicalAsaId: number, slot: number, decimals: number }
+
+const GLOBAL_PAGE_SIZE = 127
+const GLOBAL_NUM_PAGES = 63
+const LAYOUT_ID_OFFSET = GLOBAL_PAGE_SIZE * GLOBAL_NUM_PAGES - 1
+
+/**
+ * Largest number of attestations a single store call accepts (MAX_ATTESTATIONS in pricecaster-v2.py),
+ * bound by the 2048-byte application arguments limit.
+ */
+export const MAX_STORE_ATTESTATIONS = 12
+
+/**
+ * Largest number of ASAs a single allocmany call accepts (MAX_ALLOC_BATCH in pricecaster-v2.py). The ASAs
+ * (but ALGO), budget pad application and boxes referenced by a call are limited to MAX_APP_TOTAL_REFERENCES.
+ */
+export const MAX_ALLOC_BATCH = 8
+export const MAX_APP_TOTAL_REFERENCES = 8
+
+/**
+ * Application call arguments limits: a storemulti call takes two arguments per payload,
+ * and all arguments share the total size limit.
+ */
+export const MAX_APP_ARGS = 16
+export const MAX_APP_ARGS_SIZE = 2048
+
+/**
+ * Slot layout the contract was compiled with (pricecaster-v2.py --layout).
+ * The layout id is stored in the low nibble of the last byte of the global space.
+ */
+export enum SlotLayout {
+  Linear = 0,
+  Aligned = 1,
+  Box = 2
+}
+
+/**
+ * Price slot format the contract was compiled with (pricecaster-v2.py --slot-format),
+ * stored in bits 4..6 of the layout id byte.
+ */
+export enum SlotFormat {
+  Full = 0,
+  Compact = 1
+}
+
+const SLOT_SIZE = { [SlotFormat.Full]: 93, [SlotFormat.Compact]: 78 }
+
+/**
+ * Largest number of slots a getmany call returns, bound by the 1024-byte total log size.
+ */
+export const MAX_GET_SLOTS = maxGetSlots(SlotFormat.Full)
+
+export function maxGetSlots (format: SlotFormat): number {
+  return Math.floor(1024 / SLOT_SIZE[format])
+}
+
+/**
+ * Box layout: slots per box (each box fits the 1024-byte I/O quota of one box reference),
+ * and offset of the 64-bit entry count in the system slot.
+ */
+function boxSlots (format: SlotFormat): number {
+  return Math.floor(1024 / SLOT_SIZE[format])
+}
+const BOX_ENTRY_COUNT_OFFSET = 2
+
+/**
+ * ASA index (pricecaster-v2.py --asa-index): the allocated slots sorted by ASA ID in the "idx" box,
+ * as (ASA ID, slot) entries followed by the uint16 entry count in the last two bytes of the box.
+ * Store then takes ASA IDs only. Bit 7 of the layout id byte is set.
+ */
+const ASA_INDEX_FLAG = 0x80
+const ASA_INDEX_BOX_NAME = new Uint8Array(Buffer.from('idx'))
+
+/**
+ * Update record logged by each store and storemulti call: the "PCU" tag and the format version,
+ * then a (slot uint16, ASA ID, normalized price, publish time) entry for each slot written.
+ */
+const UPDATE_LOG_TAG = Buffer.from('PCU')
+export const UPDATE_LOG_VERSION = 1
+const UPDATE_LOG_HEADER_SIZE = 4
+const UPDATE_LOG_ENTRY_SIZE = 26
+
+/**
+ * Configuration flags.  With FLAG_DEVIATION set, store rewrites a slot only when the price or confidence
+ * moved more than the deviation threshold (basis points), or the heartbeat interval (seconds) elapsed.
+ * Both are kept in the system slot at the offsets below.
+ */
+export const FLAG_DEVIATION = 0x01
+const SYS_DEVIATION_BPS_OFFSET = 10
+const SYS_HEARTBEAT_OFFSET = 12
+
+/**
+ * Change tracking: the update sequence number counts the calls that wrote price slots, and change
+ * table entry (slot mod CHANGE_TABLE_SIZE) holds the low byte of the sequence number of the last
+ * call that wrote one of its slots.
+ */
+const SYS_UPDATE_SEQ_OFFSET = 16
+const SYS_CHANGE_TABLE_OFFSET = 24
+const CHANGE_TABLE_SIZE = 32
+
+/**
+ * Free list: freed slots are reused by alloc, last freed first. The system slot holds the last freed slot plus
+ * one (0 if none), and each freed slot the next one, the same way, in the two bytes after its ASA ID.
+ */
+const SYS_FREE_LIST_OFFSET = 56
+const FREE_LINK_OFFSET = 8
+const ALLOC_LOG_TAG = Buffer.from('ALLOC@')
+
+/**
+ * Pyth accumulator updates: setroot keeps the Merkle root carried by a verified VAA in the system slot, and
+ * storeproofs publishes price messages, each with its proof, a list of 20-byte node hashes.  The opcode cost of
+ * an update grows with the proof nodes hashed, each a keccak256.
+ */
+const SYS_MERKLE_ROOT_OFFSET = 58
+const MERKLE_HASH_SIZE = 20
+const MERKLE_LEVEL_COST = 170
+const PUBLISH_COST = 450
+const OPCODE_BUDGET_PER_CALL = 700
+
+/**
+ * Opcode budget store and storemulti top up before each published attestation (ATTESTATION_BUDGET in
+ * pricecaster-v2.py), and for its slot lookup with the ASA index (INDEX_SEARCH_BUDGET).
+ */
+const ATTESTATION_BUDGET = 550
+const INDEX_SEARCH_BUDGET = 200
+
+/**
+ * ASA aliases: an ASA tracking the same feed as an allocated ASA reads the slot of that canonical ASA, with its own
+ * decimals, instead of taking a slot.  The "als" box holds (ASA ID, canonical ASA ID, slot uint16, decimals uint8)
+ * entries in no particular order, followed by the uint16 entry count in the last two bytes.
+ */
+const ALIAS_BOX_NAME = new Uint8Array(Buffer.from('als'))
+const ALIAS_ENTRY_SIZE = 19
+export const MAX_ALIASES = 53
+const ALIAS_ENTRY_COST = 20
+const ALIAS_COST = 200
+const PICO_DOLLARS_DECIMALS = 12
+
+/**
+ * @returns The name of the box holding a slot (box layout).
+ */
+export function slotBoxName (slot: number, format: SlotFormat = SlotFormat.Full): Uint8Array {
+  return algosdk.encodeUint64(Math.floor(slot / boxSlots(format))).slice(6)
+}
+
+function slotLayoutOf (globalSpace: Buffer): SlotLayout {
+  return (globalSpace.readUInt8(LAYOUT_ID_OFFSET) & 0x0f) as SlotLayout
+}
+
+function slotFormatOf (globalSpace: Buffer): SlotFormat {
+  return ((globalSpace.readUInt8(LAYOUT_ID_OFFSET) >> 4) & 0x07) as SlotFormat
+}
 
-const GLOBAL_SLOT_SIZE = 92
-const SYSTEM_SLOT_INDEX = 85
-const NUM_SLOTS = 86
+function asaIndexOf (globalSpace: Buffer): boolean {
+  return (globalSpace.readUInt8(LAYOUT_ID_OFFSET) & ASA_INDEX_FLAG) !== 0
+}
+
+/**
+ * @returns Size of the slot index in the store tuples and the ASA index entries.
+ */
+function slotIndexSize (layout: SlotLayout): number {
+  return layout === SlotLayout.Box ? 2 : 1
+}
+
+/**
+ * @returns Total number of slots for a layout and format, including the system slot.
+ */
+function numSlots (layout: SlotLayout, format: SlotFormat): number {
+  if (layout === SlotLayout.Aligned) {
+    return GLOBAL_NUM_PAGES * Math.floor(GLOBAL_PAGE_SIZE / SLOT_SIZE[format])
+  }
+  return Math.floor(GLOBAL_NUM_PAGES * GLOBAL_PAGE_SIZE / SLOT_SIZE[format])
+}
+
+function slotOffset (layout: SlotLayout, format: SlotFormat, slot: number): number {
+  if (layout === SlotLayout.Aligned) {
+    const slotsPerPage = Math.floor(GLOBAL_PAGE_SIZE / SLOT_SIZE[format])
+    return Math.floor(slot / slotsPerPage) * GLOBAL_PAGE_SIZE + (slot % slotsPerPage) * SLOT_SIZE[format]
+  }
+  return slot * SLOT_SIZE[format]
+}
+
+function sliceSystemSlot (globalSpace: Buffer): Buffer {
+  const layout = slotLayoutOf(globalSpace)
+  const format = slotFormatOf(globalSpace)
+  if (layout === SlotLayout.Box) {
+    return globalSpace.subarray(0, SLOT_SIZE[format])
+  }
+  return sliceSlot(globalSpace, numSlots(layout, format) - 1)
+}
+
+function sliceSlot (globalSpace: Buffer, slot: number): Buffer {
+  const format = slotFormatOf(globalSpace)
+  const offset = slotOffset(slotLayoutOf(globalSpace), format, slot)
+  return globalSpace.subarray(offset, offset + SLOT_SIZE[format])
+}
 
 // --------------------------------------------------------------------------------------
 type SignCallback = (arg0: string, arg1: algosdk.Transaction) => any
@@ -116,6 +337,9 @@ export default class PricecasterLib {
   private minFee: number
   private dumpFailedTx: boolean
   private dumpFailedTxDirectory: string
+  private slotLayout: SlotLayout
+  private slotFormat: SlotFormat
+  private asaIndex: boolean
 
   constructor (algodClient: algosdk.Algodv2, ownerAddr: string) {
     this.algodClient = algodClient
@@ -123,6 +347,20 @@ export default class PricecasterLib {
     this.minFee = 1000
     this.dumpFailedTx = false
     this.dumpFailedTxDirectory = './'
+    this.slotLayout = SlotLayout.Linear
+    this.slotFormat = SlotFormat.Full
+    this.asaIndex = false
+  }
+
+  /**
+   * Set the slot layout and format of the deployed contract, and whether it was built with the ASA index,
+   * used to build store and alloc transactions. Get them with readSlotLayout(), readSlotFormat() and
+   * readAsaIndexEnabled().
+   */
+  setSlotLayout (layout: SlotLayout, format: SlotFormat = SlotFormat.Full, asaIndex = false) {
+    this.slotLayout = layout
+    this.slotFormat = format
+    this.asaIndex = asaIndex
   }
 
   /** Set the file dumping feature on failed group transactions
@@ -314,6 +552,7 @@ export default class PricecasterLib {
      * @param  {String} sender account used to sign the createApp transaction
      * @param  {Function} signCallback callback with prototype signCallback(sender, tx) used to sign transactions
      * @param  {Tuple[]} tmplReplace Array of tuples specifying template replacements in output TEAL.
+     * @param  {number[]} foreignApps Applications to make available to the creation call.
      * @return {String} transaction id of the created application
      */
   async createApp (sender: string,
@@ -322,7 +561,8 @@ export default class PricecasterLib {
     signCallback: SignCallback,
     tmplReplace: [string, string][] = [],
     skipCompile?: any,
-    fee?: number): Promise<string> {
+    fee?: number,
+    foreignApps?: number[]): Promise<string> {
     const onComplete = algosdk.OnApplicationComplete.NoOpOC
 
     // get node suggested parameters
@@ -335,6 +575,10 @@ export default class PricecasterLib {
       await this.compileClearProgram(pcci)
     }
 
+    // Programs over 2048 bytes need extra pages
+    const programSize = pcci.compiledApproval.bytes.length + pcci.compiledClearState.bytes.length
+    const extraPages = Math.ceil(programSize / 2048) - 1
+
     // create unsigned transaction
     const txApp = algosdk.makeApplicationCreateTxn(
       sender, params, onComplete,
@@ -343,7 +587,10 @@ export default class PricecasterLib {
       pcci.schema.localInts,
       pcci.schema.localBytes,
       pcci.schema.globalInts,
-      pcci.schema.globalBytes, appArgs
+      pcci.schema.globalBytes, appArgs,
+      undefined, foreignApps,
+      undefined, undefined, undefined, undefined,
+      extraPages
     )
     const txId = txApp.txID().toString()
 
@@ -364,7 +611,25 @@ export default class PricecasterLib {
        * @return {String} transaction id of the created application
        */
   async createPricecasterApp (sender: string, wormholeCore: number, testMode: boolean, signCallback: SignCallback, fee?: number): Promise<any> {
-    return this.createApp(sender, PRICECASTER_CI, [algosdk.encodeUint64(wormholeCore)], signCallback, [['TMPL_I_TESTING', testMode ? '1' : '0']], undefined, fee)
+    return this.createApp(sender, PRICECASTER_CI, [algosdk.encodeUint64(wormholeCore)], signCallback,
+      [['TMPL_I_TESTING', testMode ? '1' : '0'], ['TMPL_I_PAD_APP_ID', BUDGETPAD_CI.appId.toString()]], undefined, fee, this.budgetPadApps())
+  }
+
+  /**
+       * Create the budget pad application used by Pricecaster builds with the "pad" budget pool.
+       * @param  {String} sender account used to sign the createApp transaction
+       * @param  {Function} signCallback callback with prototype signCallback(sender, tx) used to sign transactions
+       * @return {String} transaction id of the created application
+       */
+  async createBudgetPadApp (sender: string, signCallback: SignCallback): Promise<any> {
+    return this.createApp(sender, BUDGETPAD_CI, [], signCallback)
+  }
+
+  /**
+   * @returns The foreign apps array needed by calls that pool opcode budget.
+   */
+  private budgetPadApps (): number[] | undefined {
+    return BUDGETPAD_CI.appId !== 0 ? [BUDGETPAD_CI.appId] : undefined
   }
 
   /**
@@ -503,27 +768,211 @@ export default class PricecasterLib {
   /**
    * Pricecaster.-V2: Generate store price transaction.
    *
-   * Other transaction in group must provide for 2000 uALGO fee for maximizing computation budget.
+   * The fee should cover the inner transactions for budget, see storeFee().
    * @param {*} sender The sender account (typically the VAA verification stateless program)
    * @param {*} asaIdSlots An array of objects of entries  (asaid, slot) for each attestation contained in the VAA to publish. A VAA
    *                           may contain entries that we dont want to publish, in that case the asaid member must be set to -1  (0xffff ...)
-   *                           The slot will be used to store the price and must be mantained by caller.
+   *                           The slot will be used to store the price and must be mantained by caller.  With the ASA index,
+   *                           the slot is looked up onchain and the slot member is not used.
    * @param {*} payload The VAA payload
    * @param {*} suggestedParams  The network suggested params, get with algosdk getTransactionParams call.
    */
   makePriceStoreTx (sender: string, asaIdSlots: AsaIdSlot[], payload: Buffer, suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
-    const ASAID_SLOT_SIZE = 9
     const appArgs = []
     suggestedParams.flatFee = true
 
+    if (asaIdSlots.length > MAX_STORE_ATTESTATIONS) {
+      throw new Error(`Cannot store ${asaIdSlots.length} attestations in one call, maximum is ${MAX_STORE_ATTESTATIONS}`)
+    }
+
     if (this.dumpFailedTx) {
       console.warn(`Dump failed to ${this.dumpFailedTxDirectory} unimplemented`)
     }
 
-    // Pricecaster use the ASA IDs to query for decimals data onchain, so valid ASA IDs
-    // must be added to the foreign asset array
+    appArgs.push(new Uint8Array(Buffer.from('store')), this.encodeAsaIdSlots(asaIdSlots), new Uint8Array(payload))
 
-    const assetIds: number[] = asaIdSlots.filter(v => v.asaid !== -1).map(v => v.asaid)
+    const tx = algosdk.makeApplicationNoOpTxn(sender,
+      suggestedParams,
+      PRICECASTER_CI.appId,
+      appArgs,
+      undefined,
+      this.budgetPadApps(),
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      this.indexBoxes(asaIdSlots.filter(v => v.asaid !== -1).map(v => v.slot)))
+
+    return tx
+  }
+
+  /**
+   * Pricecaster.-V2: Generate a storemulti transaction, publishing several VAA payloads in one call.
+   *
+   * Each payload must come with its own VAA verification transactions earlier in the group.  The fee
+   * rules are those of store, for the attestations of all payloads.
+   * @param {*} sender The sender account
+   * @param {*} batches The (asaIdSlots, payload) pair of each VAA to publish, see makePriceStoreTx.
+   * @param {*} suggestedParams  The network suggested params, get with algosdk getTransactionParams call.
+   */
+  makePriceStoreMultiTx (sender: string, batches: StoreBatch[], suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+    const appArgs: Uint8Array[] = [new Uint8Array(Buffer.from('storemulti'))]
+    suggestedParams.flatFee = true
+
+    if (batches.length === 0 || 1 + 2 * batches.length > MAX_APP_ARGS) {
+      throw new Error(`Cannot store ${batches.length} payloads in one call, maximum is ${Math.floor((MAX_APP_ARGS - 1) / 2)}`)
+    }
+
+    for (const batch of batches) {
+      if (batch.asaIdSlots.length > MAX_STORE_ATTESTATIONS) {
+        throw new Error(`Cannot store ${batch.asaIdSlots.length} attestations in one call, maximum is ${MAX_STORE_ATTESTATIONS}`)
+      }
+      appArgs.push(this.encodeAsaIdSlots(batch.asaIdSlots), new Uint8Array(batch.payload))
+    }
+
+    const argsSize = this.storeMultiArgsSize(batches)
+    if (argsSize > MAX_APP_ARGS_SIZE) {
+      throw new Error(`Cannot store payloads of ${argsSize} argument bytes in one call, maximum is ${MAX_APP_ARGS_SIZE}`)
+    }
+
+    const slots = batches.flatMap(batch => batch.asaIdSlots.filter(v => v.asaid !== -1).map(v => v.slot))
+    return algosdk.makeApplicationNoOpTxn(sender,
+      suggestedParams,
+      PRICECASTER_CI.appId,
+      appArgs,
+      undefined,
+      this.budgetPadApps(),
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      this.indexBoxes(slots))
+  }
+
+  /**
+   * @returns The total application arguments size of a storemulti call for the given batches.
+   */
+  storeMultiArgsSize (batches: StoreBatch[]): number {
+    return 'storemulti'.length + batches.reduce((size, batch) =>
+      size + batch.asaIdSlots.length * this.asaIdSlotSize() + batch.payload.length, 0)
+  }
+
+  /**
+   * @returns A fee covering a store or storemulti call publishing the given number of attestations, one inner
+   * transaction for budget per 700 opcodes.  Ignored entries need no more budget than the first attestation.
+   */
+  storeFee (published: number): number {
+    const budget = ATTESTATION_BUDGET + (this.asaIndex ? INDEX_SEARCH_BUDGET : 0)
+    return this.minFee * (1 + Math.ceil(Math.max(published, 1) * budget / OPCODE_BUDGET_PER_CALL))
+  }
+
+  /**
+   * Pricecaster.-V2: Generate a setroot transaction, storing the Merkle root of a Pyth accumulator update for
+   * storeproofs calls.
+   *
+   * The VAA carrying the root must be verified earlier in the group, as for store.
+   * @param {*} sender The sender account
+   * @param {*} payload The payload of the VAA carrying the root.
+   * @param {*} suggestedParams  The network suggested params, get with algosdk getTransactionParams call.
+   */
+  makeSetRootTx (sender: string, payload: Buffer, suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+    const appArgs = [new Uint8Array(Buffer.from('setroot')), new Uint8Array(payload)]
+    return algosdk.makeApplicationNoOpTxn(sender,
+      suggestedParams,
+      PRICECASTER_CI.appId,
+      appArgs,
+      undefined,
+      this.budgetPadApps())
+  }
+
+  /**
+   * Pricecaster.-V2: Generate a storeproofs transaction, publishing price messages of a Pyth accumulator update
+   * proven against the root stored by setroot.  No VAA verification transactions are needed.
+   *
+   * Proofs sharing nodes are cheaper to verify in a row, so updates should be in the order of the update data.
+   * @param {*} sender The sender account
+   * @param {*} asaIdSlots An array of (asaid, slot) entries, one for each update, see makePriceStoreTx.
+   * @param {*} updates The price messages to publish, with their proofs.
+   * @param {*} suggestedParams  The network suggested params, get with algosdk getTransactionParams call.  The fee
+   *                             should cover the inner transactions for budget, see storeProofsFee().
+   */
+  makeStoreProofsTx (sender: string, asaIdSlots: AsaIdSlot[], updates: ProofUpdate[], suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+    if (updates.length === 0 || updates.length > MAX_STORE_ATTESTATIONS) {
+      throw new Error(`Cannot store ${updates.length} updates in one call, maximum is ${MAX_STORE_ATTESTATIONS}`)
+    }
+    if (asaIdSlots.length !== updates.length) {
+      throw new Error(`${asaIdSlots.length} ASA ID entries given for ${updates.length} updates`)
+    }
+    const argsSize = this.storeProofsArgsSize(updates)
+    if (argsSize > MAX_APP_ARGS_SIZE) {
+      throw new Error(`Cannot store updates of ${argsSize} argument bytes in one call, maximum is ${MAX_APP_ARGS_SIZE}`)
+    }
+
+    const appArgs = [new Uint8Array(Buffer.from('storeproofs')), this.encodeAsaIdSlots(asaIdSlots), this.encodeProofUpdates(updates)]
+    return algosdk.makeApplicationNoOpTxn(sender,
+      suggestedParams,
+      PRICECASTER_CI.appId,
+      appArgs,
+      undefined,
+      this.budgetPadApps(),
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      this.indexBoxes(asaIdSlots.filter(v => v.asaid !== -1).map(v => v.slot)))
+  }
+
+  /**
+   * @returns The total application arguments size of a storeproofs call for the given updates.
+   */
+  storeProofsArgsSize (updates: ProofUpdate[]): number {
+    return 'storeproofs'.length + 1 + updates.reduce((size, update) =>
+      size + this.asaIdSlotSize() + 4 + update.message.length + update.proof.length * MERKLE_HASH_SIZE, 0)
+  }
+
+  /**
+   * @returns A fee covering a storeproofs call for the given updates, one inner transaction for budget per 700
+   * opcodes.  An update is verified where its path joins the one of the previous update: below the proof nodes
+   * they share, from the top.
+   */
+  storeProofsFee (updates: ProofUpdate[]): number {
+    let cost = 0
+    for (const [i, update] of updates.entries()) {
+      const previous = i > 0 ? updates[i - 1].proof : []
+      let levels = update.proof.length
+      if (previous.length === levels) {
+        while (levels > 0 && update.proof[levels - 1].equals(previous[levels - 1])) {
+          levels--
+        }
+      }
+      cost += (levels + 1) * MERKLE_LEVEL_COST + PUBLISH_COST
+    }
+    return this.minFee * (1 + Math.ceil(cost / OPCODE_BUDGET_PER_CALL))
+  }
+
+  private encodeProofUpdates (updates: ProofUpdate[]): Uint8Array {
+    const encoded = [Buffer.from([updates.length])]
+    for (const update of updates) {
+      const messageSize = Buffer.alloc(2)
+      messageSize.writeUInt16BE(update.message.length)
+      encoded.push(messageSize, update.message, Buffer.from([update.proof.length]), ...update.proof)
+    }
+    return new Uint8Array(Buffer.concat(encoded))
+  }
+
+  private asaIdSlotSize (): number {
+    if (this.asaIndex) {
+      return 8
+    }
+    return 8 + slotIndexSize(this.slotLayout)
+  }
+
+  /**
+   * @returns The (ASA ID, slot) tuple array argument of the store methods, an ASA ID array with the ASA index.
+   */
+  private encodeAsaIdSlots (asaIdSlots: AsaIdSlot[]): Uint8Array {
+    const SLOT_INDEX_SIZE = this.asaIdSlotSize() - 8
+    const ASAID_SLOT_SIZE = this.asaIdSlotSize()
     const encodedAsaIdSlots = new Uint8Array(ASAID_SLOT_SIZE * asaIdSlots.length)
 
     const IGNORE_ASA = Buffer.from('FFFFFFFFFFFFFFFF', 'hex')
@@ -531,12 +980,52 @@ export default class PricecasterLib {
     for (let i = 0; i < asaIdSlots.length; ++i) {
       const buf = Buffer.concat([
         (asaIdSlots[i].asaid !== -1) ? algosdk.encodeUint64(asaIdSlots[i].asaid) : IGNORE_ASA,
-        algosdk.encodeUint64(asaIdSlots[i].slot).slice(7)
+        algosdk.encodeUint64(asaIdSlots[i].slot).slice(8 - SLOT_INDEX_SIZE)
       ])
       encodedAsaIdSlots.set(buf, i * ASAID_SLOT_SIZE)
     }
 
-    appArgs.push(new Uint8Array(Buffer.from('store')), encodedAsaIdSlots, new Uint8Array(payload))
+    return encodedAsaIdSlots
+  }
+
+  /**
+   * @returns The box references needed to access the given slots, with the box layout.
+   */
+  private slotBoxes (slots: number[]): algosdk.BoxReference[] | undefined {
+    if (this.slotLayout !== SlotLayout.Box) {
+      return undefined
+    }
+    const slotByBox = new Map(slots.map(slot => [Math.floor(slot / boxSlots(this.slotFormat)), slot]))
+    return [...slotByBox.values()].map(slot => { return { appIndex: PRICECASTER_CI.appId, name: slotBoxName(slot, this.slotFormat) } })
+  }
+
+  /**
+   * @returns The box references of a call that reads or writes the ASA index, if built with it, and accesses the given slots.
+   */
+  private indexBoxes (slots: number[]): algosdk.BoxReference[] | undefined {
+    if (!this.asaIndex) {
+      return this.slotBoxes(slots)
+    }
+    return [{ appIndex: PRICECASTER_CI.appId, name: ASA_INDEX_BOX_NAME }, ...(this.slotBoxes(slots) ?? [])]
+  }
+
+  /**
+   * Allocates a new price slot.
+   *
+   * @param sender The sender account.
+   * @param asaid The ASA ID to be assigned to the new slot.
+   * @param suggestedParams  The transaction params.
+   * @param slot With the box layout, the slot that will be allocated (see nextAllocSlots()), so its box is referenced.
+   *             The application account must hold the minimum balance for a box created by this call, as for the
+   *             ASA index box, created with the first slot.
+   * @returns
+   */
+  makeAllocSlotTx (sender: string, asaid: number, suggestedParams: algosdk.SuggestedParams, slot?: number): algosdk.Transaction {
+    const appArgs = []
+    appArgs.push(new Uint8Array(Buffer.from('alloc')), algosdk.encodeUint64(asaid))
+
+    // Pricecaster reads the ASA decimals onchain at allocation, so the ASA must be
+    // added to the foreign asset array (except ALGO, id 0).
 
     const tx = algosdk.makeApplicationNoOpTxn(sender,
       suggestedParams,
@@ -544,62 +1033,254 @@ export default class PricecasterLib {
       appArgs,
       undefined,
       undefined,
-      assetIds)
+      asaid !== 0 ? [asaid] : undefined,
+      undefined,
+      undefined,
+      undefined,
+      this.indexBoxes(slot !== undefined ? [slot] : []))
 
     return tx
   }
 
   /**
-   * Allocates a new price slot.
+   * Allocates a price slot for each of several ASAs in one call. The slots are returned in one log, see parseAllocLog().
    *
    * @param sender The sender account.
-   * @param asaid The ASA ID to be assigned to the new slot.
-   * @param suggestedParams  The transaction params.
+   * @param asaids The ASA IDs, at most MAX_ALLOC_BATCH. See planAllocBatches() to split a larger set.
+   * @param suggestedParams  The transaction params. The fee should cover the inner transactions for budget, see allocManyFee().
+   * @param slots With the box layout, the slots that will be allocated (see nextAllocSlots()), so their boxes are referenced.
    * @returns
    */
-  makeAllocSlotTx (sender: string, asaid: number, suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+  makeAllocManySlotsTx (sender: string, asaids: number[], suggestedParams: algosdk.SuggestedParams, slots?: number[]): algosdk.Transaction {
+    if (asaids.length === 0 || asaids.length > MAX_ALLOC_BATCH) {
+      throw new Error(`Cannot allocate ${asaids.length} slots in one call, maximum is ${MAX_ALLOC_BATCH}`)
+    }
+
     const appArgs = []
-    appArgs.push(new Uint8Array(Buffer.from('alloc')), algosdk.encodeUint64(asaid))
+    appArgs.push(new Uint8Array(Buffer.from('allocmany')), Buffer.concat(asaids.map(asaid => algosdk.encodeUint64(asaid))))
 
     const tx = algosdk.makeApplicationNoOpTxn(sender,
       suggestedParams,
       PRICECASTER_CI.appId,
-      appArgs)
+      appArgs,
+      undefined,
+      this.budgetPadApps(),
+      [...new Set(asaids.filter(asaid => asaid !== 0))],
+      undefined,
+      undefined,
+      undefined,
+      this.indexBoxes(slots ?? []))
 
     return tx
   }
 
   /**
-   * Resets the contract to zero.
+   * @returns A fee covering an allocmany call for the given number of ASAs, one inner transaction for budget
+   * per 3 ASAs.
+   */
+  allocManyFee (count: number): number {
+    return this.minFee * (1 + Math.ceil(count / 3))
+  }
+
+  /**
+   * @returns The slots the next allocations take, in order: the freed slots, last freed first, then new slots
+   * from the entry count on.
+   */
+  async nextAllocSlots (count: number): Promise<number[]> {
+    const slots = (await this.readFreeSlots()).slice(0, count)
+    const entryCount = (await this.readSystemSlot()).entryCount
+    return [...slots, ...[...Array(count - slots.length).keys()].map(i => entryCount + i)]
+  }
+
+  /**
+   * Split a set of ASAs in allocmany calls, each within MAX_ALLOC_BATCH and the references of a call:
+   * the ASAs but ALGO, the budget pad application and the boxes of the slots taken (box layout and ASA index).
+   * @returns The ASA IDs of each call, in order, and the slots they will take.
+   */
+  async planAllocBatches (asaids: number[]): Promise<AllocBatch[]> {
+    const slots = await this.nextAllocSlots(asaids.length)
+    const references = (batch: AllocBatch) => new Set(batch.asaids.filter(asaid => asaid !== 0)).size +
+      (this.budgetPadApps() ?? []).length + (this.indexBoxes(batch.slots) ?? []).length
+
+    const batches: AllocBatch[] = []
+    for (const [i, asaid] of asaids.entries()) {
+      const last = batches[batches.length - 1]
+      const grown = last && { asaids: [...last.asaids, asaid], slots: [...last.slots, slots[i]] }
+      if (grown && grown.asaids.length <= MAX_ALLOC_BATCH && references(grown) <= MAX_APP_TOTAL_REFERENCES) {
+        batches[batches.length - 1] = grown
+      } else {
+        batches.push({ asaids: [asaid], slots: [slots[i]] })
+      }
+    }
+    return batches
+  }
+
+  /**
+   * Parse the slots allocated by an alloc or allocmany transaction.
+   * @param logs The transaction logs.
+   * @returns The slots, in argument order.
+   */
+  parseAllocLog (logs: Buffer[]): number[] {
+    const log = logs.find(l => l.subarray(0, ALLOC_LOG_TAG.length).equals(ALLOC_LOG_TAG))
+    if (log === undefined) {
+      return []
+    }
+    const slots = []
+    for (let offset = ALLOC_LOG_TAG.length; offset + 8 <= log.length; offset += 8) {
+      slots.push(Number(log.readBigUInt64BE(offset)))
+    }
+    return slots
+  }
+
+  /**
+   * Frees the allocated slots, zeroing them.
    *
    * @param sender The sender account.
-   * @param suggestedParams  The transaction params.
+   * @param suggestedParams  The transaction params. The fee should cover the inner transactions for budget,
+   *                         see resetFee().
+   * @param first The first slot to free, 0 if not given. Slots from it up to the entry count are freed,
+   *              and the entry count is set to it.
+   * @param freeSlots With the box layout and a first slot, the slots in the free list (see readFreeSlots()), which
+   *                  are relinked, so their boxes are referenced.
    * @returns
    */
-  makeResetTx (sender: string, suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+  makeResetTx (sender: string, suggestedParams: algosdk.SuggestedParams, first?: number, freeSlots?: number[]): algosdk.Transaction {
     const appArgs = []
     appArgs.push(new Uint8Array(Buffer.from('reset')))
+    if (first !== undefined) {
+      appArgs.push(algosdk.encodeUint64(first))
+    }
 
     const tx = algosdk.makeApplicationNoOpTxn(sender,
       suggestedParams,
       PRICECASTER_CI.appId,
-      appArgs)
+      appArgs,
+      undefined,
+      this.budgetPadApps(),
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      this.indexBoxes(first ? freeSlots ?? [] : []))
 
     return tx
   }
 
+  /**
+   * @returns A fee covering a reset call that frees the given number of slots, one inner
+   * transaction for budget per 16 slots, and relinks the given number of slots in the free list,
+   * one per 3 slots.
+   */
+  resetFee (slotCount: number, freeSlotCount = 0): number {
+    return this.minFee * (2 + Math.ceil(slotCount / 16) + Math.ceil(freeSlotCount / 3))
+  }
+
+  /**
+   * Frees a price slot. The slot is zeroed and its ASA ID set to 0xFFFFFFFFFFFFFFFF, so it takes no more prices,
+   * and it is reused by the next allocation. A slot cannot be freed twice.
+   *
+   * @param sender The sender account.
+   * @param slot The slot index.
+   * @param suggestedParams  The transaction params.
+   * @returns
+   */
+  makeFreeSlotTx (sender: string, slot: number, suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+    const appArgs = []
+    appArgs.push(new Uint8Array(Buffer.from('free')), algosdk.encodeUint64(slot))
+
+    const tx = algosdk.makeApplicationNoOpTxn(sender,
+      suggestedParams,
+      PRICECASTER_CI.appId,
+      appArgs,
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      this.indexBoxes([slot]))
+
+    return tx
+  }
+
+  /**
+   * Aliases an ASA to the slot of an allocated ASA tracking the same Pyth feed, so getasa reads the ASA from it, with
+   * its own decimals.  The slot is not written.  An ASA has one alias at most, and at most MAX_ALIASES are kept.
+   *
+   * @param sender The sender account.
+   * @param asaid The ASA ID to alias.
+   * @param slot The slot of the canonical ASA.
+   * @param suggestedParams  The transaction params. The fee should cover the inner transactions for budget, see aliasFee().
+   *                         The application account must hold the minimum balance for the alias box, created by the first alias.
+   * @returns
+   */
+  makeAliasTx (sender: string, asaid: number, slot: number, suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+    const appArgs = []
+    appArgs.push(new Uint8Array(Buffer.from('alias')), algosdk.encodeUint64(asaid), algosdk.encodeUint64(slot))
+
+    // The ASA decimals are read onchain, as for alloc.
+    return algosdk.makeApplicationNoOpTxn(sender,
+      suggestedParams,
+      PRICECASTER_CI.appId,
+      appArgs,
+      undefined,
+      this.budgetPadApps(),
+      asaid !== 0 ? [asaid] : undefined,
+      undefined,
+      undefined,
+      undefined,
+      [{ appIndex: PRICECASTER_CI.appId, name: ALIAS_BOX_NAME }, ...(this.slotBoxes([slot]) ?? [])])
+  }
+
+  /**
+   * Removes the alias of an ASA.
+   *
+   * @param sender The sender account.
+   * @param asaid The aliased ASA ID.
+   * @param suggestedParams  The transaction params. The fee should cover the inner transactions for budget, see aliasFee().
+   * @returns
+   */
+  makeUnaliasTx (sender: string, asaid: number, suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+    const appArgs = []
+    appArgs.push(new Uint8Array(Buffer.from('unalias')), algosdk.encodeUint64(asaid))
+
+    return algosdk.makeApplicationNoOpTxn(sender,
+      suggestedParams,
+      PRICECASTER_CI.appId,
+      appArgs,
+      undefined,
+      this.budgetPadApps(),
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      [{ appIndex: PRICECASTER_CI.appId, name: ALIAS_BOX_NAME }])
+  }
+
+  /**
+   * @returns A fee covering an alias or unalias call, or the alias lookup of a getasa call, with the given number of
+   * aliases kept, one inner transaction for budget per 700 opcodes.
+   */
+  aliasFee (aliasCount: number): number {
+    return this.minFee * (1 + Math.ceil((aliasCount * ALIAS_ENTRY_COST + ALIAS_COST) / OPCODE_BUDGET_PER_CALL))
+  }
+
   /**
    * Set configuration flags.
    *
    * @param sender The sender account.
    * @param flags A value with the flags. The LSB is used.
    * @param suggestedParams  The transaction params.
+   * @param deviation Optional deviation threshold (at most 10000 basis points) and heartbeat interval, see FLAG_DEVIATION.
    * @returns
    */
-  makeSetFlagsTx (sender: string, flags: number, suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+  makeSetFlagsTx (sender: string, flags: number, suggestedParams: algosdk.SuggestedParams, deviation?: DeviationConfig): algosdk.Transaction {
     const appArgs = []
     appArgs.push(new Uint8Array(Buffer.from('setflags')))
     appArgs.push(algosdk.encodeUint64(flags & 0xFF))
+    if (deviation) {
+      appArgs.push(algosdk.encodeUint64(deviation.thresholdBps), algosdk.encodeUint64(deviation.heartbeat))
+    }
 
     const tx = algosdk.makeApplicationNoOpTxn(sender,
       suggestedParams,
@@ -609,16 +1290,113 @@ export default class PricecasterLib {
     return tx
   }
 
+  /**
+   * Read a price slot onchain. The slot data is returned in the first log of the transaction
+   * (parse it with parseSlotBuffer), so it can be evaluated through simulation or as an inner
+   * transaction of a consumer contract.
+   *
+   * @param sender The sender account.
+   * @param slot The slot index.
+   * @param suggestedParams  The transaction params.
+   * @returns
+   */
+  makeGetSlotTx (sender: string, slot: number, suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+    const appArgs = []
+    appArgs.push(new Uint8Array(Buffer.from('get')), algosdk.encodeUint64(slot))
+
+    const tx = algosdk.makeApplicationNoOpTxn(sender,
+      suggestedParams,
+      PRICECASTER_CI.appId,
+      appArgs,
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      this.slotBoxes([slot]))
+
+    return tx
+  }
+
+  /**
+   * Read several price slots onchain, returned one per log in the order requested.
+   *
+   * @param sender The sender account.
+   * @param slots The slot indexes, at most maxGetSlots() for the slot format (MAX_GET_SLOTS with the full format).
+   * @param suggestedParams  The transaction params. The fee should cover one inner transaction for budget.
+   * @returns
+   */
+  makeGetManySlotsTx (sender: string, slots: number[], suggestedParams: algosdk.SuggestedParams): algosdk.Transaction {
+    if (slots.length > maxGetSlots(this.slotFormat)) {
+      throw new Error(`Cannot get ${slots.length} slots in one call, maximum is ${maxGetSlots(this.slotFormat)}`)
+    }
+
+    const appArgs = []
+    appArgs.push(new Uint8Array(Buffer.from('getmany')), Buffer.concat(slots.map(slot => algosdk.encodeUint64(slot))))
+
+    const tx = algosdk.makeApplicationNoOpTxn(sender,
+      suggestedParams,
+      PRICECASTER_CI.appId,
+      appArgs,
+      undefined,
+      this.budgetPadApps(),
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      this.slotBoxes(slots))
+
+    return tx
+  }
+
+  /**
+   * Read the price slot of an ASA onchain, searching all allocated slots, or the ASA index if built with it.
+   * The slot data is returned in the first log of the transaction.
+   *
+   * @param sender The sender account.
+   * @param asaid The ASA ID.
+   * @param suggestedParams  The transaction params. The fee must cover the inner transactions for budget of long searches
+   *                         (none with the ASA index).
+   * @param entryCount With the box layout, the number of allocated slots, so the boxes to search are referenced.
+   * @param alias The alias of an ASA without a slot of its own (see fetchAliases()), so the alias box and the box of the
+   *              canonical slot are referenced.  The fee must also cover the alias lookup, see aliasFee().
+   * @returns
+   */
+  makeGetAsaTx (sender: string, asaid: number, suggestedParams: algosdk.SuggestedParams, entryCount?: number, alias?: AsaAlias): algosdk.Transaction {
+    const appArgs = []
+    appArgs.push(new Uint8Array(Buffer.from('getasa')), algosdk.encodeUint64(asaid))
+
+    const slots = [...Array(entryCount ?? 0).keys()]
+    const boxes = alias === undefined
+      ? this.indexBoxes(slots)
+      : [...(this.indexBoxes(this.asaIndex ? [alias.slot] : slots) ?? []), { appIndex: PRICECASTER_CI.appId, name: ALIAS_BOX_NAME }]
+
+    const tx = algosdk.makeApplicationNoOpTxn(sender,
+      suggestedParams,
+      PRICECASTER_CI.appId,
+      appArgs,
+      undefined,
+      this.budgetPadApps(),
+      undefined,
+      undefined,
+      undefined,
+      undefined,
+      boxes)
+
+    return tx
+  }
+
   /**
    * Fetch the global store blob space
    * @returns Buffer with the entire global store
    */
   async fetchGlobalSpace (): Promise<Buffer> {
-    const buf = Buffer.alloc(63 * 127)
+    const buf = Buffer.alloc(GLOBAL_NUM_PAGES * GLOBAL_PAGE_SIZE)
     const global: [] = await this.readGlobalState(PRICECASTER_CI)
     const globalFiltered = global.filter((e: any) => { return e.key !== 'Y29yZWlk' }) // filter out 'coreid'
     globalFiltered.forEach((e: any) => {
-      const offset = Buffer.from(e.key, 'base64').readUint8() * 127
+      const offset = Buffer.from(e.key, 'base64').readUint8() * GLOBAL_PAGE_SIZE
       buf.write(e.value.bytes, offset, 'base64')
     })
     return buf
@@ -631,7 +1409,98 @@ export default class PricecasterLib {
    */
   async readSlot (slot: number): Promise<Buffer> {
     const globalSpace = await this.fetchGlobalSpace()
-    return globalSpace.subarray(GLOBAL_SLOT_SIZE * slot, GLOBAL_SLOT_SIZE * slot + GLOBAL_SLOT_SIZE)
+    if (slotLayoutOf(globalSpace) === SlotLayout.Box) {
+      return this.sliceBoxSlot(await this.fetchSlotBox(slot, slotFormatOf(globalSpace)), slot, slotFormatOf(globalSpace))
+    }
+    return sliceSlot(globalSpace, slot)
+  }
+
+  /**
+   * Fetch the box holding a slot (box layout).
+   * @returns Buffer with the box contents
+   */
+  async fetchSlotBox (slot: number, format: SlotFormat = SlotFormat.Full): Promise<Buffer> {
+    const box = await this.algodClient.getApplicationBoxByName(PRICECASTER_CI.appId, slotBoxName(slot, format)).do()
+    return Buffer.from(box.value)
+  }
+
+  private sliceBoxSlot (box: Buffer, slot: number, format: SlotFormat): Buffer {
+    const offset = (slot % boxSlots(format)) * SLOT_SIZE[format]
+    return box.subarray(offset, offset + SLOT_SIZE[format])
+  }
+
+  /**
+   * Read the slot layout the contract was compiled with.
+   */
+  async readSlotLayout (): Promise<SlotLayout> {
+    return slotLayoutOf(await this.fetchGlobalSpace())
+  }
+
+  /**
+   * Read the price slot format the contract was compiled with.
+   */
+  async readSlotFormat (): Promise<SlotFormat> {
+    return slotFormatOf(await this.fetchGlobalSpace())
+  }
+
+  /**
+   * Read whether the contract was compiled with the ASA index.
+   */
+  async readAsaIndexEnabled (): Promise<boolean> {
+    return asaIndexOf(await this.fetchGlobalSpace())
+  }
+
+  /**
+   * Fetch the ASA index of a contract compiled with it.
+   * The index box is created with the first allocated slot.
+   * @returns The (ASA ID, slot) entries of the allocated slots, sorted by ASA ID.
+   */
+  async fetchAsaIndex (): Promise<AsaIdSlot[]> {
+    const box = await this.algodClient.getApplicationBoxByName(PRICECASTER_CI.appId, ASA_INDEX_BOX_NAME).do()
+    const index = Buffer.from(box.value)
+    const layout = await this.readSlotLayout()
+    const entrySize = 8 + slotIndexSize(layout)
+    const count = index.readUInt16BE(index.length - 2)
+    return [...Array(count).keys()].map(i => {
+      return {
+        asaid: Number(index.readBigUInt64BE(i * entrySize)),
+        slot: layout === SlotLayout.Box ? index.readUInt16BE(i * entrySize + 8) : index.readUInt8(i * entrySize + 8)
+      }
+    })
+  }
+
+  /**
+   * Fetch the ASA aliases.  The alias box is created with the first alias.
+   * @returns The aliases kept, in no particular order.
+   */
+  async fetchAliases (): Promise<AsaAlias[]> {
+    const box = Buffer.from((await this.algodClient.getApplicationBoxByName(PRICECASTER_CI.appId, ALIAS_BOX_NAME).do()).value)
+    const count = box.readUInt16BE(box.length - 2)
+    return [...Array(count).keys()].map(i => {
+      return {
+        asaid: Number(box.readBigUInt64BE(i * ALIAS_ENTRY_SIZE)),
+        canonicalAsaId: Number(box.readBigUInt64BE(i * ALIAS_ENTRY_SIZE + 8)),
+        slot: box.readUInt16BE(i * ALIAS_ENTRY_SIZE + 16),
+        decimals: box.readUInt8(i * ALIAS_ENTRY_SIZE + 18)
+      }
+    })
+  }
+
+  /**
+   * The price data of an aliased ASA, as getasa returns it: the data of the canonical slot with the ASA ID, decimals
+   * and normalized price of the alias.
+   * @param slotData The parsed canonical slot.
+   * @param alias The alias.
+   */
+  aliasSlotData (slotData: PriceSlotData, alias: AsaAlias): PriceSlotData {
+    if (slotData.asaId !== alias.canonicalAsaId) {
+      throw new Error(`Slot ${alias.slot} no longer holds ASA ${alias.canonicalAsaId} aliased by ${alias.asaid}`)
+    }
+    const scale = PICO_DOLLARS_DECIMALS + slotData.exponent - alias.decimals
+    const normalizedPrice = scale >= 0
+      ? slotData.pythPrice * 10n ** BigInt(scale)
+      : slotData.pythPrice / 10n ** BigInt(-scale)
+    return { ...slotData, asaId: alias.asaid, decimals: alias.decimals, normalizedPrice }
   }
 
   /**
@@ -639,11 +1508,32 @@ export default class PricecasterLib {
    * @returns The system slot information
    */
   async readSystemSlot (): Promise<SystemSlotInfo> {
-    const sysSlotBuf = await this.readSlot(SYSTEM_SLOT_INDEX)
+    const globalSpace = await this.fetchGlobalSpace()
+    const sysSlotBuf = sliceSystemSlot(globalSpace)
     return {
-      entryCount: sysSlotBuf.readUInt8(0),
-      flags: sysSlotBuf.readUInt8(1)
+      entryCount: slotLayoutOf(globalSpace) === SlotLayout.Box
+        ? Number(sysSlotBuf.readBigUInt64BE(BOX_ENTRY_COUNT_OFFSET))
+        : sysSlotBuf.readUInt8(0),
+      flags: sysSlotBuf.readUInt8(1),
+      deviationBps: sysSlotBuf.readUInt16BE(SYS_DEVIATION_BPS_OFFSET),
+      heartbeat: sysSlotBuf.readUInt32BE(SYS_HEARTBEAT_OFFSET),
+      updateSeq: sysSlotBuf.readBigUInt64BE(SYS_UPDATE_SEQ_OFFSET),
+      freeListHead: sysSlotBuf.readUInt16BE(SYS_FREE_LIST_OFFSET),
+      merkleRoot: sysSlotBuf.subarray(SYS_MERKLE_ROOT_OFFSET, SYS_MERKLE_ROOT_OFFSET + MERKLE_HASH_SIZE)
+    }
+  }
+
+  /**
+   * Read the free list.
+   * @returns The freed slots, in the order alloc reuses them.
+   */
+  async readFreeSlots (): Promise<number[]> {
+    const slots = []
+    for (let link = (await this.readSystemSlot()).freeListHead; link !== 0;) {
+      slots.push(link - 1)
+      link = (await this.readSlot(link - 1)).readUInt16BE(FREE_LINK_OFFSET)
     }
+    return slots
   }
 
   /**
@@ -653,17 +1543,58 @@ export default class PricecasterLib {
    */
 
   async readParsePriceSlot (slot: number): Promise<PriceSlotData> {
-    if (slot < 0 || slot > NUM_SLOTS) {
+    const globalSpace = await this.fetchGlobalSpace()
+    if (slotLayoutOf(globalSpace) === SlotLayout.Box) {
+      if (slot < 0 || slot >= (await this.readSystemSlot()).entryCount) {
+        throw new Error('Invalid slot number')
+      }
+      const format = slotFormatOf(globalSpace)
+      return this.parseSlotBuffer(this.sliceBoxSlot(await this.fetchSlotBox(slot, format), slot, format))
+    }
+    const systemSlotIndex = numSlots(slotLayoutOf(globalSpace), slotFormatOf(globalSpace)) - 1
+    if (slot < 0 || slot > systemSlotIndex) {
       throw new Error('Invalid slot number')
     }
-    if (slot === SYSTEM_SLOT_INDEX) {
+    if (slot === systemSlotIndex) {
       throw new Error('Cannot parse system slot with this call')
     }
-    const dataBuf = await this.readSlot(slot)
-    return this.parseSlotBuffer(dataBuf)
+    return this.parseSlotBuffer(sliceSlot(globalSpace, slot))
+  }
+
+  /**
+   * Parse the update record among the logs of a store or storemulti transaction.
+   * @param logs The transaction logs.
+   * @returns The slots written by the call, in publication order, or undefined if there is no
+   * update record of a known version.
+   */
+  parseUpdateLog (logs: Buffer[]): PriceUpdate[] | undefined {
+    const log = logs.find(l => l.length >= UPDATE_LOG_HEADER_SIZE &&
+      l.subarray(0, UPDATE_LOG_TAG.length).equals(UPDATE_LOG_TAG) &&
+      l.readUInt8(UPDATE_LOG_TAG.length) === UPDATE_LOG_VERSION &&
+      (l.length - UPDATE_LOG_HEADER_SIZE) % UPDATE_LOG_ENTRY_SIZE === 0)
+    if (log === undefined) {
+      return undefined
+    }
+
+    const updates: PriceUpdate[] = []
+    for (let offset = UPDATE_LOG_HEADER_SIZE; offset < log.length; offset += UPDATE_LOG_ENTRY_SIZE) {
+      updates.push({
+        slot: log.readUInt16BE(offset),
+        asaId: Number(log.readBigUInt64BE(offset + 2)),
+        normalizedPrice: log.readBigUInt64BE(offset + 10),
+        pubTime: log.readBigUInt64BE(offset + 18)
+      })
+    }
+    return updates
   }
 
+  /**
+   * Parse a price slot. The slot format is told apart by the buffer length.
+   */
   parseSlotBuffer (dataBuf: Buffer): PriceSlotData {
+    if (dataBuf.length === SLOT_SIZE[SlotFormat.Compact]) {
+      return this.parseCompactSlotBuffer(dataBuf)
+    }
     const asaId = dataBuf.subarray(0, 8).readBigInt64BE()
     const normalizedPrice = dataBuf.subarray(8, 16).readBigUint64BE()
     const pythPrice = dataBuf.subarray(16, 24).readBigUint64BE()
@@ -676,6 +1607,7 @@ export default class PricecasterLib {
     const prevPubTime = dataBuf.subarray(68, 76).readBigUint64BE()
     const prevPrice = dataBuf.subarray(76, 84).readBigUint64BE()
     const prevConf = dataBuf.subarray(84, 92).readBigUInt64BE()
+    const decimals = dataBuf.readUInt8(92)
     return {
       asaId: parseInt(asaId.toString()),
       pythPrice,
@@ -688,7 +1620,30 @@ export default class PricecasterLib {
       pubTime,
       prevPubTime,
       prevPrice,
-      prevConf
+      prevConf,
+      decimals
+    }
+  }
+
+  /**
+   * Parse a compact format price slot: the exponent is kept as a signed byte and the
+   * attestation and publish times as 32-bit values.
+   */
+  private parseCompactSlotBuffer (dataBuf: Buffer): PriceSlotData {
+    return {
+      asaId: parseInt(dataBuf.readBigInt64BE(0).toString()),
+      normalizedPrice: dataBuf.readBigUInt64BE(8),
+      pythPrice: dataBuf.readBigUInt64BE(16),
+      confidence: dataBuf.readBigUInt64BE(24),
+      exponent: dataBuf.readInt8(32),
+      priceEMA: dataBuf.readBigUInt64BE(33),
+      confEMA: dataBuf.readBigUInt64BE(41),
+      attTime: BigInt(dataBuf.readUInt32BE(49)),
+      pubTime: BigInt(dataBuf.readUInt32BE(53)),
+      prevPubTime: BigInt(dataBuf.readUInt32BE(57)),
+      prevPrice: dataBuf.readBigUInt64BE(61),
+      prevConf: dataBuf.readBigUInt64BE(69),
+      decimals: dataBuf.readUInt8(77)
     }
   }
 
@@ -696,10 +1651,65 @@ export default class PricecasterLib {
    * Fetch the global state and parse all price information
    */
   async readParseGlobalState (): Promise<PriceSlotData[]> {
+    return this.parseSlots(await this.fetchGlobalSpace())
+  }
+
+  /**
+   * Incremental readParseGlobalState: only the slots changed since a previous snapshot are parsed
+   * (and, with the box layout, only their boxes fetched), as told by the system slot change table.
+   * Every slot is parsed without a previous snapshot, or when it is 256 or more updates old.
+   * algod returns the global state whole, so with the global storage layouts every call still fetches all of it.
+   * @param previous The snapshot returned by the previous call, if any.
+   * @returns The parsed slots and the update sequence number they reflect.
+   */
+  async readParseGlobalStateChanges (previous?: GlobalStateSnapshot): Promise<GlobalStateSnapshot> {
     const globalSpace = await this.fetchGlobalSpace()
+    const sysSlotBuf = sliceSystemSlot(globalSpace)
+    const updateSeq = sysSlotBuf.readBigUInt64BE(SYS_UPDATE_SEQ_OFFSET)
+    if (previous === undefined || updateSeq < previous.updateSeq || updateSeq - previous.updateSeq >= BigInt(256)) {
+      return { updateSeq, slots: await this.parseSlots(globalSpace) }
+    }
+    if (updateSeq === previous.updateSeq) {
+      return previous
+    }
+
+    const changeTable = sysSlotBuf.subarray(SYS_CHANGE_TABLE_OFFSET, SYS_CHANGE_TABLE_OFFSET + CHANGE_TABLE_SIZE)
+    const base = Number(previous.updateSeq & BigInt(0xff))
+    const updates = Number(updateSeq - previous.updateSeq)
+    const changed = (slot: number) => {
+      const age = (changeTable[slot % CHANGE_TABLE_SIZE] - base) & 0xff
+      return slot >= previous.slots.length || (age > 0 && age <= updates)
+    }
+    return { updateSeq, slots: await this.parseSlots(globalSpace, previous.slots, changed) }
+  }
+
+  /**
+   * Parse the price slots of the global space, or of the boxes with the box layout. With a previous
+   * array of slots, only those for which changed() holds are parsed, and the others kept.
+   */
+  private async parseSlots (globalSpace: Buffer, previous: PriceSlotData[] = [], changed = (slot: number) => true): Promise<PriceSlotData[]> {
     const psArray = []
-    for (let i = 0; i < 85; ++i) {
-      psArray.push(this.parseSlotBuffer(globalSpace.subarray(GLOBAL_SLOT_SIZE * i, GLOBAL_SLOT_SIZE * (i + 1))))
+    if (slotLayoutOf(globalSpace) === SlotLayout.Box) {
+      // Only allocated slots are kept in boxes.
+      const entryCount = Number(sliceSystemSlot(globalSpace).readBigUInt64BE(BOX_ENTRY_COUNT_OFFSET))
+      const format = slotFormatOf(globalSpace)
+      let box: Buffer | undefined
+      for (let i = 0; i < entryCount; ++i) {
+        if (i % boxSlots(format) === 0) {
+          box = undefined
+        }
+        if (!changed(i)) {
+          psArray.push(previous[i])
+          continue
+        }
+        box = box ?? await this.fetchSlotBox(i, format)
+        psArray.push(this.parseSlotBuffer(this.sliceBoxSlot(box, i, format)))
+      }
+      return psArray
+    }
+    const priceSlots = numSlots(slotLayoutOf(globalSpace), slotFormatOf(globalSpace)) - 1
+    for (let i = 0; i < priceSlots; ++i) {
+      psArray.push(changed(i) ? this.parseSlotBuffer(sliceSlot(globalSpace, i)) : previous[i])
     }
     return psArray
   }
@@ -0,0 +1,1428 @@
+#!/usr/bin/python3
+"""
+================================================================================================
+
+AVM stand-in for offline execution of compiled TEAL programs.
+
+(c) 2022-23 C3
+
+------------------------------------------------------------------------------------------------
+
+This is a small, self-contained interpreter of the subset of AVM version 8 opcodes emitted by
+PyTeal for the Pricecaster program. It is intended for cost measurement and functional checks
+without an Algorand node: it accounts opcode cost with pooled budget, inner transactions and
+fee credit, and enforces the protocol limits that matter for the contract (value sizes, log
+limits, foreign references, box quota).
+
+It is NOT a consensus-accurate implementation of the AVM. Any result obtained here must be
+confirmed against a real node before deployment.
+
+------------------------------------------------------------------------------------------------
+"""
+import base64
+import hashlib
+
+MAX_UINT64 = (1 << 64) - 1
+MAX_STACK_DEPTH = 1000
+MAX_BYTES_LEN = 4096
+MAX_KEY_VALUE_LEN = 128
+MAX_LOG_CALLS = 32
+MAX_LOG_SIZE = 1024
+MAX_APP_ARGS = 16
+MAX_APP_TOTAL_ARG_LEN = 2048
+MAX_FOREIGN_REFS = 8
+MAX_INNER_TXNS = 256
+BOX_IO_QUOTA_PER_REF = 1024
+APP_CALL_BUDGET = 700
+MIN_TXN_FEE = 1000
+
+ZERO_ADDRESS = bytes(32)
+
+ON_COMPLETION = {
+    "NoOp": 0, "OptIn": 1, "CloseOut": 2, "ClearState": 3, "UpdateApplication": 4, "DeleteApplication": 5
+}
+
+TYPE_ENUM = {"unknown": 0, "pay": 1, "keyreg": 2, "acfg": 3, "axfer": 4, "afrz": 5, "appl": 6}
+
+OPCODE_COST = {
+    "sha256": 35,
+    "keccak256": 130,
+    "sha512_256": 45,
+    "sha3_256": 130,
+    "ed25519verify": 1900,
+    "ed25519verify_bare": 1900,
+    "ecdsa_verify": 1700,
+    "ecdsa_pk_decompress": 650,
+    "ecdsa_pk_recover": 2000,
+    "divmodw": 20,
+    "expw": 10,
+    "sqrt": 4,
+    "b|": 6,
+    "b&": 6,
+    "b^": 6,
+}
+
+# Opcodes with a fixed number of one-byte immediates (for program size accounting).
+
+_ONE_BYTE_IMMEDIATES = {
+    "intc", "bytec", "load", "store", "txn", "global", "gtxns", "itxn_field", "itxn", "arg", "dig", "cover",
+    "uncover", "bury", "popn", "dupn", "asset_params_get", "app_params_get", "acct_params_get",
+    "asset_holding_get", "frame_dig", "frame_bury", "replace2", "txnas", "gtxnsas", "ecdsa_verify",
+    "ecdsa_pk_decompress", "ecdsa_pk_recover", "base64_decode", "json_ref", "vrf_verify", "block"
+}
+
+_TWO_BYTE_IMMEDIATES = {"txna", "gtxn", "gtxnsa", "extract", "substring", "proto", "gtxnas", "itxna"}
+
+_BRANCH_OPS = {"bnz", "bz", "b", "callsub"}
+
+
+class AVMError(Exception):
+    """
+    Raised when program execution fails (equivalent to a rejected transaction).
+    """
+
+    def __init__(self, message, pc=None, line=None):
+        super().__init__(message)
+        self.pc = pc
+        self.line = line
+
+
+def _varuint_len(n: int) -> int:
+    size = 1
+    while n >= 0x80:
+        n >>= 7
+        size += 1
+    return size
+
+
+def _parse_bytes_literal(token: str) -> bytes:
+    if token.startswith("0x"):
+        return bytes.fromhex(token[2:])
+    if token.startswith('"'):
+        return token[1:-1].encode("latin-1").decode("unicode_escape").encode("latin-1")
+    if token.startswith("base64(") or token.startswith("b64("):
+        return base64.b64decode(token[token.index("(") + 1:-1])
+    if token.startswith("base32(") or token.startswith("b32("):
+        raw = token[token.index("(") + 1:-1]
+        return base64.b32decode(raw + "=" * (-len(raw) % 8))
+    raise AVMError("unsupported byte literal " + token)
+
+
+def _tokenize(line: str):
+    """
+    Split a TEAL source line in tokens, honoring string literals and dropping comments.
+    """
+    tokens = []
+    i = 0
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c.isspace():
+            i += 1
+        elif line.startswith("//", i):
+            break
+        elif c == '"':
+            j = i + 1
+            while j < n and line[j] != '"':
+                j += 2 if line[j] == "\\" else 1
+            tokens.append(line[i:j + 1])
+            i = j + 1
+        else:
+            j = i
+            while j < n and not line[j].isspace():
+                j += 1
+            tokens.append(line[i:j])
+            i = j
+    return tokens
+
+
+class Instruction:
+    def __init__(self, op, args, line, pc=None):
+        self.op = op
+        self.args = args
+        self.line = line
+        self.pc = pc
+
+
+class Program:
+    """
+    An assembled TEAL program: instruction list, labels, constant blocks and size in bytes.
+    Template variables (TMPL_*) are replaced by the values given in `template_values`.
+    """
+
+    def __init__(self, source: str, template_values=None):
+        template_values = template_values or {}
+        for k, v in template_values.items():
+            source = source.replace(k, str(v))
+
+        self.source = source
+        self.instructions = []
+        self.labels = {}
+        self.version = 1
+        self.size = 0
+
+        for lineno, raw in enumerate(source.splitlines(), start=1):
+            tokens = _tokenize(raw)
+            if not tokens:
+                continue
+            if tokens[0] == "#pragma":
+                if tokens[1] == "version":
+                    self.version = int(tokens[2])
+                    self.size += _varuint_len(self.version)
+                continue
+            if tokens[0].endswith(":") and len(tokens) == 1:
+                self.labels[tokens[0][:-1]] = len(self.instructions)
+                continue
+            ins = Instruction(tokens[0], tokens[1:], lineno, self.size)
+            self.instructions.append(ins)
+            self.size += self._instruction_size(ins)
+
+        self.intc = []
+        self.bytec = []
+
+    @staticmethod
+    def _instruction_size(ins: Instruction) -> int:
+        op, args = ins.op, ins.args
+        if op == "intcblock":
+            return 1 + _varuint_len(len(args)) + sum(_varuint_len(int(a, 0)) for a in args)
+        if op == "bytecblock":
+            return 1 + _varuint_len(len(args)) + sum(
+                _varuint_len(len(_parse_bytes_literal(a))) + len(_parse_bytes_literal(a)) for a in args)
+        if op in ("pushint", "int"):
+            value = ON_COMPLETION.get(args[0], TYPE_ENUM.get(args[0]))
+            return 1 + _varuint_len(value if value is not None else int(args[0], 0))
+        if op in ("pushbytes", "byte"):
+            b = _parse_bytes_literal(args[0])
+            return 1 + _varuint_len(len(b)) + len(b)
+        if op == "pushints":
+            return 1 + _varuint_len(len(args)) + sum(_varuint_len(int(a, 0)) for a in args)
+        if op == "pushbytess":
+            return 1 + _varuint_len(len(args)) + sum(
+                _varuint_len(len(_parse_bytes_literal(a))) + len(_parse_bytes_literal(a)) for a in args)
+        if op in _BRANCH_OPS:
+            return 3
+        if op in ("switch", "match"):
+            return 2 + 2 * len(args)
+        if op == "gtxna":
+            return 4
+        if op in _TWO_BYTE_IMMEDIATES:
+            return 3
+        if op in _ONE_BYTE_IMMEDIATES:
+            return 2
+        return 1
+
+
+class Transaction:
+    """
+    Minimal transaction model. Only fields the Pricecaster program and the harness use are kept.
+    """
+
+    def __init__(self, sender=ZERO_ADDRESS, type="appl", application_id=0, on_completion="NoOp",
+                 app_args=None, assets=None, applications=None, accounts=None, boxes=None,
+                 fee=MIN_TXN_FEE, approval_program=b"", clear_state_program=b""):
+        self.sender = sender
+        self.type = type
+        self.application_id = application_id
+        self.on_completion = on_completion
+        self.app_args = list(app_args or [])
+        self.assets = list(assets or [])
+        self.applications = list(applications or [])
+        self.accounts = list(accounts or [])
+        self.boxes = list(boxes or [])
+        self.fee = fee
+        self.approval_program = approval_program
+        self.clear_state_program = clear_state_program
+        self.close_remainder_to = ZERO_ADDRESS
+        self.asset_close_to = ZERO_ADDRESS
+        self.rekey_to = ZERO_ADDRESS
+
+    def field(self, name, index=None):
+        if name == "Sender":
+            return self.sender
+        if name == "TypeEnum":
+            return TYPE_ENUM[self.type]
+        if name == "ApplicationID":
+            return self.application_id
+        if name == "OnCompletion":
+            return ON_COMPLETION[self.on_completion]
+        if name == "NumAppArgs":
+            return len(self.app_args)
+        if name == "ApplicationArgs":
+            if index >= len(self.app_args):
+                raise AVMError("invalid ApplicationArgs index %d" % index)
+            return self.app_args[index]
+        if name == "NumAssets":
+            return len(self.assets)
+        if name == "Assets":
+            return self.assets[index]
+        if name == "NumApplications":
+            return len(self.applications)
+        if name == "Applications":
+            return self.applications[index]
+        if name == "NumAccounts":
+            return len(self.accounts)
+        if name == "Fee":
+            return self.fee
+        if name == "CloseRemainderTo":
+            return self.close_remainder_to
+        if name == "AssetCloseTo":
+            return self.asset_close_to
+        if name == "RekeyTo":
+            return self.rekey_to
+        raise AVMError("unsupported txn field " + name)
+
+
+class Ledger:
+    """
+    State visible to the program: the application global state and boxes, known assets and
+    deployed applications that can be called as inner transactions.
+    """
+
+    def __init__(self, app_id=1000, creator=b"\x01" * 32, latest_timestamp=1700000000, round=1000):
+        self.app_id = app_id
+        self.creator = creator
+        self.global_state = {}
+        self.boxes = {}
+        self.asset_decimals = {}
+        self.apps = {}
+        self.latest_timestamp = latest_timestamp
+        self.round = round
+
+    def add_asset(self, asset_id, decimals):
+        self.asset_decimals[asset_id] = decimals
+
+    def add_app(self, app_id, program_cost=1):
+        """
+        Register an application that can be called by inner transactions. `program_cost` is the opcode
+        cost its approval program consumes from the pooled budget on every call.
+        """
+        self.apps[app_id] = program_cost
+
+    def global_space(self, num_keys=63, page_size=127) -> bytes:
+        """
+        Rebuild the linear global blob from the one-byte page keys.
+        """
+        out = b""
+        for k in range(num_keys):
+            v = self.global_state.get(bytes([k]), b"")
+            out += v if isinstance(v, bytes) else b""
+            out += bytes(page_size - len(v)) if isinstance(v, bytes) else bytes(page_size)
+        return out
+
+
+class ExecResult:
+    def __init__(self):
+        self.approved = False
+        self.error = None
+        self.error_line = None
+        self.cost = 0
+        self.budget_added = 0
+        self.inner_txns = []
+        self.logs = []
+        self.global_reads = 0
+        self.global_writes = 0
+        self.box_reads = 0
+        self.box_writes = 0
+        self.keys_written = set()
+        self.boxes_touched = set()
+
+    def as_dict(self):
+        return {
+            "approved": self.approved,
+            "error": self.error,
+            "error_line": self.error_line,
+            "opcode_cost": self.cost,
+            "budget_added": self.budget_added,
+            "inner_txns": len(self.inner_txns),
+            "logs": len(self.logs),
+            "global_reads": self.global_reads,
+            "global_writes": self.global_writes,
+            "keys_written": len(self.keys_written),
+            "box_reads": self.box_reads,
+            "box_writes": self.box_writes,
+        }
+
+
+class AVM:
+    """
+    Executes one application call of a transaction group against a `Ledger`.
+
+    The opcode budget is pooled: every application call in the group contributes APP_CALL_BUDGET,
+    and every inner application call adds APP_CALL_BUDGET minus the cost of the program it runs.
+    `preconsumed_budget` models budget already used by earlier app calls in the group.
+    """
+
+    def __init__(self, program: Program, ledger: Ledger, group, index=None, preconsumed_budget=0,
+                 trace=False):
+        self.program = program
+        self.ledger = ledger
+        self.group = group
+        self.index = len(group) - 1 if index is None else index
+        self.txn = group[self.index]
+        self.trace = trace
+
+        num_app_calls = sum(1 for t in group if t.type == "appl")
+        self.budget = APP_CALL_BUDGET * num_app_calls - preconsumed_budget
+        self.fee_credit = sum(t.fee for t in group) - MIN_TXN_FEE * len(group)
+
+        self.stack = []
+        self.scratch = [0] * 256
+        self.callstack = []
+        self.pc = 0
+        self.itxn = None
+        self.result = ExecResult()
+
+    # --------------------------------------------------------------------------------------------
+    # helpers
+
+    def _fail(self, message):
+        ins = self.program.instructions[self.pc] if self.pc < len(self.program.instructions) else None
+        raise AVMError(message, self.pc, ins.line if ins else None)
+
+    def _check_references(self):
+        t = self.txn
+        if len(t.app_args) > MAX_APP_ARGS:
+            raise AVMError("too many application args")
+        if sum(len(a) for a in t.app_args) > MAX_APP_TOTAL_ARG_LEN:
+            raise AVMError("application args total length too long")
+        if len(t.accounts) + len(t.assets) + len(t.applications) + len(t.boxes) > MAX_FOREIGN_REFS:
+            raise AVMError("tx references exceed MaxAppTotalTxnReferences")
+
+    def push(self, v):
+        if isinstance(v, bytes) and len(v) > MAX_BYTES_LEN:
+            self._fail("bytes value too long")
+        if len(self.stack) >= MAX_STACK_DEPTH:
+            self._fail("stack overflow")
+        self.stack.append(v)
+
+    def pop(self):
+        if not self.stack:
+            self._fail("stack underflow")
+        return self.stack.pop()
+
+    def pop_int(self):
+        v = self.pop()
+        if not isinstance(v, int):
+            self._fail("expected uint64, got bytes")
+        return v
+
+    def pop_bytes(self):
+        v = self.pop()
+        if not isinstance(v, bytes):
+            self._fail("expected bytes, got uint64")
+        return v
+
+    def _uint(self, v):
+        if v < 0 or v > MAX_UINT64:
+            self._fail("integer overflow")
+        return v
+
+    def _intc(self, i):
+        if i >= len(self.program.intc):
+            self._fail("intc index out of range")
+        return self.program.intc[i]
+
+    def _bytec(self, i):
+        if i >= len(self.program.bytec):
+            self._fail("bytec index out of range")
+        return self.program.bytec[i]
+
+    def _resolve_asset(self, ref):
+        if ref in self.txn.assets:
+            return ref
+        if ref < len(self.txn.assets):
+            return self.txn.assets[ref]
+        self._fail("unavailable Asset %d" % ref)
+
+    def _check_box(self, name):
+        if name not in self.txn.boxes:
+            self._fail("invalid Box reference %r" % name)
+        self.result.boxes_touched.add(name)
+        touched = sum(len(self.ledger.boxes.get(n, b"")) for n in self.result.boxes_touched)
+        if touched > BOX_IO_QUOTA_PER_REF * len(self.txn.boxes):
+            self._fail("box read/write budget exceeded")
+
+    def _global(self, name):
+        if name == "ZeroAddress":
+            return ZERO_ADDRESS
+        if name == "CreatorAddress":
+            return self.ledger.creator
+        if name == "CurrentApplicationID":
+            return self.ledger.app_id
+        if name == "GroupSize":
+            return len(self.group)
+        if name == "MinTxnFee":
+            return MIN_TXN_FEE
+        if name == "OpcodeBudget":
+            return self.budget
+        if name == "LatestTimestamp":
+            return self.ledger.latest_timestamp
+        if name == "Round":
+            return self.ledger.round
+        if name == "GroupID":
+            return bytes(32)
+        if name == "CurrentApplicationAddress":
+            return hashlib.sha512(b"appID" + self.ledger.app_id.to_bytes(8, "big")).digest()[:32]
+        self._fail("unsupported global field " + name)
+
+    # --------------------------------------------------------------------------------------------
+    # inner transactions
+
+    def _itxn_submit(self):
+        fields = self.itxn
+        self.itxn = None
+        if len(self.result.inner_txns) >= MAX_INNER_TXNS:
+            self._fail("too many inner transactions")
+
+        fee = fields.get("Fee", MIN_TXN_FEE)
+        self.fee_credit += fee - MIN_TXN_FEE
+        if self.fee_credit < 0:
+            self._fail("fee too small")
+
+        type_enum = fields.get("TypeEnum", 0)
+        if type_enum == TYPE_ENUM["appl"]:
+            app_id = fields.get("ApplicationID", 0)
+            if app_id == 0:
+                # Created (and possibly deleted) application running a trivial approval program.
+                cost = 1
+            else:
+                if app_id not in self.txn.applications:
+                    self._fail("unavailable App %d" % app_id)
+                if app_id not in self.ledger.apps:
+                    self._fail("application %d does not exist" % app_id)
+                cost = self.ledger.apps[app_id]
+            self.budget += APP_CALL_BUDGET - cost
+            self.result.budget_added += APP_CALL_BUDGET - cost
+
+        self.result.inner_txns.append(fields)
+
+    # --------------------------------------------------------------------------------------------
+    # execution
+
+    def run(self) -> ExecResult:
+        global_state = dict(self.ledger.global_state)
+        boxes = dict(self.ledger.boxes)
+        try:
+            self._check_references()
+            self._run()
+        except AVMError as e:
+            self.result.approved = False
+            self.result.error = str(e)
+            self.result.error_line = e.line
+        if not self.result.approved:
+            # A rejected call leaves no trace in the ledger.
+            self.ledger.global_state = global_state
+            self.ledger.boxes = boxes
+        return self.result
+
+    def _run(self):
+        instructions = self.program.instructions
+        while True:
+            if self.pc >= len(instructions):
+                break
+            ins = instructions[self.pc]
+            cost = OPCODE_COST.get(ins.op, 1)
+            self.budget -= cost
+            self.result.cost += cost
+            if self.budget < 0:
+                self._fail("dynamic cost budget exceeded")
+            if self.trace:
+                print(ins.line, ins.op, ins.args, self.stack[-4:])
+            jump = self._step(ins)
+            if jump is _RETURN:
+                return
+            self.pc = jump if jump is not None else self.pc + 1
+
+        if len(self.stack) != 1:
+            self._fail("stack must hold exactly one value at program end")
+        v = self.pop()
+        if not isinstance(v, int):
+            self._fail("program end with bytes on stack")
+        self.result.approved = v != 0
+        if not self.result.approved:
+            self.result.error = "program rejected"
+
+    def _label(self, name):
+        if name not in self.program.labels:
+            self._fail("unknown label " + name)
+        return self.program.labels[name]
+
+    def _step(self, ins: Instruction):
+        op, a = ins.op, ins.args
+        handler = _HANDLERS.get(op)
+        if handler is None:
+            self._fail("unsupported opcode " + op)
+        return handler(self, a)
+
+
+_RETURN = object()
+
+
+# ------------------------------------------------------------------------------------------------
+# Opcode handlers
+
+def _binary_int(fn):
+    def h(vm, a):
+        y = vm.pop_int()
+        x = vm.pop_int()
+        vm.push(vm._uint(int(fn(vm, x, y))))
+    return h
+
+
+def _div(vm, x, y):
+    if y == 0:
+        vm._fail("/ 0")
+    return x // y
+
+
+def _mod(vm, x, y):
+    if y == 0:
+        vm._fail("% 0")
+    return x % y
+
+
+def _exp(vm, x, y):
+    if x == 0 and y == 0:
+        vm._fail("0^0 is undefined")
+    r = x ** y if y < 128 or x <= 1 else MAX_UINT64 + 1
+    if r > MAX_UINT64:
+        vm._fail("exp overflow")
+    return r
+
+
+def _shl(vm, x, y):
+    if y > 63:
+        vm._fail("shl arg too big")
+    return (x << y) & MAX_UINT64
+
+
+def _shr(vm, x, y):
+    if y > 63:
+        vm._fail("shr arg too big")
+    return x >> y
+
+
+def _eq(vm, a):
+    y = vm.pop()
+    x = vm.pop()
+    if type(x) != type(y):
+        vm._fail("cannot compare uint64 to bytes")
+    vm.push(int(x == y))
+
+
+def _neq(vm, a):
+    _eq(vm, a)
+    vm.push(int(not vm.pop()))
+
+
+def _not(vm, a):
+    vm.push(int(vm.pop_int() == 0))
+
+
+def _bnot(vm, a):
+    vm.push(MAX_UINT64 ^ vm.pop_int())
+
+
+def _mulw(vm, a):
+    y = vm.pop_int()
+    x = vm.pop_int()
+    r = x * y
+    vm.push(r >> 64)
+    vm.push(r & MAX_UINT64)
+
+
+def _addw(vm, a):
+    y = vm.pop_int()
+    x = vm.pop_int()
+    r = x + y
+    vm.push(r >> 64)
+    vm.push(r & MAX_UINT64)
+
+
+def _divmodw(vm, a):
+    dlo = vm.pop_int()
+    dhi = vm.pop_int()
+    nlo = vm.pop_int()
+    nhi = vm.pop_int()
+    d = (dhi << 64) | dlo
+    if d == 0:
+        vm._fail("/ 0")
+    q, r = divmod((nhi << 64) | nlo, d)
+    vm.push(q >> 64)
+    vm.push(q & MAX_UINT64)
+    vm.push(r >> 64)
+    vm.push(r & MAX_UINT64)
+
+
+def _divw(vm, a):
+    c = vm.pop_int()
+    lo = vm.pop_int()
+    hi = vm.pop_int()
+    if c == 0:
+        vm._fail("/ 0")
+    vm.push(vm._uint(((hi << 64) | lo) // c))
+
+
+def _expw(vm, a):
+    y = vm.pop_int()
+    x = vm.pop_int()
+    if x == 0 and y == 0:
+        vm._fail("0^0 is undefined")
+    r = x ** y
+    if r >> 128:
+        vm._fail("expw overflow")
+    vm.push(r >> 64)
+    vm.push(r & MAX_UINT64)
+
+
+def _sqrt(vm, a):
+    x = vm.pop_int()
+    r = int(x ** 0.5)
+    while r * r > x:
+        r -= 1
+    while (r + 1) * (r + 1) <= x:
+        r += 1
+    vm.push(r)
+
+
+def _bitlen(vm, a):
+    x = vm.pop()
+    if isinstance(x, bytes):
+        x = int.from_bytes(x, "big")
+    vm.push(x.bit_length())
+
+
+def _btoi(vm, a):
+    b = vm.pop_bytes()
+    if len(b) > 8:
+        vm._fail("btoi arg too long")
+    vm.push(int.from_bytes(b, "big"))
+
+
+def _itob(vm, a):
+    vm.push(vm.pop_int().to_bytes(8, "big"))
+
+
+def _len(vm, a):
+    vm.push(len(vm.pop_bytes()))
+
+
+def _concat(vm, a):
+    y = vm.pop_bytes()
+    x = vm.pop_bytes()
+    vm.push(x + y)
+
+
+def _substring_impl(vm, b, s, e):
+    if e < s or e > len(b):
+        vm._fail("substring range beyond length of string")
+    vm.push(b[s:e])
+
+
+def _substring(vm, a):
+    b = vm.pop_bytes()
+    _substring_impl(vm, b, int(a[0]), int(a[1]))
+
+
+def _substring3(vm, a):
+    e = vm.pop_int()
+    s = vm.pop_int()
+    b = vm.pop_bytes()
+    _substring_impl(vm, b, s, e)
+
+
+def _extract_impl(vm, b, s, n):
+    if s > len(b) or s + n > len(b):
+        vm._fail("extraction end %d is beyond length: %d" % (s + n, len(b)))
+    vm.push(b[s:s + n])
+
+
+def _extract(vm, a):
+    b = vm.pop_bytes()
+    s, n = int(a[0]), int(a[1])
+    if n == 0:
+        n = len(b) - s
+    _extract_impl(vm, b, s, n)
+
+
+def _extract3(vm, a):
+    n = vm.pop_int()
+    s = vm.pop_int()
+    b = vm.pop_bytes()
+    _extract_impl(vm, b, s, n)
+
+
+def _extract_uint(size):
+    def h(vm, a):
+        s = vm.pop_int()
+        b = vm.pop_bytes()
+        if s + size > len(b):
+            vm._fail("extraction end %d is beyond length: %d" % (s + size, len(b)))
+        vm.push(int.from_bytes(b[s:s + size], "big"))
+    return h
+
+
+def _replace_impl(vm, b, s, r):
+    if s + len(r) > len(b):
+        vm._fail("replacement end %d beyond original length: %d" % (s + len(r), len(b)))
+    vm.push(b[:s] + r + b[s + len(r):])
+
+
+def _replace2(vm, a):
+    r = vm.pop_bytes()
+    b = vm.pop_bytes()
+    _replace_impl(vm, b, int(a[0]), r)
+
+
+def _replace3(vm, a):
+    r = vm.pop_bytes()
+    s = vm.pop_int()
+    b = vm.pop_bytes()
+    _replace_impl(vm, b, s, r)
+
+
+def _getbyte(vm, a):
+    i = vm.pop_int()
+    b = vm.pop_bytes()
+    if i >= len(b):
+        vm._fail("getbyte index beyond array length")
+    vm.push(b[i])
+
+
+def _setbyte(vm, a):
+    v = vm.pop_int()
+    i = vm.pop_int()
+    b = vm.pop_bytes()
+    if i >= len(b):
+        vm._fail("setbyte index beyond array length")
+    if v > 255:
+        vm._fail("setbyte value > 255")
+    vm.push(b[:i] + bytes([v]) + b[i + 1:])
+
+
+def _getbit(vm, a):
+    i = vm.pop_int()
+    x = vm.pop()
+    if isinstance(x, int):
+        if i > 63:
+            vm._fail("getbit index > 63 with with Uint")
+        vm.push((x >> i) & 1)
+    else:
+        if i // 8 >= len(x):
+            vm._fail("getbit index beyond byteslice")
+        vm.push((x[i // 8] >> (7 - i % 8)) & 1)
+
+
+def _setbit(vm, a):
+    v = vm.pop_int()
+    i = vm.pop_int()
+    x = vm.pop()
+    if v > 1:
+        vm._fail("setbit value > 1")
+    if isinstance(x, int):
+        if i > 63:
+            vm._fail("setbit index > 63 with Uint")
+        vm.push((x & ~(1 << i)) | (v << i))
+    else:
+        if i // 8 >= len(x):
+            vm._fail("setbit index beyond byteslice")
+        byte = x[i // 8]
+        mask = 1 << (7 - i % 8)
+        byte = (byte | mask) if v else (byte & ~mask)
+        vm.push(x[:i // 8] + bytes([byte]) + x[i // 8 + 1:])
+
+
+def _bzero(vm, a):
+    n = vm.pop_int()
+    if n > MAX_BYTES_LEN:
+        vm._fail("bzero attempted to create a too large string")
+    vm.push(bytes(n))
+
+
+def _intcblock(vm, a):
+    vm.program.intc = [int(x, 0) for x in a]
+
+
+def _bytecblock(vm, a):
+    vm.program.bytec = [_parse_bytes_literal(x) for x in a]
+
+
+def _pushint(vm, a):
+    value = ON_COMPLETION.get(a[0], TYPE_ENUM.get(a[0]))
+    vm.push(value if value is not None else int(a[0], 0))
+
+
+def _pushints(vm, a):
+    for x in a:
+        vm.push(int(x, 0))
+
+
+def _pushbytes(vm, a):
+    vm.push(_parse_bytes_literal(a[0]))
+
+
+def _pushbytess(vm, a):
+    for x in a:
+        vm.push(_parse_bytes_literal(x))
+
+
+def _dup(vm, a):
+    x = vm.pop()
+    vm.push(x)
+    vm.push(x)
+
+
+def _dup2(vm, a):
+    y = vm.pop()
+    x = vm.pop()
+    for v in (x, y, x, y):
+        vm.push(v)
+
+
+def _dupn(vm, a):
+    x = vm.pop()
+    for _ in range(int(a[0]) + 1):
+        vm.push(x)
+
+
+def _pop(vm, a):
+    vm.pop()
+
+
+def _popn(vm, a):
+    for _ in range(int(a[0])):
+        vm.pop()
+
+
+def _swap(vm, a):
+    y = vm.pop()
+    x = vm.pop()
+    vm.push(y)
+    vm.push(x)
+
+
+def _dig(vm, a):
+    n = int(a[0])
+    if n >= len(vm.stack):
+        vm._fail("dig %d with stack size = %d" % (n, len(vm.stack)))
+    vm.push(vm.stack[-1 - n])
+
+
+def _cover(vm, a):
+    n = int(a[0])
+    if n >= len(vm.stack):
+        vm._fail("cover %d with stack size = %d" % (n, len(vm.stack)))
+    x = vm.stack.pop()
+    vm.stack.insert(len(vm.stack) - n, x)
+
+
+def _uncover(vm, a):
+    n = int(a[0])
+    if n >= len(vm.stack):
+        vm._fail("uncover %d with stack size = %d" % (n, len(vm.stack)))
+    x = vm.stack.pop(-1 - n)
+    vm.stack.append(x)
+
+
+def _bury(vm, a):
+    n = int(a[0])
+    if n == 0 or n >= len(vm.stack):
+        vm._fail("bury %d with stack size = %d" % (n, len(vm.stack)))
+    x = vm.stack.pop()
+    vm.stack[-n] = x
+
+
+def _select(vm, a):
+    c = vm.pop_int()
+    b = vm.pop()
+    x = vm.pop()
+    vm.push(b if c else x)
+
+
+def _assert(vm, a):
+    if not vm.pop_int():
+        vm._fail("assert failed")
+
+
+def _err(vm, a):
+    vm._fail("err opcode executed")
+
+
+def _return(vm, a):
+    v = vm.pop_int()
+    vm.result.approved = v != 0
+    if not vm.result.approved:
+        vm.result.error = "program rejected"
+    return _RETURN
+
+
+def _bnz(vm, a):
+    if vm.pop_int():
+        return vm._label(a[0])
+
+
+def _bz(vm, a):
+    if not vm.pop_int():
+        return vm._label(a[0])
+
+
+def _b(vm, a):
+    return vm._label(a[0])
+
+
+def _switch(vm, a):
+    i = vm.pop_int()
+    if i < len(a):
+        return vm._label(a[i])
+
+
+def _match(vm, a):
+    n = len(a)
+    x = vm.pop()
+    candidates = [vm.pop() for _ in range(n)][::-1]
+    for i, c in enumerate(candidates):
+        if type(c) == type(x) and c == x:
+            return vm._label(a[i])
+
+
+def _callsub(vm, a):
+    vm.callstack.append({"return": vm.pc + 1, "fp": None, "args": 0, "rets": 0})
+    return vm._label(a[0])
+
+
+def _proto(vm, a):
+    if not vm.callstack:
+        vm._fail("proto outside of subroutine")
+    frame = vm.callstack[-1]
+    frame["args"], frame["rets"] = int(a[0]), int(a[1])
+    frame["fp"] = len(vm.stack)
+    if frame["args"] > len(vm.stack):
+        vm._fail("callsub to proto that requires %d args with stack height %d" % (frame["args"], len(vm.stack)))
+
+
+def _retsub(vm, a):
+    if not vm.callstack:
+        vm._fail("retsub with empty callstack")
+    frame = vm.callstack.pop()
+    if frame["fp"] is not None:
+        base = frame["fp"] - frame["args"]
+        rets = frame["rets"]
+        if len(vm.stack) < frame["fp"] + rets:
+            vm._fail("retsub executed with stack below frame")
+        vm.stack = vm.stack[:base] + (vm.stack[len(vm.stack) - rets:] if rets else [])
+    return frame["return"]
+
+
+def _frame_index(vm, a):
+    if not vm.callstack or vm.callstack[-1]["fp"] is None:
+        vm._fail("frame_dig with empty callstack")
+    i = vm.callstack[-1]["fp"] + int(a[0])
+    if i < 0 or i >= len(vm.stack):
+        vm._fail("frame index %s out of range" % a[0])
+    return i
+
+
+def _frame_dig(vm, a):
+    vm.push(vm.stack[_frame_index(vm, a)])
+
+
+def _frame_bury(vm, a):
+    x = vm.pop()
+    vm.stack[_frame_index(vm, a)] = x
+
+
+def _load(vm, a):
+    vm.push(vm.scratch[int(a[0])])
+
+
+def _store(vm, a):
+    vm.scratch[int(a[0])] = vm.pop()
+
+
+def _loads(vm, a):
+    i = vm.pop_int()
+    if i > 255:
+        vm._fail("invalid Scratch index %d" % i)
+    vm.push(vm.scratch[i])
+
+
+def _stores(vm, a):
+    v = vm.pop()
+    i = vm.pop_int()
+    if i > 255:
+        vm._fail("invalid Scratch index %d" % i)
+    vm.scratch[i] = v
+
+
+def _txn(vm, a):
+    vm.push(vm.txn.field(a[0], int(a[1]) if len(a) > 1 else None))
+
+
+def _txnas(vm, a):
+    i = vm.pop_int()
+    vm.push(vm.txn.field(a[0], i))
+
+
+def _gtxn_at(vm, gi):
+    if gi >= len(vm.group):
+        vm._fail("gtxn lookup TxnGroup[%d] but it only has %d" % (gi, len(vm.group)))
+    return vm.group[gi]
+
+
+def _gtxn(vm, a):
+    vm.push(_gtxn_at(vm, int(a[0])).field(a[1], int(a[2]) if len(a) > 2 else None))
+
+
+def _gtxns(vm, a):
+    gi = vm.pop_int()
+    vm.push(_gtxn_at(vm, gi).field(a[0], int(a[1]) if len(a) > 1 else None))
+
+
+def _gtxnsas(vm, a):
+    i = vm.pop_int()
+    gi = vm.pop_int()
+    vm.push(_gtxn_at(vm, gi).field(a[0], i))
+
+
+def _global_op(vm, a):
+    vm.push(vm._global(a[0]))
+
+
+def _log(vm, a):
+    b = vm.pop_bytes()
+    vm.result.logs.append(b)
+    if len(vm.result.logs) > MAX_LOG_CALLS:
+        vm._fail("too many log calls in program. up to %d is allowed." % MAX_LOG_CALLS)
+    if sum(len(x) for x in vm.result.logs) > MAX_LOG_SIZE:
+        vm._fail("program logs too large. %d bytes >  %d bytes limit" % (
+            sum(len(x) for x in vm.result.logs), MAX_LOG_SIZE))
+
+
+def _app_global_get(vm, a):
+    key = vm.pop_bytes()
+    vm.result.global_reads += 1
+    vm.push(vm.ledger.global_state.get(key, 0))
+
+
+def _app_global_get_ex(vm, a):
+    key = vm.pop_bytes()
+    app = vm.pop_int()
+    if app not in (0, vm.ledger.app_id):
+        vm._fail("app_global_get_ex on foreign apps is not supported")
+    vm.result.global_reads += 1
+    exists = key in vm.ledger.global_state
+    vm.push(vm.ledger.global_state.get(key, 0))
+    vm.push(int(exists))
+
+
+def _app_global_put(vm, a):
+    v = vm.pop()
+    key = vm.pop_bytes()
+    if len(key) > 64:
+        vm._fail("key too long")
+    if isinstance(v, bytes) and len(key) + len(v) > MAX_KEY_VALUE_LEN:
+        vm._fail("key/value total too long for key 0x%s" % key.hex())
+    vm.result.global_writes += 1
+    vm.result.keys_written.add(key)
+    vm.ledger.global_state[key] = v
+
+
+def _app_global_del(vm, a):
+    key = vm.pop_bytes()
+    vm.result.global_writes += 1
+    vm.ledger.global_state.pop(key, None)
+
+
+def _asset_params_get(vm, a):
+    ref = vm.pop_int()
+    asset = vm._resolve_asset(ref)
+    if a[0] != "AssetDecimals":
+        vm._fail("unsupported asset param " + a[0])
+    exists = asset in vm.ledger.asset_decimals
+    vm.push(vm.ledger.asset_decimals.get(asset, 0))
+    vm.push(int(exists))
+
+
+def _itxn_begin(vm, a):
+    if vm.itxn is not None:
+        vm._fail("itxn_begin without itxn_submit")
+    vm.itxn = {}
+
+
+def _itxn_field(vm, a):
+    if vm.itxn is None:
+        vm._fail("itxn_field without itxn_begin")
+    vm.itxn[a[0]] = vm.pop()
+
+
+def _itxn_submit(vm, a):
+    if vm.itxn is None:
+        vm._fail("itxn_submit without itxn_begin")
+    vm._itxn_submit()
+
+
+def _itxn_next(vm, a):
+    _itxn_submit(vm, a)
+    vm.itxn = {}
+
+
+def _box_name(vm):
+    name = vm.pop_bytes()
+    if not name or len(name) > 64:
+        vm._fail("box names must be 1-64 bytes")
+    vm._check_box(name)
+    return name
+
+
+def _box_create(vm, a):
+    size = vm.pop_int()
+    name = _box_name(vm)
+    if size > 32768:
+        vm._fail("box size too large")
+    if name in vm.ledger.boxes:
+        if len(vm.ledger.boxes[name]) != size:
+            vm._fail("box size mismatch")
+        vm.push(0)
+        return
+    vm.ledger.boxes[name] = bytes(size)
+    vm._check_box(name)
+    vm.result.box_writes += 1
+    vm.push(1)
+
+
+def _box_extract(vm, a):
+    n = vm.pop_int()
+    s = vm.pop_int()
+    name = _box_name(vm)
+    if name not in vm.ledger.boxes:
+        vm._fail("no such box")
+    box = vm.ledger.boxes[name]
+    if s + n > len(box):
+        vm._fail("extraction end beyond box length")
+    vm.result.box_reads += 1
+    vm.push(box[s:s + n])
+
+
+def _box_replace(vm, a):
+    r = vm.pop_bytes()
+    s = vm.pop_int()
+    name = _box_name(vm)
+    if name not in vm.ledger.boxes:
+        vm._fail("no such box")
+    box = vm.ledger.boxes[name]
+    if s + len(r) > len(box):
+        vm._fail("replacement end beyond box length")
+    vm.result.box_writes += 1
+    vm.ledger.boxes[name] = box[:s] + r + box[s + len(r):]
+
+
+def _box_del(vm, a):
+    name = _box_name(vm)
+    vm.result.box_writes += 1
+    vm.push(int(vm.ledger.boxes.pop(name, None) is not None))
+
+
+def _box_len(vm, a):
+    name = _box_name(vm)
+    box = vm.ledger.boxes.get(name)
+    vm.push(len(box) if box is not None else 0)
+    vm.push(int(box is not None))
+
+
+def _box_get(vm, a):
+    name = _box_name(vm)
+    box = vm.ledger.boxes.get(name)
+    vm.result.box_reads += 1
+    vm.push(box if box is not None else b"")
+    vm.push(int(box is not None))
+
+
+def _box_put(vm, a):
+    v = vm.pop_bytes()
+    name = _box_name(vm)
+    if name in vm.ledger.boxes and len(vm.ledger.boxes[name]) != len(v):
+        vm._fail("box_put wrong size")
+    vm.ledger.boxes[name] = v
+    vm._check_box(name)
+    vm.result.box_writes += 1
+
+
+def _hash(fn):
+    def h(vm, a):
+        vm.push(fn(vm.pop_bytes()))
+    return h
+
+
+def _keccak256(data):
+    from Cryptodome.Hash import keccak
+    return keccak.new(digest_bits=256, data=data).digest()
+
+
+def _bytes_binary(fn):
+    def h(vm, a):
+        y = vm.pop_bytes()
+        x = vm.pop_bytes()
+        vm.push(fn(x, y))
+    return h
+
+
+def _bytes_cmp(fn):
+    def h(vm, a):
+        y = int.from_bytes(vm.pop_bytes(), "big")
+        x = int.from_bytes(vm.pop_bytes(), "big")
+        vm.push(int(fn(x, y)))
+    return h
+
+
+def _bytes_bitwise(fn):
+    def h(vm, a):
+        y = vm.pop_bytes()
+        x = vm.pop_bytes()
+        n = max(len(x), len(y))
+        x, y = x.rjust(n, b"\x00"), y.rjust(n, b"\x00")
+        vm.push(bytes(fn(p, q) for p, q in zip(x, y)))
+    return h
+
+
+_HANDLERS = {
+    "+": _binary_int(lambda vm, x, y: x + y),
+    "-": _binary_int(lambda vm, x, y: x - y),
+    "*": _binary_int(lambda vm, x, y: x * y),
+    "/": _binary_int(_div),
+    "%": _binary_int(_mod),
+    "<": _binary_int(lambda vm, x, y: x < y),
+    ">": _binary_int(lambda vm, x, y: x > y),
+    "<=": _binary_int(lambda vm, x, y: x <= y),
+    ">=": _binary_int(lambda vm, x, y: x >= y),
+    "&&": _binary_int(lambda vm, x, y: x != 0 and y != 0),
+    "||": _binary_int(lambda vm, x, y: x != 0 or y != 0),
+    "&": _binary_int(lambda vm, x, y: x & y),
+    "|": _binary_int(lambda vm, x, y: x | y),
+    "^": _binary_int(lambda vm, x, y: x ^ y),
+    "exp": _binary_int(_exp),
+    "shl": _binary_int(_shl),
+    "shr": _binary_int(_shr),
+    "==": _eq,
+    "!=": _neq,
+    "!": _not,
+    "~": _bnot,
+    "mulw": _mulw,
+    "addw": _addw,
+    "divmodw": _divmodw,
+    "divw": _divw,
+    "expw": _expw,
+    "sqrt": _sqrt,
+    "bitlen": _bitlen,
+    "btoi": _btoi,
+    "itob": _itob,
+    "len": _len,
+    "concat": _concat,
+    "substring": _substring,
+    "substring3": _substring3,
+    "extract": _extract,
+    "extract3": _extract3,
+    "extract_uint16": _extract_uint(2),
+    "extract_uint32": _extract_uint(4),
+    "extract_uint64": _extract_uint(8),
+    "replace2": _replace2,
+    "replace3": _replace3,
+    "getbyte": _getbyte,
+    "setbyte": _setbyte,
+    "getbit": _getbit,
+    "setbit": _setbit,
+    "bzero": _bzero,
+    "intcblock": _intcblock,
+    "bytecblock": _bytecblock,
+    "intc": lambda vm, a: vm.push(vm._intc(int(a[0]))),
+    "intc_0": lambda vm, a: vm.push(vm._intc(0)),
+    "intc_1": lambda vm, a: vm.push(vm._intc(1)),
+    "intc_2": lambda vm, a: vm.push(vm._intc(2)),
+    "intc_3": lambda vm, a: vm.push(vm._intc(3)),
+    "bytec": lambda vm, a: vm.push(vm._bytec(int(a[0]))),
+    "bytec_0": lambda vm, a: vm.push(vm._bytec(0)),
+    "bytec_1": lambda vm, a: vm.push(vm._bytec(1)),
+    "bytec_2": lambda vm, a: vm.push(vm._bytec(2)),
+    "bytec_3": lambda vm, a: vm.push(vm._bytec(3)),
+    "pushint": _pushint,
+    "int": _pushint,
+    "pushints": _pushints,
+    "pushbytes": _pushbytes,
+    "byte": _pushbytes,
+    "pushbytess": _pushbytess,
+    "dup": _dup,
+    "dup2": _dup2,
+    "dupn": _dupn,
+    "pop": _pop,
+    "popn": _popn,
+    "swap": _swap,
+    "dig": _dig,
+    "cover": _cover,
+    "uncover": _uncover,
+    "bury": _bury,
+    "select": _select,
+    "assert": _assert,
+    "err": _err,
+    "return": _return,
+    "bnz": _bnz,
+    "bz": _bz,
+    "b": _b,
+    "switch": _switch,
+    "match": _match,
+    "callsub": _callsub,
+    "retsub": _retsub,
+    "proto": _proto,
+    "frame_dig": _frame_dig,
+    "frame_bury": _frame_bury,
+    "load": _load,
+    "store": _store,
+    "loads": _loads,
+    "stores": _stores,
+    "txn": _txn,
+    "txna": _txn,
+    "txnas": _txnas,
+    "gtxn": _gtxn,
+    "gtxna": _gtxn,
+    "gtxns": _gtxns,
+    "gtxnsa": _gtxns,
+    "gtxnsas": _gtxnsas,
+    "global": _global_op,
+    "log": _log,
+    "app_global_get": _app_global_get,
+    "app_global_get_ex": _app_global_get_ex,
+    "app_global_put": _app_global_put,
+    "app_global_del": _app_global_del,
+    "asset_params_get": _asset_params_get,
+    "itxn_begin": _itxn_begin,
+    "itxn_field": _itxn_field,
+    "itxn_submit": _itxn_submit,
+    "itxn_next": _itxn_next,
+    "box_create": _box_create,
+    "box_extract": _box_extract,
+    "box_replace": _box_replace,
+    "box_del": _box_del,
+    "box_len": _box_len,
+    "box_get": _box_get,
+    "box_put": _box_put,
+    "sha256": _hash(lambda b: hashlib.sha256(b).digest()),
+    "sha512_256": _hash(lambda b: hashlib.new("sha512_256", b).digest()),
+    "sha3_256": _hash(lambda b: hashlib.sha3_256(b).digest()),
+    "keccak256": _hash(_keccak256),
+    "b==": _bytes_cmp(lambda x, y: x == y),
+    "b!=": _bytes_cmp(lambda x, y: x != y),
+    "b<": _bytes_cmp(lambda x, y: x < y),
+    "b>": _bytes_cmp(lambda x, y: x > y),
+    "b<=": _bytes_cmp(lambda x, y: x <= y),
+    "b>=": _bytes_cmp(lambda x, y: x >= y),
+    "b|": _bytes_bitwise(lambda p, q: p | q),
+    "b&": _bytes_bitwise(lambda p, q: p & q),
+    "b^": _bytes_bitwise(lambda p, q: p ^ q),
+}
+
+
+def execute(program: Program, ledger: Ledger, group, index=None, preconsumed_budget=0, trace=False) -> ExecResult:
+    """
+    Convenience wrapper: run transaction `index` (default: last) of `group` and return the result.
+    """
+    program.intc = []
+    program.bytec = []
+    return AVM(program, ledger, group, index, preconsumed_budget, trace).run()
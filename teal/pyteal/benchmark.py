@@ -0,0 +1,611 @@
+#!/usr/bin/python3
+"""
+================================================================================================
+
+Pricecaster Onchain Program -- Offline Cost Benchmark
+
+(c) 2022-23 C3
+
+------------------------------------------------------------------------------------------------
+
+Compiles `pricecaster_program()` and runs every approval-program method against the AVM
+stand-in in `avmsim.py`, reporting for each call:
+
+    opcode_cost         Opcodes executed by the Pricecaster call (budget consumed).
+    inner_txns          Inner transactions issued (budget pooling).
+    budget_added        Opcode budget obtained through inner transactions.
+    global_reads        app_global_get executions.
+    global_writes       app_global_put executions.
+    keys_written        Distinct global keys written.
+
+plus the size in bytes of the compiled approval program.
+
+Results are emitted as JSON (one document) so they can be diffed between commits or checked
+in CI against a previous run:
+
+    python3 teal/pyteal/benchmark.py                      # print results
+    python3 teal/pyteal/benchmark.py -o bench.json        # write results
+    python3 teal/pyteal/benchmark.py --baseline bench.json --tolerance 0
+    python3 teal/pyteal/benchmark.py --layout aligned     # benchmark another build
+    python3 teal/pyteal/benchmark.py --budget-pool pad
+    python3 teal/pyteal/benchmark.py --write-combining
+    python3 teal/pyteal/benchmark.py --asa-index
+    python3 teal/pyteal/benchmark.py --profile            # opcode cost per subroutine
+
+With --baseline, the run fails (exit code 1) if any scenario costs more opcodes than the
+baseline plus the tolerance, or if any scenario changed its approve/reject outcome.
+
+------------------------------------------------------------------------------------------------
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+
+from pyteal import Mode, OptimizeOptions, compileTeal
+
+from avmsim import Ledger, Program, Transaction, execute, APP_CALL_BUDGET, MIN_TXN_FEE
+import budgetpad
+from profiling import instrument, read_profile
+
+PYTEAL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CORE_APP_ID = 10000
+CREATOR = b"\xc3" * 32
+PRICECASTER_APP_ID = 2000
+PAD_APP_ID = 3000
+
+# Attestation layout used to build synthetic Pyth payloads (P2W v3, 149 bytes per attestation).
+
+P2W_HEADER = bytes.fromhex("5032574800030000000102")
+ATTESTATION_SIZE = 149
+IGNORE_ASA = 0xFFFFFFFFFFFFFFFF
+
+# Largest store batch (MAX_ATTESTATIONS in pricecaster-v2.py). One more must be rejected.
+MAX_ATTESTATIONS = 12
+
+# Largest allocmany batch (MAX_ALLOC_BATCH in pricecaster-v2.py).
+MAX_ALLOC_BATCH = 8
+
+# Pyth accumulator updates: root payload header ("AUWV", Wormhole Merkle) and the size of the tree 
+# the storeproofs scenarios prove against, about the number of Pythnet price feeds.
+ACCUMULATOR_ROOT_HEADER = b"AUWV\x00"
+ACCUMULATOR_LEAVES = 512
+
+# Largest call argument total (all application arguments of a call share it).
+MAX_APP_ARGS_SIZE = 2048
+
+# Signature verification steps measured by the store/1-verify-N scenarios: a single step up to
+# a full 16-transaction group (14 steps, the verifyVAA call and store). A 19-guardian set
+# needs 13 signatures, verified in 3 steps of up to 6 (the --verify-steps default).
+GROUP_VERIFY_STEPS = (1, 3, 7, 14)
+
+# Deviation threshold mode flag (FLAG_DEVIATION in pricecaster-v2.py).
+FLAG_DEVIATION = 0x01
+
+# Opcode budget given to every call of a profiling build on top of the pooled budget: the probes
+# cost more than the budget the program tops up for itself, so no budget is bought.
+PROFILE_EXTRA_BUDGET = 100000
+
+# Box layout: slots per box with the full slot format (slots_per_box() in pricecaster-v2.py).
+BOX_SLOTS = 11
+
+# Box holding the ASA index (ASA_INDEX_BOX in pricecaster-v2.py).
+ASA_INDEX_BOX = b"idx"
+
+# Box holding the ASA aliases (ALIAS_BOX in pricecaster-v2.py).
+ALIAS_BOX = b"als"
+
+
+def load_pricecaster():
+    """
+    Import a fresh copy of the Pricecaster program module and its dependencies.
+    """
+    if PYTEAL_DIR not in sys.path:
+        sys.path.insert(0, PYTEAL_DIR)
+    for name in ("globals", "oppool", "globalblob", "inlineasm", "pricecaster"):
+        sys.modules.pop(name, None)
+    spec = importlib.util.spec_from_file_location("pricecaster", os.path.join(PYTEAL_DIR, "pricecaster-v2.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["pricecaster"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def compile_approval(pricecaster, layout=None, budget_pool=None, write_combining=None, slot_format=None,
+                     asa_index=None) -> str:
+    if layout is not None:
+        pricecaster.SLOT_LAYOUT = layout
+    if budget_pool is not None:
+        pricecaster.BUDGET_POOL = budget_pool
+    if write_combining is not None:
+        pricecaster.WRITE_COMBINING = write_combining
+    if slot_format is not None:
+        pricecaster.SLOT_FORMAT = slot_format
+    if asa_index is not None:
+        pricecaster.ASA_INDEX = asa_index
+    teal = compileTeal(pricecaster.pricecaster_program(), mode=Mode.Application, version=8,
+                       assembleConstants=True, optimize=OptimizeOptions(scratch_slots=True))
+    pricecaster.check_scratch_slots(teal)
+    return teal
+
+
+def template_values(testing=False):
+    return {"TMPL_I_TESTING": int(testing), "TMPL_I_PAD_APP_ID": PAD_APP_ID}
+
+
+def budget_pad_cost() -> int:
+    """
+    Opcode cost of one call to the budget pad application (straight-line program).
+    """
+    teal = compileTeal(budgetpad.budget_pad_program(), mode=Mode.Application, version=8)
+    return len(Program(teal, {}).instructions)
+
+
+def make_attestation(price=10000, exponent=-8, status=1, pub_time=0x6283efc3):
+    return b"".join([
+        b"\xaa" * 32,                                   # product id
+        b"\xbb" * 32,                                   # price id
+        price.to_bytes(8, "big"),
+        bytes.fromhex("cc000000000000ff"),              # confidence
+        (exponent & 0xFFFFFFFF).to_bytes(4, "big"),
+        bytes.fromhex("111111111111111f"),              # price EMA
+        bytes.fromhex("222222222222222f"),              # confidence EMA
+        bytes([status]),
+        bytes.fromhex("00000004"),                      # num publishers
+        bytes.fromhex("00000006"),                      # max num publishers
+        (0x6283efc2).to_bytes(8, "big"),                # attestation time
+        pub_time.to_bytes(8, "big"),
+        bytes.fromhex("000000006283efc4"),              # prev publish time
+        bytes.fromhex("00000000008823d6"),              # prev price
+        bytes.fromhex("0000000000004be2"),              # prev confidence
+    ])
+
+
+def make_payload(attestations) -> bytes:
+    return P2W_HEADER + len(attestations).to_bytes(2, "big") + ATTESTATION_SIZE.to_bytes(2, "big") + \
+        b"".join(attestations)
+
+
+def keccak160(data) -> bytes:
+    from Cryptodome.Hash import keccak
+    return keccak.new(digest_bits=256, data=data).digest()[:20]
+
+
+def make_price_message(feed_id, price=10000, exponent=-8, pub_time=0x6283efc3) -> bytes:
+    """
+    A Pyth accumulator price message (type 0, 85 bytes).
+    """
+    return b"".join([
+        b"\x00",
+        feed_id.to_bytes(32, "big"),
+        price.to_bytes(8, "big"),
+        bytes.fromhex("cc000000000000ff"),              # confidence
+        (exponent & 0xFFFFFFFF).to_bytes(4, "big"),
+        pub_time.to_bytes(8, "big"),
+        bytes.fromhex("000000006283efc4"),              # prev publish time
+        bytes.fromhex("111111111111111f"),              # price EMA
+        bytes.fromhex("222222222222222f"),              # confidence EMA
+    ])
+
+
+def merkle_tree(messages):
+    """
+    Root and proofs of the accumulator Merkle tree of `messages`, padded with empty leaves to a
+    power of two.  Each proof lists the sibling hashes from the leaf up.
+    """
+    size = 1
+    while size < len(messages):
+        size *= 2
+    level = [keccak160(b"\x00" + m) for m in messages] + [keccak160(b"\x00")] * (size - len(messages))
+    proofs = [[] for _ in messages]
+    positions = list(range(len(messages)))
+    while len(level) > 1:
+        for proof, position in zip(proofs, positions):
+            proof.append(level[position ^ 1])
+        level = [keccak160(b"\x01" + min(a, b) + max(a, b)) for a, b in zip(level[::2], level[1::2])]
+        positions = [position // 2 for position in positions]
+    return level[0], proofs
+
+
+def encode_proof_updates(updates) -> bytes:
+    # (message, proof) pairs, encoded as in the accumulator update data.
+    return bytes([len(updates)]) + b"".join(len(message).to_bytes(2, "big") + message + bytes([len(proof)]) + b"".join(proof)
+                                            for message, proof in updates)
+
+
+def encode_asaid_slots(entries, slot_index_size=1) -> bytes:
+    # With the ASA index (slot_index_size 0), ASA IDs only.
+    return b"".join(asa_id.to_bytes(8, "big") + (slot.to_bytes(slot_index_size, "big") if slot_index_size else b"")
+                    for asa_id, slot in entries)
+
+
+def slot_box_name(slot, box_slots=BOX_SLOTS) -> bytes:
+    return (slot // box_slots).to_bytes(2, "big")
+
+
+class Harness:
+    """
+    Drives a Pricecaster deployment on the AVM stand-in.
+    """
+
+    def __init__(self, teal: str, testing=False, verify_steps=3, group_budget=0, layout="linear",
+                 box_slots=BOX_SLOTS, extra_budget=0, asa_index=False):
+        self.program = Program(teal, template_values(testing))
+        self.testing = testing
+        self.verify_steps = verify_steps
+        self.group_budget = group_budget
+        self.extra_budget = extra_budget
+        self.layout = layout
+        self.box_slots = box_slots
+        self.asa_index = asa_index
+        self.ledger = Ledger(app_id=PRICECASTER_APP_ID, creator=CREATOR)
+        self.ledger.add_app(PAD_APP_ID, budget_pad_cost())
+        self.asa_slots = {}
+        self.entry_count = 0
+        self.free_slots = []
+        self.aliases = {}
+
+    def slot_boxes(self, slots):
+        """
+        Box references needed to access `slots` (box layout only).
+        """
+        if self.layout != "box":
+            return []
+        return sorted(set(slot_box_name(slot, self.box_slots) for slot in slots))
+
+    def index_boxes(self, slots=()):
+        """
+        Box references of the calls that read or write the ASA index, which also access `slots`.
+        """
+        return ([ASA_INDEX_BOX] if self.asa_index else []) + self.slot_boxes(slots)
+
+    def slot_index_size(self):
+        # Size of the slot index in the store tuples, none with the ASA index.
+        if self.asa_index:
+            return 0
+        return 2 if self.layout == "box" else 1
+
+    def wormhole_group(self):
+        """
+        Transactions preceding the store call: signature verification steps and the VAA
+        verification call, all issued to the Wormhole core application.
+        """
+        if self.testing:
+            return []
+        return [Transaction(sender=b"\x05" * 32, application_id=CORE_APP_ID, app_args=[b"verifySigs"])
+                for _ in range(self.verify_steps)] + \
+            [Transaction(sender=CREATOR, application_id=CORE_APP_ID, app_args=[b"verifyVAA"])]
+
+    def call(self, app_args, fee=MIN_TXN_FEE, assets=None, group_prefix=None, application_id=PRICECASTER_APP_ID,
+             boxes=None):
+        txn = Transaction(sender=CREATOR, application_id=application_id, app_args=app_args, fee=fee,
+                          assets=assets, applications=[PAD_APP_ID], boxes=boxes)
+        group = (group_prefix or []) + [txn]
+        # Preceding app calls contribute only what they leave of their budget to the pool.
+        used = APP_CALL_BUDGET * len(group_prefix or []) - min(self.group_budget, APP_CALL_BUDGET * len(group_prefix or []))
+        return execute(self.program, self.ledger, group, preconsumed_budget=used - self.extra_budget)
+
+    def bootstrap(self):
+        return self.call([CORE_APP_ID.to_bytes(8, "big")], fee=3 * MIN_TXN_FEE, application_id=0)
+
+    def next_slots(self, count):
+        """
+        The slots the next `count` allocations take: freed slots, last freed first, then new ones.
+        """
+        reused = self.free_slots[::-1][:count]
+        return reused + list(range(self.entry_count, self.entry_count + count - len(reused)))
+
+    def allocated(self, asa_ids, log):
+        slots = [int.from_bytes(log[i:i + 8], "big") for i in range(len(b"ALLOC@"), len(log), 8)]
+        for asa_id, slot in zip(asa_ids, slots):
+            self.asa_slots[asa_id] = slot
+            if slot in self.free_slots:
+                self.free_slots.remove(slot)
+            else:
+                self.entry_count += 1
+
+    def alloc(self, asa_id, decimals=6):
+        self.ledger.add_asset(asa_id, decimals)
+        result = self.call([b"alloc", asa_id.to_bytes(8, "big")], assets=[asa_id],
+                           boxes=self.index_boxes(self.next_slots(1)))
+        if result.approved:
+            self.allocated([asa_id], result.logs[0])
+        return result
+
+    def allocmany(self, asa_ids, decimals=6, fee=None):
+        fee = fee if fee is not None else MIN_TXN_FEE * (1 + len(asa_ids))
+        for asa_id in asa_ids:
+            self.ledger.add_asset(asa_id, decimals)
+        result = self.call([b"allocmany", b"".join(asa_id.to_bytes(8, "big") for asa_id in asa_ids)], fee=fee,
+                           assets=asa_ids, boxes=self.index_boxes(self.next_slots(len(asa_ids))))
+        if result.approved:
+            self.allocated(asa_ids, result.logs[0])
+        return result
+
+    def store(self, entries, attestations, fee=None):
+        """
+        Publish `attestations` for the (asa_id, slot) `entries`.
+        """
+        fee = fee if fee is not None else MIN_TXN_FEE * (2 + 2 * len(entries))
+        boxes = self.index_boxes([slot for asa_id, slot in entries if asa_id != IGNORE_ASA])
+        return self.call([b"store", encode_asaid_slots(entries, self.slot_index_size()), make_payload(attestations)],
+                         fee=fee, group_prefix=self.wormhole_group(), boxes=boxes)
+
+    def storemulti(self, batches, fee=None):
+        """
+        Publish several payloads in one call, each batch an (entries, attestations) pair as in store.
+        Every payload comes with its own Wormhole verification transactions.
+        """
+        entries = [entry for batch_entries, _ in batches for entry in batch_entries]
+        fee = fee if fee is not None else MIN_TXN_FEE * (2 + 2 * len(entries))
+        boxes = self.index_boxes([slot for asa_id, slot in entries if asa_id != IGNORE_ASA])
+        args = [b"storemulti"]
+        for batch_entries, attestations in batches:
+            args += [encode_asaid_slots(batch_entries, self.slot_index_size()), make_payload(attestations)]
+        return self.call(args, fee=fee, group_prefix=self.wormhole_group() * len(batches), boxes=boxes)
+
+    def setroot(self, root, pythnet_slot=1):
+        payload = ACCUMULATOR_ROOT_HEADER + pythnet_slot.to_bytes(8, "big") + ACCUMULATOR_LEAVES.to_bytes(4, "big") + root
+        return self.call([b"setroot", payload], group_prefix=self.wormhole_group())
+
+    def storeproofs(self, entries, updates, fee=None):
+        """
+        Publish accumulator `updates`, (message, proof) pairs, for the (asa_id, slot) `entries`.
+        No Wormhole verification transactions: the messages are proven against the stored root.
+        """
+        fee = fee if fee is not None else MIN_TXN_FEE * (2 + 4 * len(entries))
+        boxes = self.index_boxes([slot for asa_id, slot in entries if asa_id != IGNORE_ASA])
+        return self.call([b"storeproofs", encode_asaid_slots(entries, self.slot_index_size()), encode_proof_updates(updates)],
+                         fee=fee, boxes=boxes)
+
+    def reset(self, first=None, fee=3 * MIN_TXN_FEE):
+        args = [b"reset"] if first is None else [b"reset", first.to_bytes(8, "big")]
+        # Freed slots are relinked or dropped from the free list, so their boxes are read.
+        result = self.call(args, fee=fee, boxes=self.index_boxes(self.free_slots if first else []))
+        if result.approved:
+            self.entry_count = first or 0
+            self.free_slots = [slot for slot in self.free_slots if slot < self.entry_count]
+        return result
+
+    def free(self, slot):
+        result = self.call([b"free", slot.to_bytes(8, "big")], boxes=self.index_boxes([slot]))
+        if result.approved:
+            self.free_slots.append(slot)
+        return result
+
+    def setflags(self, flags, deviation_bps=None, heartbeat=None):
+        args = [b"setflags", flags.to_bytes(8, "big")]
+        if deviation_bps is not None:
+            args += [deviation_bps.to_bytes(8, "big"), heartbeat.to_bytes(8, "big")]
+        return self.call(args)
+
+    def get(self, slot):
+        return self.call([b"get", slot.to_bytes(8, "big")], boxes=self.slot_boxes([slot]))
+
+    def getmany(self, slots, fee=2 * MIN_TXN_FEE):
+        return self.call([b"getmany", b"".join(slot.to_bytes(8, "big") for slot in slots)], fee=fee,
+                         boxes=self.slot_boxes(slots))
+
+    def getasa(self, asa_id, fee=MIN_TXN_FEE):
+        # Without the ASA index, every slot may be read.  An aliased ASA is read from the canonical slot.
+        if asa_id in self.aliases:
+            slots = [self.aliases[asa_id]] if self.asa_index else range(self.entry_count)
+            return self.call([b"getasa", asa_id.to_bytes(8, "big")], fee=fee,
+                             boxes=self.index_boxes(slots) + [ALIAS_BOX])
+        slots = [self.asa_slots[asa_id]] if self.asa_index else range(self.entry_count)
+        return self.call([b"getasa", asa_id.to_bytes(8, "big")], fee=fee, boxes=self.index_boxes(slots))
+
+    def alias(self, asa_id, slot, decimals=6, fee=MIN_TXN_FEE):
+        self.ledger.add_asset(asa_id, decimals)
+        result = self.call([b"alias", asa_id.to_bytes(8, "big"), slot.to_bytes(8, "big")], fee=fee, assets=[asa_id],
+                           boxes=self.slot_boxes([slot]) + [ALIAS_BOX])
+        if result.approved:
+            self.aliases[asa_id] = slot
+        return result
+
+    def unalias(self, asa_id, fee=MIN_TXN_FEE):
+        result = self.call([b"unalias", asa_id.to_bytes(8, "big")], fee=fee, boxes=[ALIAS_BOX])
+        if result.approved:
+            del self.aliases[asa_id]
+        return result
+
+
+def run_scenarios(teal: str, verify_steps=3, group_budget=0, layout="linear", box_slots=BOX_SLOTS,
+                  profile_table=None, asa_index=False):
+    """
+    Run the standard scenario set and return a dict of scenario name -> measurements.
+    With the `profile_table` of a profiling build (see profiling.py), each scenario also reports
+    its opcode cost per subroutine.
+    """
+    results = {}
+    extra_budget = PROFILE_EXTRA_BUDGET if profile_table is not None else 0
+
+    def record(name, result):
+        results[name] = result.as_dict()
+        if profile_table is not None:
+            results[name]["profile"] = read_profile(result.logs, profile_table)
+
+    record("bootstrap/testing", Harness(teal, testing=True, layout=layout, box_slots=box_slots,
+                                        extra_budget=extra_budget, asa_index=asa_index).bootstrap())
+
+    h = Harness(teal, testing=False, verify_steps=verify_steps, group_budget=group_budget, layout=layout,
+                box_slots=box_slots, extra_budget=extra_budget, asa_index=asa_index)
+    record("bootstrap", h.bootstrap())
+    record("setflags", h.setflags(0x00))
+
+    asa_ids = [1000 + i for i in range(MAX_ATTESTATIONS + 1)]
+    for i, asa_id in enumerate(asa_ids):
+        r = h.alloc(asa_id, decimals=5 + i % 3)
+        if i == 0:
+            record("alloc/first", r)
+    record("alloc/next", h.alloc(2000, decimals=8))
+
+    for n in list(range(1, 6)) + [MAX_ATTESTATIONS, MAX_ATTESTATIONS + 1]:
+        entries = [(asa_id, h.asa_slots[asa_id]) for asa_id in asa_ids[:n]]
+        record("store/%d-fresh" % n, h.store(entries, [make_attestation(pub_time=0x62840000 + n)] * n))
+
+    entries = [(asa_id, h.asa_slots[asa_id]) for asa_id in asa_ids[:5]]
+    record("store/5-stale", h.store(entries, [make_attestation(pub_time=1)] * 5))
+    record("store/5-disabled", h.store(entries, [make_attestation(status=0)] * 5))
+
+    ignored = [(IGNORE_ASA, 0xFF)] * 4 + entries[:1]
+    record("store/5-4-ignored", h.store(ignored, [make_attestation(pub_time=0x62850000)] * 5))
+
+    for steps in GROUP_VERIFY_STEPS:
+        h.verify_steps = steps
+        record("store/1-verify-%d" % steps, h.store(entries[:1], [make_attestation(pub_time=0x62860000 + steps)]))
+    h.verify_steps = verify_steps
+
+    # Several payloads in one call, against the same number of attestations in separate store calls.
+    for count, n in ((2, 3), (3, 4)):
+        batches = [([(asa_id, h.asa_slots[asa_id]) for asa_id in asa_ids[k * n:(k + 1) * n]],
+                    [make_attestation(pub_time=0x62870000 + count)] * n) for k in range(count)]
+        record("storemulti/%dx%d" % (count, n), h.storemulti(batches))
+
+    # Attestations already stored are skipped without writing.
+    record("store/5-unchanged", h.store(entries, [make_attestation(pub_time=0x62870003)] * 5))
+
+    # Deviation threshold mode, 0.5% and 60 seconds: a 0.4% move is skipped, a 0.6% move or the
+    # heartbeat is written.
+    record("setflags/deviation", h.setflags(FLAG_DEVIATION, deviation_bps=50, heartbeat=60))
+    record("store/5-deviation-within", h.store(entries, [make_attestation(price=10040, pub_time=0x62870003 + 10)] * 5))
+    record("store/5-deviation-moved", h.store(entries, [make_attestation(price=10060, pub_time=0x62870003 + 20)] * 5))
+    record("store/5-heartbeat", h.store(entries, [make_attestation(price=10060, pub_time=0x62870003 + 80)] * 5))
+    h.setflags(0x00)
+
+    # Accumulator updates: a root, then prices proven against it.  Feed k is the leaf of the k-th ASA,
+    # so the proofs of a batch share their upper levels, unless the leaves are scattered in the tree.
+    def proof_update_call(leaves, pub_time):
+        messages = [make_price_message(leaf, pub_time=pub_time) for leaf in range(ACCUMULATOR_LEAVES)]
+        root, proofs = merkle_tree(messages)
+        entries = [(asa_id, h.asa_slots[asa_id]) for asa_id in asa_ids[:len(leaves)]]
+        return root, entries, [(messages[leaf], proofs[leaf]) for leaf in leaves]
+
+    root, entries, updates = proof_update_call(range(6), 0x62880000)
+    record("setroot", h.setroot(root))
+    record("storeproofs/1", h.storeproofs(entries[:1], updates[:1]))
+    record("storeproofs/5", h.storeproofs(entries[1:], updates[1:]))
+
+    # The largest batch within the argument size limit.
+    n = MAX_ATTESTATIONS
+    while len(b"storeproofs") + len(encode_asaid_slots(entries[:1] * n, h.slot_index_size())) + \
+            len(encode_proof_updates(updates[:1] * n)) > MAX_APP_ARGS_SIZE:
+        n -= 1
+    root, entries, updates = proof_update_call(range(n), 0x62880001)
+    h.setroot(root)
+    record("storeproofs/%d" % n, h.storeproofs(entries, updates))
+
+    root, entries, updates = proof_update_call(range(0, ACCUMULATOR_LEAVES, ACCUMULATOR_LEAVES // 5)[:5], 0x62880002)
+    record("storeproofs/5-wrong-root", h.storeproofs(entries, updates))
+    h.setroot(root)
+    record("storeproofs/5-scattered", h.storeproofs(entries, updates))
+
+    record("get", h.get(h.asa_slots[asa_ids[0]]))
+    record("getmany/5", h.getmany([h.asa_slots[asa_id] for asa_id in asa_ids[:5]]))
+    record("getmany/11", h.getmany([h.asa_slots[asa_id] for asa_id in asa_ids[:11]]))
+    record("getmany/12", h.getmany([h.asa_slots[asa_id] for asa_id in asa_ids[:12]]))
+    record("getasa/first", h.getasa(asa_ids[0]))
+    record("getasa/last", h.getasa(2000, fee=2 * MIN_TXN_FEE))
+
+    # A wrapped variant of the first ASA, with other decimals, read from its slot.
+    record("alias", h.alias(5000, h.asa_slots[asa_ids[0]], decimals=8))
+    record("getasa/alias", h.getasa(5000, fee=2 * MIN_TXN_FEE))
+    record("unalias", h.unalias(5000))
+
+    record("free", h.free(h.asa_slots[2000]))
+    record("alloc/reuse", h.alloc(2000, decimals=8))
+
+    # Slots freed before a reset from a given slot: the free list is truncated.
+    for asa_id in asa_ids[10:]:
+        h.free(h.asa_slots[asa_id])
+    record("reset/from-12", h.reset(MAX_ATTESTATIONS))
+    record("reset", h.reset())
+
+    # The largest batch within the 8 references of a call: the ASAs, the budget pad application
+    # and any boxes.
+    n = MAX_ALLOC_BATCH
+    while n + 1 + len(h.index_boxes(h.next_slots(n))) > 8:
+        n -= 1
+    record("allocmany/%d" % n, h.allocmany([3000 + i for i in range(n)]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pricecaster offline opcode-cost benchmark")
+    parser.add_argument("-o", "--output", help="write JSON results to this file")
+    parser.add_argument("--baseline", help="compare against a previous JSON results file")
+    parser.add_argument("--tolerance", type=int, default=0, help="allowed opcode cost increase per scenario")
+    parser.add_argument("--layout", help="slot layout to compile (see pricecaster-v2.py --layout)")
+    parser.add_argument("--budget-pool", help="budget pooling mode to compile (see pricecaster-v2.py --budget-pool)")
+    parser.add_argument("--write-combining", action="store_true", default=None,
+                        help="compile the write-combining store (see pricecaster-v2.py --write-combining)")
+    parser.add_argument("--slot-format", help="price slot format to compile (see pricecaster-v2.py --slot-format)")
+    parser.add_argument("--asa-index", action="store_true", default=None,
+                        help="compile with the ASA index (see pricecaster-v2.py --asa-index)")
+    parser.add_argument("--verify-steps", type=int, default=3,
+                        help="number of Wormhole signature verification transactions in the store group")
+    parser.add_argument("--group-budget", type=int, default=0,
+                        help="opcode budget left to the pool by the Wormhole calls preceding store (default 0, worst case)")
+    parser.add_argument("--profile", action="store_true",
+                        help="run the profiling build and report opcode cost per subroutine (not comparable to a baseline)")
+    args = parser.parse_args()
+    if args.profile and args.baseline:
+        parser.error("profiling build costs include the probes: --profile cannot be checked against --baseline")
+    if args.write_combining and args.layout == "box":
+        parser.error("write-combining applies to global storage layouts only: --write-combining cannot be used with --layout box")
+
+    pricecaster = load_pricecaster()
+    teal = compile_approval(pricecaster, args.layout, args.budget_pool, args.write_combining,
+                            args.slot_format, args.asa_index)
+    profile_table = None
+    if args.profile:
+        teal, profile_table = instrument(teal)
+    report = {
+        "layout": pricecaster.SLOT_LAYOUT,
+        "budget_pool": pricecaster.BUDGET_POOL,
+        "write_combining": pricecaster.WRITE_COMBINING,
+        "slot_format": pricecaster.SLOT_FORMAT,
+        "asa_index": pricecaster.ASA_INDEX,
+        "program_size": Program(teal, template_values()).size,
+        "scenarios": run_scenarios(teal, args.verify_steps, args.group_budget, pricecaster.SLOT_LAYOUT,
+                                   pricecaster.slots_per_box(), profile_table, pricecaster.ASA_INDEX),
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        for r in regressions:
+            print("REGRESSION: " + r, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+def compare(baseline, report, tolerance=0):
+    """
+    Return a list of human-readable regressions of `report` against `baseline`.
+    """
+    regressions = []
+    for name, base in baseline["scenarios"].items():
+        current = report["scenarios"].get(name)
+        if current is None:
+            regressions.append("%s: scenario missing" % name)
+            continue
+        if current["approved"] != base["approved"]:
+            regressions.append("%s: approved %s -> %s (%s)" % (name, base["approved"], current["approved"],
+                                                              current["error"]))
+        if current["opcode_cost"] > base["opcode_cost"] + tolerance:
+            regressions.append("%s: opcode cost %d -> %d" % (name, base["opcode_cost"], current["opcode_cost"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+"""
+================================================================================================
+
+Budget Pad Onchain Program
+
+(c) 2022-23 C3 
+
+------------------------------------------------------------------------------------------------
+
+A stateless application that approves NoOp calls and nothing else. Pricecaster builds compiled
+with the "pad" budget pool (pricecaster-v2.py --budget-pool pad) call it from inner transactions
+to raise their pooled opcode budget, instead of creating and deleting a throwaway application
+for every 700 opcodes.
+
+The application cannot be updated, deleted or opted-in, so a deployed instance can be shared by
+any number of Pricecaster deployments.
+
+------------------------------------------------------------------------------------------------
+"""
+from pyteal import *
+import argparse
+
+def budget_pad_program():
+    return Return(Txn.on_completion() == OnComplete.NoOp)
+
+def clear_state_program():
+    return Int(1)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Budget pad TEAL compiler")
+    parser.add_argument("approval_outfile", nargs="?", default="teal/build/budgetpad-approval.teal")
+    parser.add_argument("clear_state_outfile", nargs="?", default="teal/build/budgetpad-clear.teal")
+    args = parser.parse_args()
+
+    print("Budget Pad TEAL Program, (c) 2022-23 C3")
+    print("Compiling approval program...")
+
+    with open(args.approval_outfile, "w") as f:
+        compiled = compileTeal(budget_pad_program(), mode=Mode.Application, version=8)
+        f.write(compiled)
+
+    print("Written to " + args.approval_outfile)
+    print("Compiling clear state program...")
+
+    with open(args.clear_state_outfile, "w") as f:
+        compiled = compileTeal(clear_state_program(), mode=Mode.Application, version=8)
+        f.write(compiled)
+
+    print("Written to " + args.clear_state_outfile)
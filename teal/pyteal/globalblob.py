@@ -1,8 +1,10 @@
 # NOTE: This is an almost exact copy of the local_blob code from Wormhole
 
+import re
 from typing import Tuple
 
 from pyteal import *
+from inlineasm import FrameLocal
 
 _max_keys = 63 
 _page_size = 128 - 1  # need 1 byte for key
@@ -13,8 +15,41 @@ max_keys = Int(_max_keys)
 page_size = Int(_page_size)
 max_bytes = Int(_max_bytes)
 
+# Write-combining page cache: page N is held in scratch slot _cache_base + N.  The slots from 
+# reserved_scratch_base up (the cache, and below it the probes of profiling builds, see profiling.py)
+# are addressed by number, so the compiler must not assign them: see check_scratch_slots.
+_cache_base = 256 - _max_keys - 1
+cache_base = Int(_cache_base)
+reserved_scratch_base = _cache_base - 4
+
+_scratch_op = re.compile(r"^\s*(?:load|store) (\d+)$", re.MULTILINE)
+
+
+def check_scratch_slots(teal: str):
+    """
+    Fails if the compiled program uses a scratch slot numbered from reserved_scratch_base up.
+    """
+    slots = [int(slot) for slot in _scratch_op.findall(teal)]
+    if slots and max(slots) >= reserved_scratch_base:
+        raise ValueError("scratch slot %d assigned by the compiler is reserved (slots %d to 255)"
+                         % (max(slots), reserved_scratch_base))
+
+# Bitmasks (bit N = page N) of the pages loaded into and modified in the cache. 
+_cache_loaded = ScratchVar(TealType.uint64)
+_cache_dirty = ScratchVar(TealType.uint64)
+
+
+def _constant(expr: Expr):
+    """
+    Value of a constant Int expression, None for anything computed at run time.
+    """
+    return expr.value if isinstance(expr, Int) else None
+
 
 def _key_and_offset(idx: Int) -> Tuple[Int, Int]:
+    if _constant(idx) is not None:
+        key, offset = divmod(_constant(idx), _page_size)
+        return Int(key), Int(offset)
     return idx / page_size, idx % page_size
 
 
@@ -23,6 +58,73 @@ def intkey(i: Expr) -> Expr:
     return Extract(Itob(i), Int(7), Int(1))
 
 
+def _key(key: Expr) -> Expr:
+    """
+    Global key of a page. The key of a constant page is a byte constant.
+    """
+    if _constant(key) is not None:
+        return Bytes(bytes([_constant(key)]))
+    return intkey(key)
+
+
+@Subroutine(TealType.uint64)
+def _get_byte(idx: Expr) -> Expr:
+    key, offset = _key_and_offset(idx)
+    return GetByte(App.globalGet(intkey(key)), offset)
+
+
+@Subroutine(TealType.none)
+def _set_byte(idx: Expr, byte: Expr) -> Expr:
+    key, offset = _key_and_offset(idx)
+    return App.globalPut(
+        intkey(key), SetByte(App.globalGet(intkey(key)), offset, byte)
+    )
+
+
+@Subroutine(TealType.bytes)
+def _read_span(bstart: Expr, length: Expr) -> Expr:
+    start_key, start_offset = _key_and_offset(bstart)
+
+    key = FrameLocal(0, TealType.uint64)
+    offset = FrameLocal(1, TealType.uint64)
+
+    return Seq(
+        key.init(start_key),
+        offset.init(start_offset),
+        If(offset.load() + length <= page_size)
+        .Then(GlobalBlob.read_page(key.load(), offset.load(), length))
+        .Else(
+            Concat(
+                Substring(App.globalGet(intkey(key.load())), offset.load(), page_size),
+                GlobalBlob.read_page(key.load() + Int(1), Int(0), offset.load() + length - page_size),
+            )
+        ),
+    )
+
+
+@Subroutine(TealType.none)
+def _write_span(bstart: Expr, buff: Expr) -> Expr:
+    start_key, start_offset = _key_and_offset(bstart)
+
+    key = FrameLocal(0, TealType.uint64)
+    offset = FrameLocal(1, TealType.uint64)
+    head = FrameLocal(2, TealType.uint64)
+
+    return Seq(
+        key.init(start_key),
+        offset.init(start_offset),
+        head.init(page_size - offset.load()),
+        If(Len(buff) <= head.load())
+        .Then(GlobalBlob.write_page(key.load(), offset.load(), buff))
+        .Else(
+            Seq(
+                GlobalBlob.write_page(key.load(), offset.load(), Extract(buff, Int(0), head.load())),
+                GlobalBlob.write_page(key.load() + Int(1), Int(0), Extract(buff, head.load(), Len(buff) - head.load())),
+            )
+        ),
+    )
+
+
 # TODO: Add Keyspace range?
 class GlobalBlob:
     """
@@ -40,8 +142,8 @@ class GlobalBlob:
         This allows us to be lazy later and _assume_ all the strings are the same size
 
         """
-        i = ScratchVar()
-        init = i.store(Int(0))
+        i = FrameLocal(0, TealType.uint64)
+        init = i.init(Int(0))
         cond = i.load() < max_keys
         iter = i.store(i.load() + Int(1))
         return For(init, cond, iter).Do(
@@ -49,128 +151,213 @@ class GlobalBlob:
         )
 
     @staticmethod
-    @Subroutine(TealType.uint64)
+    @Subroutine(TealType.none)
+    def zero_range(bstart: Expr, bend: Expr) -> Expr:
+        """
+        zero the bytes between bstart and bend, where bend > bstart
+
+        Unlike zero, only the keys covering the range are written. Partially covered keys
+        at either end are updated in place.
+        """
+        key = FrameLocal(0, TealType.uint64)
+        start = FrameLocal(1, TealType.uint64)
+        stop_key = FrameLocal(2, TealType.uint64)
+        stop = FrameLocal(3, TealType.uint64)
+
+        def zero_page(key, start, stop):
+            return GlobalBlob.write_page(key, start, BytesZero(stop - start))
+
+        return Seq(
+            key.init(bstart / page_size),
+            start.init(bstart % page_size),
+            stop_key.init((bend - Int(1)) / page_size),
+            stop.init((bend - Int(1)) % page_size + Int(1)),
+            If(key.load() == stop_key.load())
+            .Then(zero_page(key.load(), start.load(), stop.load()))
+            .Else(
+                Seq(
+                    zero_page(key.load(), start.load(), page_size),
+                    For(key.store(key.load() + Int(1)), key.load() < stop_key.load(), key.store(key.load() + Int(1))).Do(
+                        App.globalPut(intkey(key.load()), BytesZero(page_size))
+                    ),
+                    zero_page(stop_key.load(), Int(0), stop.load()),
+                )
+            ),
+        )
+
+    @staticmethod
     def get_byte(idx: Expr):
         """
-        Get a single byte from global storage by index
+        Get a single byte from global storage by index. A constant index is resolved at
+        compile time into a read of a known key.
         """
-        key, offset = _key_and_offset(idx)
-        return GetByte(App.globalGet(intkey(key)), offset)
+        if _constant(idx) is not None:
+            key, offset = _key_and_offset(idx)
+            return GetByte(App.globalGet(_key(key)), offset)
+        return _get_byte(idx)
 
     @staticmethod
-    @Subroutine(TealType.none)
     def set_byte(idx: Expr, byte: Expr):
         """
-        Set a single byte from global storage by index
+        Set a single byte from global storage by index. A constant index is resolved at
+        compile time into an update of a known key.
         """
-        key, offset = _key_and_offset(idx)
-        return App.globalPut(
-            intkey(key), SetByte(App.globalGet(intkey(key)), offset, byte)
-        )
+        if _constant(idx) is not None:
+            key, offset = _key_and_offset(idx)
+            return App.globalPut(_key(key), SetByte(App.globalGet(_key(key)), offset, byte))
+        return _set_byte(idx, byte)
 
     @staticmethod
-    @Subroutine(TealType.bytes)
-    def read(
-        bstart: Expr, bend: Expr
-    ) -> Expr:
+    def read_page(key: Expr, offset: Expr, length: Expr) -> Expr:
         """
-        read bytes between bstart and bend from global storage by index
+        read length bytes at offset from a single key. The range must not cross the page end.
         """
+        return Extract(App.globalGet(_key(key)), offset, length)
 
-        start_key, start_offset = _key_and_offset(bstart)
-        stop_key, stop_offset = _key_and_offset(bend)
+    @staticmethod
+    def write_page(key: Expr, offset: Expr, buff: Expr) -> Expr:
+        """
+        write buff at offset into a single key. The range must not cross the page end.
+        """
+        return App.globalPut(_key(key), Replace(App.globalGet(_key(key)), offset, buff))
 
-        key = ScratchVar()
-        buff = ScratchVar()
+    @staticmethod
+    def read_span(bstart: Expr, length: Expr) -> Expr:
+        """
+        read length bytes from bstart, where length <= page_size so the range touches at most two keys.
+        Unlike read, no loop is generated. A constant range is resolved at compile time.
+        """
+        if _constant(bstart) is not None and _constant(length) is not None:
+            key, offset = divmod(_constant(bstart), _page_size)
+            head = min(_constant(length), _page_size - offset)
+            if head == _constant(length):
+                return GlobalBlob.read_page(Int(key), Int(offset), length)
+            return Concat(
+                GlobalBlob.read_page(Int(key), Int(offset), Int(head)),
+                GlobalBlob.read_page(Int(key + 1), Int(0), Int(_constant(length) - head)),
+            )
+        return _read_span(bstart, length)
 
-        start = ScratchVar()
-        stop = ScratchVar()
+    @staticmethod
+    def write_span(bstart: Expr, buff: Expr) -> Expr:
+        """
+        write buff at bstart, where len(buff) <= page_size so the range touches at most two keys.
+        Unlike write, no loop is generated.
+        """
+        return _write_span(bstart, buff)
 
-        init = key.store(start_key)
-        cond = key.load() <= stop_key
-        incr = key.store(key.load() + Int(1))
+    @staticmethod
+    def cache_begin() -> Expr:
+        """
+        start write-combining: pages are read from global storage at most once, and updates are
+        kept in scratch space until cache_flush is called.
+        """
+        return Seq(_cache_loaded.store(Int(0)), _cache_dirty.store(Int(0)))
 
+    @staticmethod
+    @Subroutine(TealType.bytes)
+    def cache_page(key: Expr) -> Expr:
+        """
+        get a page through the cache, loading it from global storage on first use
+        """
+        bit = ShiftLeft(Int(1), key)
         return Seq(
-            buff.store(Bytes("")),
-            For(init, cond, incr).Do(
+            If(Not(_cache_loaded.load() & bit)).Then(
                 Seq(
-                    start.store(If(key.load() == start_key, start_offset, Int(0))),
-                    stop.store(If(key.load() == stop_key, stop_offset, page_size)),
-                    buff.store(
-                        Concat(
-                            buff.load(),
-                            Substring(
-                                App.globalGet(intkey(key.load())),
-                                start.load(),
-                                stop.load(),
-                            ),
-                        )
-                    ),
+                    ScratchStore(None, App.globalGet(intkey(key)), cache_base + key),
+                    _cache_loaded.store(_cache_loaded.load() | bit),
                 )
             ),
-            buff.load(),
+            ScratchLoad(None, TealType.bytes, cache_base + key),
         )
 
     @staticmethod
     @Subroutine(TealType.none)
-    def write(
-        bstart: Expr, buff: Expr
-    ) -> Expr:
+    def cache_write_page(key: Expr, offset: Expr, buff: Expr) -> Expr:
+        """
+        write buff at offset into a cached page. The range must not cross the page end.
+        """
+        return Seq(
+            ScratchStore(None, Replace(GlobalBlob.cache_page(key), offset, buff), cache_base + key),
+            _cache_dirty.store(_cache_dirty.load() | ShiftLeft(Int(1), key)),
+        )
+
+    @staticmethod
+    def cache_get_byte(idx: Expr) -> Expr:
+        """
+        get_byte through the cache
+        """
+        key, offset = _key_and_offset(idx)
+        return GetByte(GlobalBlob.cache_page(key), offset)
+
+    @staticmethod
+    def cache_read_page(key: Expr, offset: Expr, length: Expr) -> Expr:
         """
-        write bytes between bstart and len(buff) to global storage
+        read length bytes at offset from a cached page. The range must not cross the page end.
         """
+        return Extract(GlobalBlob.cache_page(key), offset, length)
 
+    @staticmethod
+    @Subroutine(TealType.bytes)
+    def cache_read_span(bstart: Expr, length: Expr) -> Expr:
+        """
+        read_span through the cache
+        """
         start_key, start_offset = _key_and_offset(bstart)
-        stop_key, stop_offset = _key_and_offset(bstart + Len(buff))
 
-        key = ScratchVar()
-        start = ScratchVar()
-        stop = ScratchVar()
-        written = ScratchVar()
+        key = FrameLocal(0, TealType.uint64)
+        offset = FrameLocal(1, TealType.uint64)
 
-        init = key.store(start_key)
-        cond = key.load() <= stop_key
-        incr = key.store(key.load() + Int(1))
+        return Seq(
+            key.init(start_key),
+            offset.init(start_offset),
+            If(offset.load() + length <= page_size)
+            .Then(GlobalBlob.cache_read_page(key.load(), offset.load(), length))
+            .Else(
+                Concat(
+                    Substring(GlobalBlob.cache_page(key.load()), offset.load(), page_size),
+                    GlobalBlob.cache_read_page(key.load() + Int(1), Int(0), offset.load() + length - page_size),
+                )
+            ),
+        )
+
+    @staticmethod
+    @Subroutine(TealType.none)
+    def cache_write_span(bstart: Expr, buff: Expr) -> Expr:
+        """
+        write_span through the cache
+        """
+        start_key, start_offset = _key_and_offset(bstart)
 
-        delta = ScratchVar()
+        key = FrameLocal(0, TealType.uint64)
+        offset = FrameLocal(1, TealType.uint64)
+        head = FrameLocal(2, TealType.uint64)
 
         return Seq(
-            written.store(Int(0)),
-            For(init, cond, incr).Do(
+            key.init(start_key),
+            offset.init(start_offset),
+            head.init(page_size - offset.load()),
+            If(Len(buff) <= head.load())
+            .Then(GlobalBlob.cache_write_page(key.load(), offset.load(), buff))
+            .Else(
                 Seq(
-                    start.store(If(key.load() == start_key, start_offset, Int(0))),
-                    stop.store(If(key.load() == stop_key, stop_offset, page_size)),
-                    App.globalPut(
-                        intkey(key.load()),
-                        If(
-                            Or(stop.load() != page_size, start.load() != Int(0))
-                        )  # Its a partial write
-                        .Then(
-                            Seq(
-                                delta.store(stop.load() - start.load()),
-                                Concat(
-                                    Substring(
-                                        App.globalGet(intkey(key.load())),
-                                        Int(0),
-                                        start.load(),
-                                    ),
-                                    Extract(buff, written.load(), delta.load()),
-                                    Substring(
-                                        App.globalGet(intkey(key.load())),
-                                        stop.load(),
-                                        page_size,
-                                    ),
-                                ),
-                            )
-                        )
-                        .Else(
-                            Seq(
-                                delta.store(page_size),
-                                Extract(buff, written.load(), page_size),
-                            )
-                        ),
-                    ),
-                    written.store(written.load() + delta.load()),
+                    GlobalBlob.cache_write_page(key.load(), offset.load(), Extract(buff, Int(0), head.load())),
+                    GlobalBlob.cache_write_page(key.load() + Int(1), Int(0), Extract(buff, head.load(), Len(buff) - head.load())),
                 )
+            ),
+        )
+
+    @staticmethod
+    @Subroutine(TealType.none)
+    def cache_flush() -> Expr:
+        """
+        write every modified page back to global storage, one globalPut per page
+        """
+        key = ScratchVar()
+        return While(_cache_dirty.load()).Do(
+            Seq(
+                key.store(BitLen(_cache_dirty.load()) - Int(1)),
+                App.globalPut(intkey(key.load()), ScratchLoad(None, TealType.bytes, cache_base + key.load())),
+                _cache_dirty.store(_cache_dirty.load() ^ ShiftLeft(Int(1), key.load())),
             )
         )
@@ -1,5 +1,7 @@
 #!/usr/bin/python3
 from pyteal import *
+from pyteal.ast.abstractvar import AbstractVar
+from pyteal.ast.frame import FrameBury, FrameDig
 
 
 class CustomOp():
@@ -34,3 +36,61 @@ class InlineAssembly(LeafExpr):
 
     def type_of(self):
         return self.type
+
+
+class _Push(Expr):
+    """
+    Evaluates an expression and leaves its value on the stack. Typed none, so it can be a
+    statement of a Seq.
+    """
+    def __init__(self, value: Expr) -> None:
+        super().__init__()
+        self.value = value
+
+
+    def __teal__(self, options: "CompileOptions"):
+        return self.value.__teal__(options)
+
+
+    def __str__(self):
+        return "(Push: {})".format(self.value)
+
+
+    def type_of(self):
+        return TealType.none
+
+
+    def has_return(self):
+        return False
+
+
+class FrameLocal(AbstractVar):
+    """
+    A subroutine local variable kept on the stack, above the frame pointer of the subroutine
+    (AVM v8 proto frames), instead of in a scratch slot. init() pushes the first value, which
+    saves the store, and load/store are frame_dig/frame_bury. The frame is dropped on return.
+
+    The locals of a subroutine are numbered from 0 in the order they are initialized, and each
+    init() must be a statement of the subroutine body run when only the lower-numbered locals
+    are on the stack: at the top level of the body or in both branches of an If, never in a loop.
+    """
+    def __init__(self, index: int, type: TealType = TealType.anytype) -> None:
+        super().__init__()
+        self.index = index
+        self.type = type
+
+
+    def storage_type(self) -> TealType:
+        return self.type
+
+
+    def init(self, value: Expr) -> Expr:
+        return _Push(value)
+
+
+    def store(self, value: Expr) -> Expr:
+        return FrameBury(value, self.index, inferred_type=self.type)
+
+
+    def load(self) -> Expr:
+        return FrameDig(self.index, inferred_type=self.type)
@@ -2,6 +2,10 @@ from pyteal import *
 
 ON_CALL_APP = Bytes("base16", "068101")  # v6 program "int 1"
 
+# Pre-deployed budget pad application (see budgetpad.py). It must be present in the foreign
+# applications array of every call that pools budget through it.
+PAD_APP_ID = Tmpl.Int("TMPL_I_PAD_APP_ID")
+
 def _construct_itxn() -> Expr:
     return Seq(
         InnerTxnBuilder.Begin(),
@@ -17,19 +21,57 @@ def _construct_itxn() -> Expr:
         InnerTxnBuilder.Submit(),
     )
 
+def _construct_pad_itxn() -> Expr:
+    return Seq(
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields(
+            {
+                TxnField.type_enum: TxnType.ApplicationCall,
+                TxnField.application_id: PAD_APP_ID,
+                TxnField.fee: Int(0),
+            }
+        ),
+        InnerTxnBuilder.Submit(),
+    )
+
+def _top_up(min_budget: Expr, construct_itxn) -> Expr:
+    return While(Global.opcode_budget() < min_budget).Do(
+        construct_itxn()
+    )
+
+@Subroutine(TealType.none)
+def _ensure_budget_create(min_budget: Expr) -> Expr:
+    return _top_up(min_budget, _construct_itxn)
+
+@Subroutine(TealType.none)
+def _ensure_budget_pad(min_budget: Expr) -> Expr:
+    return _top_up(min_budget, _construct_pad_itxn)
+
 class OpPool:
+    """
+    Opcode budget pooling through inner application calls.
+
+    Modes, selected at compile time:
+
+    create      Each inner call creates and deletes a throwaway application. Needs no setup.
+    pad         Each inner call is a NoOp call to the pre-deployed budget pad application, a lighter
+                inner transaction. Its id is bound through the TMPL_I_PAD_APP_ID template variable.
+    """
+
+    CREATE = "create"
+    PAD = "pad"
+    MODES = (CREATE, PAD)
+
+    def __init__(self, mode: str = CREATE):
+        assert mode in OpPool.MODES, "unknown OpPool mode " + mode
+        self.mode = mode
+
+    def ensure_budget(self, min_budget: Expr) -> Expr:
+        """Top up the opcode budget, one inner call at a time, only while the remaining
+        budget is below min_budget. Nothing is bought when the pooled budget already
+        suffices, so callers pay for the budget they actually use. Inner calls are
+        fee-pooled: the outer transaction fee must cover each one issued."""
 
-    @Subroutine(TealType.none)
-    def maximize_budget(fee: Expr) -> Expr:
-        """Maximize the available opcode budget without spending more than the given fee.
-        Note: the available budget just prior to calling maximize_budget() must be
-        high enough to execute the budget increase code. The exact budget required
-        depends on the provided fee expression, but a budget of ~25 should be
-        sufficient for most use cases. If lack of budget is an issue then consider
-        moving the call to maximize_budget() earlier in the pyteal program."""
-
-        i = ScratchVar(TealType.uint64)
-        n = fee / Global.min_txn_fee()
-        return For(i.store(Int(0)), i.load() < n, i.store(i.load() + Int(1))).Do(
-            _construct_itxn()
-        )
\ No newline at end of file
+        if self.mode == OpPool.PAD:
+            return _ensure_budget_pad(min_budget)
+        return _ensure_budget_create(min_budget)
@@ -4,7 +4,7 @@
 
 The Pricecaster Onchain Program
 
-Version 7.5.1
+Version 9.6
 
 (c) 2022-23 C3 
 
@@ -24,11 +24,33 @@ v7.0 - C3-Testnet deployment version: Use linear-addressable global space for en
 v7.1 - Configuration flags.  Old publications are discarded.
 v7.5 - Fix checking attestation size 
 v7.5.1 - Fixed regression in attestation publication
+v7.6 - Page-aligned slot layout build option. Loop-free slot reads and writes.
+v7.7 - Budget pad application build option for opcode budget pooling.
+v7.8 - Opcode budget is topped up on demand instead of bought up front.
+v8.0 - ASA decimals cached in the slot at allocation: store takes no asset references.
+v8.1 - Store accepts batches of up to MAX_ATTESTATIONS (12) attestations.
+v8.2 - Write-combining store build option: slot writes are combined per global key.
+v8.3 - Box storage layout build option: price slots in application boxes.
+v8.4 - Read-only get, getmany and getasa methods.
+v8.5 - Compact slot format build option (78-byte slots).
+v8.6 - Reset zeroes only the allocated slots, optionally from a given slot.  Free method.
+v8.7 - Storemulti method: several Pyth payloads published in one call.
+v8.8 - Stale and unchanged attestations are skipped without writing.  Deviation threshold mode.
+v8.9 - Store logs one binary update record listing the slots written.
+v9.0 - Update sequence number and change table in the system slot.
+v9.1 - Subroutine locals kept in the subroutine frame instead of scratch slots.
+v9.2 - Price slots are updated in place from the stored slot: fewer copies per attestation.
+v9.3 - ASA index build option: allocated slots found by binary search on a sorted ASA ID index.
+v9.4 - Allocmany method: several slots allocated in one call.  Freed slots are reused by alloc.
+v9.5 - Pyth accumulator updates: setroot and storeproofs methods, prices proven against a Merkle root.
+v9.6 - ASA aliases: an ASA read from the slot of another ASA tracking the same feed.
 
 This program stores price data verified from Pyth VAA messaging. To accept data, this application
 requires to be the last of the Wormhole VAA verification transaction group.
 
-The payload format must be V3, with batched message support.
+The payload format must be V3, with batched message support.  Pyth accumulator updates are 
+accepted too: setroot stores the Merkle root carried by a verified VAA, then storeproofs publishes
+price messages proven against it, in as many calls as needed, without verifying another VAA.
 
 ------------------------------------------------------------------------------------------------
 
@@ -41,27 +63,29 @@ The global state is treated like a linear array (Blob) of entries with the follo
 key             data
 value           Linear array packed with fields as follow: 
 
-                Bytes
+                Bytes   Bytes (compact format)
 
-                8               asa_id
+                8       8       asa_id
                 
-                8               normalized price
+                8       8       normalized price
 
-                8               price
-                8               confidence
+                8       8       price
+                8       8       confidence
 
-                4               exponent
+                4       1       exponent
 
-                8               price EMA
-                8               confidence EMA
+                8       8       price EMA
+                8       8       confidence EMA
 
-                8               att time
-                8               publish time
+                8       4       att time
+                8       4       publish time
 
-                8               prev_publish_time
-                8               prev_price
-                8               prev_confidence
-TOTAL           92 Bytes.
+                8       4       prev_publish_time
+                8       8       prev_price
+                8       8       prev_confidence
+
+                1       1       asa decimals (cached at allocation)
+TOTAL           93      78 Bytes.
 
 First byte of storage is reserved to keep number of entries.
 
@@ -69,29 +93,90 @@ First byte of storage is reserved to keep number of entries.
 
 With this in mind, there is space for 127 * 63 bytes of space = 8001 bytes. 
 As the last slot space is reserved for internal use and future expansion (SYSTEM_SLOT), there are 
-8001/92 = 86   minus 1,  85 slots available for price storage.
+8001/93 = 86   minus 1,  85 slots available for price storage.
+
+When compiled with the aligned layout (--layout aligned), slots never straddle two keys: slot N
+starts at byte 0 of key N, so there are 63 minus 1, 62 slots available for price storage.  The last
+byte of the blob (offset 8000) holds the layout id: 0 = linear, 1 = aligned, 2 = box.
+
+When compiled with the box layout (--layout box), price slots are kept in application boxes instead:
+box N (2-byte big-endian name) holds slots 11*N .. 11*N+10, so each box fits the 1024-byte I/O quota 
+of one box reference.  Slots are addressed by a 2-byte index, so 65535 slots are available for price 
+storage.  The blob keeps only the system slot (at offset 0) and the layout id.  The application 
+account must be funded for the minimum balance of the boxes it creates.
+
+When compiled with the compact slot format (--slot-format compact), slots are 78 bytes: the exponent
+is kept in one byte and the three timestamps as uint32 seconds.  The linear layout then holds 
+8001/78 = 102 minus 1, 101 price slots, and a box 13 slots.  The high nibble of the layout id byte
+holds the slot format: 0 = full, 1 = compact.
+
+When compiled with the ASA index (--asa-index), the (ASA ID, slot) pairs of the allocated slots are
+kept sorted by ASA ID in the "idx" box, kept up to date by alloc, free and reset.  Slots are found
+by binary search on it, so store takes an array of ASA IDs, without slot numbers.  The index holds
+at most (1024 - 2) / (8 + slot index size) entries, which limits the box layout to 102 slots.  
+Bit 7 of the layout id byte is set.
+
+ASAs tracking the same Pyth feed as an allocated ASA (wrapped or bridged variants) can be aliased to
+its slot instead of taking one of their own: the aliases, at most (1024 - 2) / 19 = 53, are kept in
+the "als" box, and getasa reads an aliased ASA from the canonical slot with its own decimals.  The
+feed is published once.
 
 The system slot layout is as follows:
 
 Byte 
 0           Last allocated slot.  
 1           Config flags.
-2..91       Reserved
+2..9        Reserved
+10..11      Deviation threshold, in basis points (uint16).
+12..15      Heartbeat interval, in seconds (uint32).
+16..23      Update sequence number (uint64).
+24..55      Change table.
+56..57      Free list head: the last freed slot plus one, 0 if none (uint16).
+58..77      Pyth accumulator Merkle root, set by setroot (20 bytes).
+78..        Reserved
+
+With the box layout, byte 0 is unused and bytes 2..9 hold the entry count (uint64).
 ------------------------------------------------------------------------------------------------
 """
+import sys
+if __name__ == "__main__" and "--source-map" in sys.argv:
+    # PyTeal records the Python source of expressions only if enabled before it is imported.
+    from feature_gates import FeatureGates
+    FeatureGates.set_sourcemap_enabled(True)
+
 from inspect import currentframe
 from pyteal import *
 from globals import *
 from oppool import OpPool
 from globalblob import *
-import sys
+from inlineasm import FrameLocal
+import profiling
+import argparse
+import json
 
 METHOD = Txn.application_args[0]
 ASAID_SLOT_ARRAY = Txn.application_args[1]
 PYTH_PAYLOAD = Txn.application_args[2]
 ALLOC_ASA_ID = Txn.application_args[1]
 FLAGS_ARG = Txn.application_args[1]
-SLOT_TEMP = ScratchVar(TealType.uint64)
+DEVIATION_BPS_ARG = Txn.application_args[2]
+HEARTBEAT_ARG = Txn.application_args[3]
+GET_ARG = Txn.application_args[1]
+RESET_ARG = Txn.application_args[1]
+FREE_ARG = Txn.application_args[1]
+ALLOC_MANY_ARG = Txn.application_args[1]
+ROOT_PAYLOAD_ARG = Txn.application_args[1]
+ALIAS_ASA_ARG = Txn.application_args[1]
+ALIAS_SLOT_ARG = Txn.application_args[2]
+PROOF_UPDATES_ARG = Txn.application_args[2]
+DEVIATION_MODE = ScratchVar(TealType.uint64)
+DEVIATION_BPS = ScratchVar(TealType.uint64)
+HEARTBEAT = ScratchVar(TealType.uint64)
+UPDATE_LOG = ScratchVar(TealType.bytes)
+TRACKING = ScratchVar(TealType.bytes)
+TRACKING_SEQ_BYTE = ScratchVar(TealType.uint64)
+MERKLE_ROOT = ScratchVar(TealType.bytes)
+MERKLE_PATH = ScratchVar(TealType.bytes)
 WORMHOLE_CORE_ID = App.globalGet(Bytes("coreid"))
 
 PYTH_MAGIC_HEADER = Bytes("\x50\x32\x57\x48")
@@ -114,42 +199,353 @@ PYTH_FIELD_ATTESTATION_SIZE_LEN = Int(2)
 PYTH_BEGIN_PAYLOAD_OFFSET = Int(15)
 PRODUCT_PRICE_KEY_LEN = Int(64)
 
+# Pyth accumulator updates. A VAA carries the root of a Merkle tree of price messages, and each 
+# message comes with its proof, the sibling hashes from its leaf up.  Hashes are keccak256 
+# truncated to 20 bytes:
+#
+#   leaf    keccak256(0x00 || message)
+#   node    keccak256(0x01 || lower || higher)      children ordered as byte strings
+#
+# Root payload: "AUWV", update type (0: Wormhole Merkle), Pythnet slot (uint64), ring size (uint32),
+# root (20 bytes).  Price message (type 0), the only message type published:
+#
+#   0   type            1   feed id         33  price           41  confidence      
+#   49  exponent        53  publish time    61  prev publish    69  price EMA       77  conf EMA
+#
+ACCUMULATOR_ROOT_HEADER = Bytes("base16", "0x4155575600")    # "AUWV", Wormhole Merkle
+ACCUMULATOR_ROOT_HEADER_LEN = Int(5)
+ACCUMULATOR_ROOT_PAYLOAD_LEN = Int(37)
+ACCUMULATOR_ROOT_OFFSET = Int(17)
+MERKLE_HASH_SIZE = Int(20)
+MERKLE_LEAF_PREFIX = Bytes("base16", "0x00")
+MERKLE_NODE_PREFIX = Bytes("base16", "0x01")
+PRICE_MESSAGE_TYPE = Int(0)
+PRICE_MESSAGE_LEN = Int(85)
+SYS_MERKLE_ROOT_OFFSET = 58
+
 # Stored prices have two blocks: 
 # BLOCK 1 (price,conf,expo,ema_p,ema_c)
 # BLOCK 2 (att_time,pub_time,prev_pub_time,prev_price,prev_conf)
 #
 
-SLOT_SIZE = 92
-MAX_PRICE_SLOTS = int((63 * 127 / SLOT_SIZE) - 1)
-FREE_ENTRY = Bytes('base16', '0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000')
-SYSTEM_SLOT_INDEX = Int(85)
-SYSTEM_SLOT_OFFSET = SYSTEM_SLOT_INDEX * Int(SLOT_SIZE)
+# Slot formats, selected at compile time (--slot-format).
+#
+# full:     the format described above, 93 bytes.
+# compact:  78 bytes. The exponent is kept in one byte (two's complement), and the attestation,
+#           publish and previous publish times as uint32 Unix seconds (valid until 2106).
+#
+# The format id is kept in the high nibble of the layout id byte.
+#
+SLOT_FORMAT_FULL = "full"
+SLOT_FORMAT_COMPACT = "compact"
+SLOT_FORMAT_IDS = { SLOT_FORMAT_FULL: 0, SLOT_FORMAT_COMPACT: 1 }
+
+SLOT_FORMAT = SLOT_FORMAT_FULL
+
+# Slot layouts, selected at compile time (--layout). 
+#
+# linear:   slots are packed back to back. A slot touches one or two keys.
+# aligned:  slots never cross a key boundary, so every slot access touches exactly one key, 
+#           at the cost of the unused tail of each page.
+# box:      slots are kept in fixed-size application boxes, read and written in place. The blob
+#           holds only the system slot.
+#
+# The layout id is kept in the last byte of the blob so off-chain readers can tell them apart.
+#
+LAYOUT_LINEAR = "linear"
+LAYOUT_ALIGNED = "aligned"
+LAYOUT_BOX = "box"
+LAYOUT_IDS = { LAYOUT_LINEAR: 0, LAYOUT_ALIGNED: 1, LAYOUT_BOX: 2 }
+LAYOUT_ID_OFFSET = Int(max_keys.value * page_size.value - 1)
+
+# Box layout: each box holds as many slots as fit the read/write quota of one box reference,
+# and slots are addressed with a 2-byte index.
+BOX_IO_QUOTA = 1024
+BOX_MAX_SLOTS = 0xFFFF
+BOX_ENTRY_COUNT_OFFSET = Int(2)
+
+SLOT_LAYOUT = LAYOUT_LINEAR
+
+# Opcode budget pooling mode, selected at compile time (--budget-pool). See OpPool.
+BUDGET_POOL = OpPool.CREATE
+
+# Write-combining store, selected at compile time (--write-combining). Slot reads and writes in 
+# store go through the GlobalBlob page cache: each touched key is read once and written once, 
+# roughly halving global state operations for adjacently allocated slots, in exchange for more 
+# opcodes per attestation spent on cache bookkeeping.
+WRITE_COMBINING = False
+
+# ASA index, selected at compile time (--asa-index). The allocated slots are indexed by ASA ID in
+# one application box, sized for the I/O quota of one box reference:
+#
+#   uint16      number of entries
+#   then, for each allocated slot, sorted by ASA ID:
+#   uint64      ASA ID
+#   uint8       slot (uint16 with the box layout)
+#
+# find_asaid_index is then a binary search instead of a scan of the slots, cheap enough to look
+# up every attestation of a store call by ASA ID.  Freed slots are removed from the index.  The 
+# calls that read or write the index (store, storemulti, alloc, free, reset and getasa) must 
+# reference its box, and the application account must be funded for its minimum balance.
+ASA_INDEX = False
+ASA_INDEX_BOX = Bytes("idx")
+ASA_INDEX_COUNT_SIZE = 2
+ASA_INDEX_LAYOUT_FLAG = 0x80        # set in the layout id byte
+
+# ASA aliases. An ASA tracking the same feed as an allocated ASA, such as a wrapped or bridged 
+# variant, is aliased to the slot of that canonical ASA instead of taking a slot of its own, so the
+# feed is stored and written once.  getasa reads an aliased ASA from the canonical slot, with its 
+# own ASA ID and decimals and the normalized price computed for them.  The aliases are kept, in no
+# particular order, in one application box sized for the I/O quota of one box reference:
+#
+#   for each alias:
+#   uint64      ASA ID
+#   uint64      canonical ASA ID
+#   uint16      canonical slot
+#   uint8       ASA decimals
+#   then, in the last two bytes:
+#   uint16      number of aliases
+#
+# An alias keeps the canonical ASA ID, so once the slot is freed or reused, getasa refuses it.
+ALIAS_BOX = Bytes("als")
+ALIAS_ENTRY_SIZE = 19
+ALIAS_COUNT_SIZE = 2
+ALIAS_CAPACITY = (BOX_IO_QUOTA - ALIAS_COUNT_SIZE) // ALIAS_ENTRY_SIZE
+
+# Opcode budget topped up (lazily, see OpPool.ensure_budget) before each unit of work.
+# Each covers the most expensive path until the next check, plus a margin.
+ATTESTATION_BUDGET = Int(550)       # one store loop iteration (publish path) and the final approval
+ZERO_BUDGET = Int(1600)             # zeroing the whole blob and the rest of bootstrap
+ZERO_PAGE_BUDGET = Int(30)          # zeroing one key in reset, per key touched, plus 4 for the rest
+FIND_ITERATION_BUDGET = Int(200)    # one find_asaid_index loop iteration
+INDEX_SEARCH_BUDGET = Int(200)      # one find_asaid_index binary search, with the ASA index
+INDEX_ENTRY_BUDGET = Int(30)        # one ASA index entry kept or dropped by reset
+ALLOC_BUDGET = Int(400)             # one allocmany loop iteration and the final approval
+FREE_LINK_BUDGET = Int(300)         # one free list slot kept or dropped by reset, and the last relink
+GROUP_TXN_CHECK_BUDGET = Int(50)    # one check_group_tx full check, per transaction in the group
+GET_SLOT_BUDGET = Int(150)          # one getmany loop iteration and the final approval
+ALIAS_ENTRY_BUDGET = Int(20)        # one alias_search loop iteration
+ALIAS_BUDGET = Int(200)             # the rest of an alias call, or of resolving an alias in getasa
+MERKLE_LEVEL_BUDGET = Int(300)      # one merkle_verify level (keccak256 costs 130), and the rest of the update until published
 
 BLOCK1_OFFSET = Int(64)
 BLOCK1_LEN = Int(36)
 BLOCK1_NORMALIZED_OFFSET = Int(72)
-BLOCK1_EXPONENT_OFFSET = Int(64) + Int(16)
+BLOCK1_EXPONENT_OFFSET = Int(80)
 BLOCK1_STATUS_OFFSET = Int(100)
 BLOCK1_STATUS_LEN = Int(1)
 BLOCK2_OFFSET = Int(109)
 BLOCK2_LEN = Int(40)
 
-PUB_TIME_FIELD_OFFSET = Int(68)
+ATTESTATION_PUB_TIME_OFFSET = Int(117)
+
+# Slot contents for each format: the ASA ID and the normalized price, then these runs of the 
+# attestation as (offset, length), then the cached ASA decimals byte. This is the only place 
+# the slot formats are defined; sizes and offsets below are derived from it.
+SLOT_ATTESTATION_RUNS = {
+    SLOT_FORMAT_FULL: [
+        (BLOCK1_OFFSET.value, BLOCK1_LEN.value),    # price, confidence, exponent, price EMA, conf EMA
+        (BLOCK2_OFFSET.value, BLOCK2_LEN.value),    # att_time, pub_time, prev_pub_time, prev_price, prev_conf
+    ],
+    SLOT_FORMAT_COMPACT: [
+        (64, 16),       # price, confidence
+        (83, 17),       # exponent (low byte), price EMA, conf EMA
+        (113, 4),       # att_time (low 4 bytes)
+        (121, 4),       # pub_time (low 4 bytes)
+        (129, 20),      # prev_pub_time (low 4 bytes), prev_price, prev_conf
+    ],
+}
+
+# Largest batch accepted by store. All application arguments of a call share a 2048-byte limit,
+# and each attestation takes its payload bytes plus an (ASA ID, slot) tuple of 9 bytes (10 with
+# the box layout, 8 with the ASA index):
+#
+#   len("store") + 15 (payload header) + n * (149 + 10) <= 2048   =>   n <= 12
+#
+# The other per-call limits are not binding at this size: at most one log per attestation (32), 
+# no foreign references, and the budget is topped up per attestation (see ATTESTATION_BUDGET).
+MAX_ATTESTATIONS = Int(12)
 
-ASAID_SLOT_TUPLE_SIZE = Int(9)
+# Largest batch accepted by allocmany. The decimals of each ASA but ALGO are read from its asset
+# parameters, so it must be in the foreign assets array, and a call references at most 8 assets,
+# applications, accounts and boxes altogether.
+MAX_ALLOC_BATCH = Int(8)
+
+# Configuration flags (system slot byte 1). Bit 7 is the testing-mode flag, set at bootstrap only.
+#
+# FLAG_DEVIATION    Deviation threshold mode: store rewrites a slot only when the price or the 
+#                   confidence moved more than the deviation threshold, or the heartbeat interval 
+#                   elapsed since the stored publish time. Both are set with setflags.
+FLAG_DEVIATION = Int(0x01)
+SYS_DEVIATION_BPS_OFFSET = 10
+SYS_HEARTBEAT_OFFSET = 12
+MAX_DEVIATION_BPS = Int(10000)
+
+# Update log: each store call logs one binary record listing the slots it wrote, so readers can
+# follow updates from transaction logs instead of reading the global state. Version 1 format:
+#
+#   "PCU" 0x01                          header: tag and format version
+#   then, for each slot written, in publication order (26 bytes each):
+#   uint16      slot
+#   uint64      ASA ID
+#   uint64      normalized price
+#   uint64      publish time
+#
+# At most MAX_ATTESTATIONS entries are written per call, 316 bytes, within the 1024-byte log limit.
+UPDATE_LOG_HEADER = Bytes("PCU\x01")
+
+# Change tracking. The update sequence number counts the calls that wrote price slots (store, 
+# storemulti, alloc, free, reset). Slot N maps to change table entry N mod CHANGE_TABLE_SIZE, which
+# holds the low byte of the sequence number of the last call that wrote one of its slots.  A reader
+# that parsed the slots at sequence number S and reads S' < S + 256 needs to parse again only the 
+# slots whose entry e gives 0 < (e - S) mod 256 <= S' - S.  Slots sharing an entry may be parsed 
+# needlessly, never missed.
+SYS_UPDATE_SEQ_OFFSET = 16
+CHANGE_TABLE_SIZE = 32
+TRACKING_SIZE = Int(8 + CHANGE_TABLE_SIZE)      # sequence number and change table
 UINT64_SIZE = Int(8)
 UINT32_SIZE = Int(4)
 
+# Free list. Freed slots are linked in a list, reused by alloc last freed first.  The head is kept
+# in the system slot and each freed slot holds the next one, after its FREE_SLOT_ASA_ID, as a link:
+# the slot plus one (uint16), 0 at the end of the list.  A zeroed blob has an empty list.
+SYS_FREE_LIST_OFFSET = 56
+FREE_LINK_SIZE = Int(2)
+
 ALGO_DECIMALS = Int(6)
 PICO_DOLLARS_DECIMALS = Int(12)
 
 IGNORE_ATTESTATION = Int(0xFFFFFFFFFFFFFFFF)
+FREE_SLOT_ASA_ID = Bytes("base16", "0xFFFFFFFFFFFFFFFF")  # ASA ID of freed slots, never published to
 ENTRY_NOT_FOUND    = Int(0xFFFFFFFFFFFFFF00)
 GLOBAL_SPACE_FULL  = Int(0xFFFFFFFFFFFFFF01)
 
 def XAssert(cond):
     return Assert(And(cond, Int(currentframe().f_back.f_lineno)))
 
+#
+# Layout-dependent values. These are evaluated when the program is built, so the layout
+# can be selected after this module is imported.
+#
+
+def slot_size():
+    return UINT64_SIZE.value * 2 + sum(length for _, length in SLOT_ATTESTATION_RUNS[SLOT_FORMAT]) + 1
+
+def slot_decimals_offset():
+    return Int(slot_size() - 1)
+
+def slot_field_offset(attestation_offset):
+    # Offset in the slot of the byte copied from the given attestation offset.
+    position = UINT64_SIZE.value * 2
+    for offset, length in SLOT_ATTESTATION_RUNS[SLOT_FORMAT]:
+        if offset <= attestation_offset < offset + length:
+            return Int(position + attestation_offset - offset)
+        position += length
+    raise ValueError("attestation offset %d is not kept in the slot" % attestation_offset)
+
+def slot_pub_time(slot_data):
+    # Publish time stored in a slot. The compact format keeps its low 4 bytes.
+    if SLOT_FORMAT == SLOT_FORMAT_COMPACT:
+        return ExtractUint32(slot_data, slot_field_offset(ATTESTATION_PUB_TIME_OFFSET.value + 4))
+    return ExtractUint64(slot_data, slot_field_offset(ATTESTATION_PUB_TIME_OFFSET.value))
+
+def slot_exponent(slot_data):
+    # Exponent stored in a slot, as the uint32 of the attestation. The compact format keeps its low byte.
+    if SLOT_FORMAT == SLOT_FORMAT_COMPACT:
+        exponent = GetByte(slot_data, slot_field_offset(BLOCK1_EXPONENT_OFFSET.value + 3))
+        return If(exponent < Int(0x80), exponent, exponent + Int(0xFFFFFF00))
+    return ExtractUint32(slot_data, slot_field_offset(BLOCK1_EXPONENT_OFFSET.value))
+
+def slots_per_page():
+    return page_size.value // slot_size()
+
+def slots_per_box():
+    return BOX_IO_QUOTA // slot_size()
+
+def num_slots():
+    # Total number of slots in the blob, including the system slot.
+    if SLOT_LAYOUT == LAYOUT_ALIGNED:
+        return max_keys.value * slots_per_page()
+    return (max_keys.value * page_size.value) // slot_size()
+
+def getmany_max_slots():
+    # All logs of a call share a 1024-byte limit.
+    return 1024 // slot_size()
+
+def max_price_slots():
+    if SLOT_LAYOUT == LAYOUT_BOX:
+        return BOX_MAX_SLOTS
+    return num_slots() - 1
+
+def slot_index_size():
+    # Size in bytes of the slot index in the store (ASA ID, slot) tuples.
+    return 2 if SLOT_LAYOUT == LAYOUT_BOX else 1
+
+def asaid_slot_tuple_size():
+    # With the ASA index, store takes ASA IDs only.
+    if ASA_INDEX:
+        return UINT64_SIZE
+    return Int(UINT64_SIZE.value + slot_index_size())
+
+def slot_index_at(data, offset):
+    # Slot index stored at a byte offset, as in the store tuples and the ASA index entries.
+    return (ExtractUint16 if slot_index_size() == 2 else GetByte)(data, offset)
+
+def slot_index_bytes(slot):
+    return Extract(Itob(slot), Int(8 - slot_index_size()), Int(slot_index_size()))
+
+def asa_index_entry_size():
+    return UINT64_SIZE.value + slot_index_size()
+
+def asa_index_capacity():
+    # Entries that fit one box reference, if fewer than the price slots (pyteal exports a min).
+    entries = (BOX_IO_QUOTA - ASA_INDEX_COUNT_SIZE) // asa_index_entry_size()
+    return entries if entries < max_price_slots() else max_price_slots()
+
+def asa_index_count_offset():
+    # The entry count is kept after the entries, so entry N starts at byte N * entry size.
+    return asa_index_capacity() * asa_index_entry_size()
+
+def asa_index_box_size():
+    return asa_index_count_offset() + ASA_INDEX_COUNT_SIZE
+
+def asa_index_entry_offset(position):
+    return position * Int(asa_index_entry_size())
+
+def system_slot_index():
+    return Int(num_slots() - 1)
+
+def slot_page(slot):
+    # Key and in-page offset of a slot, aligned layout only.
+    if slots_per_page() == 1:
+        return slot, Int(0)
+    return slot / Int(slots_per_page()), (slot % Int(slots_per_page())) * Int(slot_size())
+
+def slot_offset(slot):
+    # Byte offset of a slot in the blob.
+    if SLOT_LAYOUT == LAYOUT_ALIGNED:
+        key, offset = slot_page(slot)
+        return key * page_size + offset
+    return slot * Int(slot_size())
+
+def slot_box(slot):
+    # Box name and in-box offset of a slot, box layout only.
+    return Extract(Itob(slot / Int(slots_per_box())), Int(6), Int(2)), (slot % Int(slots_per_box())) * Int(slot_size())
+
+def system_slot_offset(field=0):
+    # Byte offset of the system slot (or of a field in it) in the blob. This is a constant,
+    # so GlobalBlob resolves the key and in-page offset at compile time.
+    if SLOT_LAYOUT == LAYOUT_BOX:
+        offset = 0
+    elif SLOT_LAYOUT == LAYOUT_ALIGNED:
+        offset = (num_slots() - 1) // slots_per_page() * page_size.value + (num_slots() - 1) % slots_per_page() * slot_size()
+    else:
+        offset = (num_slots() - 1) * slot_size()
+    return Int(offset + field)
+
+def read_system_slot():
+    return GlobalBlob.read_span(system_slot_offset(), Int(slot_size()))
+
 @Subroutine(TealType.uint64)
 def is_creator():
     return Txn.sender() == Global.creator_address()
@@ -167,13 +563,21 @@ def check_group_tx():
     #
     # There must be at least one app call to Wormhole Core Id.
     #
-    i = SLOT_TEMP
-    is_corecall = ScratchVar(TealType.uint64)
+    # The Wormhole verification steps (verifySigs calls and the verifyVAA call) come first 
+    # in the group, so a leading run of core calls is skipped checking only the application id. 
+    # Any other transaction goes through the full check.
+    #
+    last = FrameLocal(0, TealType.uint64)
+    i = FrameLocal(1, TealType.uint64)
+    is_corecall = FrameLocal(2, TealType.uint64)
     return Seq([
-        is_corecall.store(Int(0)),
-        For(i.store(Int(0)),
-            i.load() < Global.group_size() - Int(1),
-            i.store(i.load() + Int(1))).Do(Seq([
+        last.init(Global.group_size() - Int(1)),
+        i.init(Int(0)),
+        While(And(i.load() < last.load(), Gtxn[i.load()].application_id() == WORMHOLE_CORE_ID)).Do(
+            i.store(i.load() + Int(1))
+        ),
+        is_corecall.init(i.load() > Int(0)),
+        For(Seq(), i.load() < last.load(), i.store(i.load() + Int(1))).Do(Seq([
                 If (Gtxn[i.load()].application_id() == WORMHOLE_CORE_ID, is_corecall.store(Int(1))),
                 Assert(
                     Or(
@@ -190,26 +594,202 @@ def check_group_tx():
     ])
 
 
+#
+# ASA index (ASA_INDEX builds). The index is read whole, one box read, and searched in the bytes.
+#
+
+def read_asa_index():
+    return App.box_extract(ASA_INDEX_BOX, Int(0), Int(asa_index_box_size()))
+
+def asa_index_count(index):
+    return ExtractUint16(index, Int(asa_index_count_offset()))
+
+def write_asa_index_count(count):
+    return App.box_replace(ASA_INDEX_BOX, Int(asa_index_count_offset()), Extract(Itob(count), Int(6), Int(2)))
+
+@Subroutine(TealType.uint64)
+def asa_index_search(index, asaId):
+    # Binary search of the ASA index contents: the position of the first entry with an ASA ID
+    # not below asaId, or the entry count if there is none.
+    low = FrameLocal(0, TealType.uint64)
+    high = FrameLocal(1, TealType.uint64)
+    middle = FrameLocal(2, TealType.uint64)
+    return Seq([
+        low.init(Int(0)),
+        high.init(asa_index_count(index)),
+        middle.init(Int(0)),
+        While(low.load() < high.load()).Do(Seq([
+            middle.store((low.load() + high.load()) / Int(2)),
+            If(ExtractUint64(index, asa_index_entry_offset(middle.load())) < asaId,
+               low.store(middle.load() + Int(1)),
+               high.store(middle.load()))
+        ])),
+        Return(low.load())
+    ])
+
+@Subroutine(TealType.none)
+def asa_index_insert(asaId, slot):
+    # Adds a newly allocated slot to the ASA index. The index box is created with the first slot.
+    # An ASA can have one slot only.
+    index = FrameLocal(0, TealType.bytes)
+    count = FrameLocal(1, TealType.uint64)
+    position = FrameLocal(2, TealType.uint64)
+    return Seq([
+        Pop(App.box_create(ASA_INDEX_BOX, Int(asa_index_box_size()))),
+        index.init(read_asa_index()),
+        count.init(asa_index_count(index.load())),
+        XAssert(count.load() < Int(asa_index_capacity())),
+        position.init(asa_index_search(index.load(), asaId)),
+        If(position.load() < count.load(),
+           XAssert(ExtractUint64(index.load(), asa_index_entry_offset(position.load())) != asaId)),
+
+        # The new entry, then the entries from the position moved one place up.
+        App.box_replace(ASA_INDEX_BOX, asa_index_entry_offset(position.load()), Concat(
+            Itob(asaId), slot_index_bytes(slot),
+            Extract(index.load(), asa_index_entry_offset(position.load()), asa_index_entry_offset(count.load() - position.load())))),
+        write_asa_index_count(count.load() + Int(1)),
+    ])
+
+@Subroutine(TealType.none)
+def asa_index_remove(asaId):
+    # Removes the slot of an ASA from the ASA index, if indexed.
+    index = FrameLocal(0, TealType.bytes)
+    count = FrameLocal(1, TealType.uint64)
+    position = FrameLocal(2, TealType.uint64)
+    return Seq([
+        index.init(read_asa_index()),
+        count.init(asa_index_count(index.load())),
+        position.init(asa_index_search(index.load(), asaId)),
+        If(position.load() < count.load(),
+           If(ExtractUint64(index.load(), asa_index_entry_offset(position.load())) == asaId, Seq([
+
+                # The entries above the position moved one place down, the last one zeroed.
+                App.box_replace(ASA_INDEX_BOX, asa_index_entry_offset(position.load()), Concat(
+                    Extract(index.load(), asa_index_entry_offset(position.load() + Int(1)),
+                            asa_index_entry_offset(count.load() - position.load() - Int(1))),
+                    BytesZero(Int(asa_index_entry_size())))),
+                write_asa_index_count(count.load() - Int(1)),
+           ]))),
+    ])
+
+@Subroutine(TealType.none)
+def asa_index_truncate(first):
+    # Removes the slots from `first` on from the ASA index.
+    index = FrameLocal(0, TealType.bytes)
+    count = FrameLocal(1, TealType.uint64)
+    kept = FrameLocal(2, TealType.bytes)
+    i = FrameLocal(3, TealType.uint64)
+    op_pool = OpPool(BUDGET_POOL)
+    return Seq([
+        index.init(read_asa_index()),
+        count.init(asa_index_count(index.load())),
+        # The entries, and as much for the rest of reset as for 8 more entries.
+        op_pool.ensure_budget((count.load() + Int(8)) * INDEX_ENTRY_BUDGET),
+        kept.init(Bytes("")),
+        For(i.init(Int(0)), i.load() < count.load(), i.store(i.load() + Int(1))).Do(
+            If(slot_index_at(index.load(), asa_index_entry_offset(i.load()) + UINT64_SIZE) < first,
+               kept.store(Concat(kept.load(), Extract(index.load(), asa_index_entry_offset(i.load()), Int(asa_index_entry_size())))))
+        ),
+        App.box_put(ASA_INDEX_BOX, Concat(
+            kept.load(),
+            BytesZero(Int(asa_index_count_offset()) - Len(kept.load())),
+            Extract(Itob(Len(kept.load()) / Int(asa_index_entry_size())), Int(6), Int(2)))),
+    ])
+
+#
+# ASA aliases. The alias table is read whole, one box read, and scanned in the bytes.
+#
+
+def read_alias_table():
+    return App.box_extract(ALIAS_BOX, Int(0), Int(ALIAS_CAPACITY * ALIAS_ENTRY_SIZE + ALIAS_COUNT_SIZE))
+
+def alias_count(aliases):
+    return ExtractUint16(aliases, Int(ALIAS_CAPACITY * ALIAS_ENTRY_SIZE))
+
+def write_alias_count(count):
+    return App.box_replace(ALIAS_BOX, Int(ALIAS_CAPACITY * ALIAS_ENTRY_SIZE), Extract(Itob(count), Int(6), Int(2)))
+
+def alias_entry_offset(position):
+    return position * Int(ALIAS_ENTRY_SIZE)
+
+@Subroutine(TealType.uint64)
+def alias_search(aliases, asaId):
+    # Position of the alias of an ASA in the alias table contents, or ENTRY_NOT_FOUND.
+    count = FrameLocal(0, TealType.uint64)
+    i = FrameLocal(1, TealType.uint64)
+    op_pool = OpPool(BUDGET_POOL)
+    return Seq([
+        count.init(alias_count(aliases)),
+        op_pool.ensure_budget(count.load() * ALIAS_ENTRY_BUDGET + ALIAS_BUDGET),
+        For(i.init(Int(0)), i.load() < count.load(), i.store(i.load() + Int(1))).Do(
+            If(ExtractUint64(aliases, alias_entry_offset(i.load())) == asaId, Return(i.load()))
+        ),
+        Return(ENTRY_NOT_FOUND)
+    ])
+
+@Subroutine(TealType.bytes)
+def read_aliased_slot(asaId):
+    # The price slot data of an aliased ASA: the canonical slot, with the ASA ID, the normalized price
+    # and the decimals of the aliased ASA.  The canonical slot must still hold the canonical ASA.
+    aliases = FrameLocal(0, TealType.bytes)
+    position = FrameLocal(1, TealType.uint64)
+    slot_data = FrameLocal(2, TealType.bytes)
+    decimals = FrameLocal(3, TealType.uint64)
+    pyth_price = FrameLocal(4, TealType.uint64)
+    exponent = FrameLocal(5, TealType.uint64)
+    scale_up = FrameLocal(6, TealType.uint64)
+    scale_down = FrameLocal(7, TealType.uint64)
+    normalized_price = FrameLocal(8, TealType.uint64)
+    box_length = App.box_length(ALIAS_BOX)
+    entry = lambda offset, length: Extract(aliases.load(), alias_entry_offset(position.load()) + Int(offset), Int(length))
+    return Seq([
+        box_length,
+        XAssert(box_length.hasValue()),
+        aliases.init(read_alias_table()),
+        position.init(alias_search(aliases.load(), asaId)),
+        XAssert(position.load() != ENTRY_NOT_FOUND),
+        slot_data.init(read_slot(Btoi(entry(16, 2)))),
+        XAssert(Extract(slot_data.load(), Int(0), UINT64_SIZE) == entry(8, 8)),
+        decimals.init(Btoi(entry(18, 1))),
+        pyth_price.init(ExtractUint64(slot_data.load(), slot_field_offset(BLOCK1_OFFSET.value))),
+        exponent.init(slot_exponent(slot_data.load())),
+        normalize_price(pyth_price, exponent, decimals.load(), scale_up, scale_down, normalized_price),
+        Return(Replace(
+            Replace(slot_data.load(), Int(0), Concat(Itob(asaId), Itob(normalized_price.load()))),
+            slot_decimals_offset(), entry(18, 1)))
+    ])
+
 @Subroutine(TealType.uint64)
 def find_asaid_index(asaId):
     #
-    # Returns NOT_FOUND or entry-index
+    # Returns NOT_FOUND or entry-index: a binary search of the ASA index if built with it,
+    # otherwise a scan of the allocated slots.
     #
-    i = ScratchVar(TealType.uint64)
-    index = ScratchVar(TealType.uint64)
-    offset = ScratchVar(TealType.uint64)
-    op_pool = OpPool()
+    if ASA_INDEX:
+        index = FrameLocal(0, TealType.bytes)
+        position = FrameLocal(1, TealType.uint64)
+        return Seq([
+            index.init(read_asa_index()),
+            position.init(asa_index_search(index.load(), asaId)),
+            If(position.load() < asa_index_count(index.load()),
+               If(ExtractUint64(index.load(), asa_index_entry_offset(position.load())) == asaId,
+                  Return(slot_index_at(index.load(), asa_index_entry_offset(position.load()) + UINT64_SIZE)))),
+            Return(ENTRY_NOT_FOUND)
+        ])
+    index = FrameLocal(0, TealType.uint64)
+    entry_count = FrameLocal(1, TealType.uint64)
+    i = FrameLocal(2, TealType.uint64)
+    op_pool = OpPool(BUDGET_POOL)
 
     return Seq([
-        index.store(ENTRY_NOT_FOUND),
-        offset.store(Int(0)),
-        op_pool.maximize_budget(Int(5000)),
+        index.init(ENTRY_NOT_FOUND),
+        entry_count.init(get_entry_count()),
 
-        For(i.store(Int(1)),
-            i.load() < get_entry_count(), i.store(i.load() + Int(1))).Do(
+        For(i.init(Int(0)),
+            i.load() < entry_count.load(), i.store(i.load() + Int(1))).Do(
             Seq([
-                offset.store(i.load() * Int(SLOT_SIZE)),
-                If(Btoi(GlobalBlob.read(offset.load(), offset.load() + UINT64_SIZE)) == asaId,
+                op_pool.ensure_budget(FIND_ITERATION_BUDGET),
+                If(ExtractUint64(read_slot(i.load()), Int(0)) == asaId,
                    Seq([
                        index.store(i.load()),
                        Break()
@@ -218,247 +798,842 @@ def find_asaid_index(asaId):
         Return(index.load())
     ])
 
-@Subroutine(TealType.uint64)
 def get_entry_count():
-    return GetByte(read_slot(SYSTEM_SLOT_INDEX), Int(0))
+    if SLOT_LAYOUT == LAYOUT_BOX:
+        return ExtractUint64(GlobalBlob.read_page(Int(0), BOX_ENTRY_COUNT_OFFSET, UINT64_SIZE), Int(0))
+    return GlobalBlob.get_byte(system_slot_offset())
+
+@Subroutine(TealType.none)
+def set_entry_count(count):
+    if SLOT_LAYOUT == LAYOUT_BOX:
+        return GlobalBlob.write_page(Int(0), BOX_ENTRY_COUNT_OFFSET, Itob(count))
+    return GlobalBlob.set_byte(system_slot_offset(), count)
 
 @Subroutine(TealType.none)
-def inc_entry_count(prevCount):
-    return GlobalBlob.write(SYSTEM_SLOT_INDEX * Int(SLOT_SIZE), Extract(Itob(prevCount + Int(1)), Int(7), Int(1)))
+def track_begin():
+    # Load the sequence number and change table for the changes of this call.
+    return Seq([
+        TRACKING.store(GlobalBlob.read_span(system_slot_offset(SYS_UPDATE_SEQ_OFFSET), TRACKING_SIZE)),
+        TRACKING_SEQ_BYTE.store((ExtractUint64(TRACKING.load(), Int(0)) + Int(1)) & Int(0xFF)),
+    ])
+
+def track_slot(slot):
+    return TRACKING.store(SetByte(TRACKING.load(), UINT64_SIZE + slot % Int(CHANGE_TABLE_SIZE), TRACKING_SEQ_BYTE.load()))
+
+def track_all():
+    # Mark every change table entry.
+    fill = Itob(TRACKING_SEQ_BYTE.load() * Int(0x0101010101010101))
+    return TRACKING.store(Concat(Extract(TRACKING.load(), Int(0), UINT64_SIZE), *[fill] * (CHANGE_TABLE_SIZE // UINT64_SIZE.value)))
+
+@Subroutine(TealType.none)
+def write_tracking():
+    # The span never crosses a key, so it is written in place.
+    key, offset = divmod(system_slot_offset(SYS_UPDATE_SEQ_OFFSET).value, page_size.value)
+    assert offset + TRACKING_SIZE.value <= page_size.value
+    return GlobalBlob.write_page(Int(key), Int(offset), 
+        Replace(TRACKING.load(), Int(0), Itob(ExtractUint64(TRACKING.load(), Int(0)) + Int(1))))
+
+def track_end(changed=None):
+    # Store the change table and the next sequence number. Store passes whether any slot was written.
+    return write_tracking() if changed is None else If(changed, write_tracking())
 
 @Subroutine(TealType.bytes)
 def read_slot(slot):
-    return GlobalBlob.read(slot * Int(SLOT_SIZE), (slot + Int(1)) * Int(SLOT_SIZE))
+    if SLOT_LAYOUT == LAYOUT_BOX:
+        name, offset = slot_box(slot)
+        return App.box_extract(name, offset, Int(slot_size()))
+    if SLOT_LAYOUT == LAYOUT_ALIGNED:
+        key, offset = slot_page(slot)
+        return GlobalBlob.read_page(key, offset, Int(slot_size()))
+    return GlobalBlob.read_span(slot_offset(slot), Int(slot_size()))
 
 @Subroutine(TealType.none)
 def write_slot(slot, data):
+    if SLOT_LAYOUT == LAYOUT_BOX:
+        name, offset = slot_box(slot)
+        write = App.box_replace(name, offset, data)
+    elif SLOT_LAYOUT == LAYOUT_ALIGNED:
+        key, offset = slot_page(slot)
+        write = GlobalBlob.write_page(key, offset, data)
+    else:
+        write = GlobalBlob.write_span(slot_offset(slot), data)
     return Seq([
-        XAssert(Len(data) == Int(SLOT_SIZE)),
+        XAssert(Len(data) == Int(slot_size())),
         XAssert(slot < get_entry_count()),
-        GlobalBlob.write(slot * Int(SLOT_SIZE), data)
+        write
     ])
 
+#
+# Slot access through the GlobalBlob write-combining cache (store, WRITE_COMBINING builds). 
+# Pages touched by several slots in a batch are read once, and written once by 
+# GlobalBlob.cache_flush().
+#
+
+@Subroutine(TealType.bytes)
+def read_cached_slot(slot):
+    if SLOT_LAYOUT == LAYOUT_ALIGNED:
+        key, offset = slot_page(slot)
+        return GlobalBlob.cache_read_page(key, offset, Int(slot_size()))
+    return GlobalBlob.cache_read_span(slot_offset(slot), Int(slot_size()))
+
 @Subroutine(TealType.none)
-def write_system_slot(data):
-    return Seq(GlobalBlob.write(SYSTEM_SLOT_INDEX * Int(SLOT_SIZE), data))
+def write_cached_slot(slot, data):
+    if SLOT_LAYOUT == LAYOUT_ALIGNED:
+        key, offset = slot_page(slot)
+        write = GlobalBlob.cache_write_page(key, offset, data)
+    else:
+        write = GlobalBlob.cache_write_span(slot_offset(slot), data)
+    return Seq([
+        XAssert(Len(data) == Int(slot_size())),
+        XAssert(slot < GlobalBlob.cache_get_byte(system_slot_offset())),
+        write
+    ])
 
+def zero_slots(first, end):
+    # Zeroes the storage of slots first..end-1, where end > first, topping up the budget for 
+    # the keys touched. With the box layout nothing is written: slots past the entry count are
+    # never read, and alloc writes the whole slot.
+    if SLOT_LAYOUT == LAYOUT_BOX:
+        return Seq()
+    start = ScratchVar(TealType.uint64)
+    stop = ScratchVar(TealType.uint64)
+    op_pool = OpPool(BUDGET_POOL)
+    return Seq([
+        start.store(slot_offset(first)),
+        stop.store(slot_offset(end - Int(1)) + Int(slot_size())),
+        op_pool.ensure_budget(((stop.load() - Int(1)) / page_size - start.load() / page_size + Int(4)) * ZERO_PAGE_BUDGET),
+        GlobalBlob.zero_range(start.load(), stop.load()),
+    ])
 
-#@Subroutine(TealType.uint64)
-#def is_test_mode():
-#    return FLAG_TEST_MODE & GetByte(read_slot(SYSTEM_SLOT_INDEX), Int(1))
+def create_slot_storage(slot):
+    # With the box layout, the box holding a slot is created with its first slot.
+    if SLOT_LAYOUT != LAYOUT_BOX:
+        return Seq()
+    name, offset = slot_box(slot)
+    return If(offset == Int(0), Pop(App.box_create(name, Int(slots_per_box() * slot_size()))))
 
+#
+# Free list.
+#
 
-@Subroutine(TealType.none)
-def publish_data(asa_id, attestation_data, slot):
-    packed_price_data = ScratchVar(TealType.bytes)
-    asa_decimals = ScratchVar(TealType.uint64)
-    pyth_price = ScratchVar(TealType.uint64)
-    normalized_price = ScratchVar(TealType.uint64)
-    ad = AssetParam.decimals(asa_id)
-    exponent = ScratchVar(TealType.uint64)
-    norm_exp = Int(0xffffffff) & (Int(0x100000000) - exponent.load())
+def free_list_head():
+    return ExtractUint16(GlobalBlob.read_span(system_slot_offset(SYS_FREE_LIST_OFFSET), FREE_LINK_SIZE), Int(0))
 
+def set_free_list_head(link):
+    return GlobalBlob.write_span(system_slot_offset(SYS_FREE_LIST_OFFSET), Extract(Itob(link), Int(6), FREE_LINK_SIZE))
+
+def free_slot_data(link):
+    # Contents of a freed slot: FREE_SLOT_ASA_ID and the link to the next freed slot.
+    return Replace(BytesZero(Int(slot_size())), Int(0), Concat(FREE_SLOT_ASA_ID, Extract(Itob(link), Int(6), FREE_LINK_SIZE)))
+
+def free_slot_link(slot_data):
+    return ExtractUint16(slot_data, UINT64_SIZE)
+
+@Subroutine(TealType.none)
+def free_list_truncate(first):
+    # Removes the slots from `first` on from the free list.  The slots kept are relinked in 
+    # list order, one slot write each.
+    link = FrameLocal(0, TealType.uint64)
+    last = FrameLocal(1, TealType.uint64)
+    next_link = FrameLocal(2, TealType.uint64)
+    op_pool = OpPool(BUDGET_POOL)
+    relink = lambda target: If(last.load() == Int(0), set_free_list_head(target), write_slot(last.load() - Int(1), free_slot_data(target)))
     return Seq([
+        link.init(free_list_head()),
+        last.init(Int(0)),
+        next_link.init(Int(0)),
+        While(link.load() != Int(0)).Do(Seq([
+            op_pool.ensure_budget(FREE_LINK_BUDGET),
+            next_link.store(free_slot_link(read_slot(link.load() - Int(1)))),
+            If(link.load() <= first, Seq([
+                relink(link.load()),
+                last.store(link.load()),
+            ])),
+            link.store(next_link.load()),
+        ])),
+        relink(Int(0)),
+    ])
+
+def write_layout_id():
+    # The layout id in the low nibble, the slot format id in bits 4..6, and the ASA index flag.
+    # The linear layout with full slots is id 0, so a zeroed blob needs no marker.
+    layout_id = LAYOUT_IDS[SLOT_LAYOUT] | (SLOT_FORMAT_IDS[SLOT_FORMAT] << 4) | (ASA_INDEX_LAYOUT_FLAG if ASA_INDEX else 0)
+    if layout_id == 0:
+        return Seq()
+    return GlobalBlob.set_byte(LAYOUT_ID_OFFSET, Int(layout_id))
 
-        If (
-            asa_id == Int(0), 
 
-            # if Asset is 0 (ALGO), we cannot get decimals through AssetParams, so set to known value.
-            asa_decimals.store(ALGO_DECIMALS),
-            
-            # otherwise, get onchain decimals parameter. 
-            asa_decimals.store(Seq([ad, XAssert(ad.hasValue()), ad.value()]))
-            ),
+#@Subroutine(TealType.uint64)
+#def is_test_mode():
+#    return FLAG_TEST_MODE & GetByte(read_slot(system_slot_index()), Int(1))
 
-        pyth_price.store(Btoi(Extract(attestation_data, BLOCK1_OFFSET, UINT64_SIZE))),
-        exponent.store(Btoi(Extract(attestation_data, BLOCK1_EXPONENT_OFFSET, UINT32_SIZE))),
 
+@Subroutine(TealType.uint64)
+def deviation_exceeded(new, old):
+    # Whether new moved more than DEVIATION_BPS basis points from old:  |new - old| * 10000 > old * bps.
+    # The right side is computed as floor(old * bps / 10000) without overflow, as bps <= 10000.
+    bps = DEVIATION_BPS.load()
+    return If(new > old, new - old, old - new) > (old / MAX_DEVIATION_BPS) * bps + (old % MAX_DEVIATION_BPS) * bps / MAX_DEVIATION_BPS
+
+@Subroutine(TealType.uint64)
+def update_due(attestation_data, slot_data):
+    # Deviation threshold mode: whether a newer attestation must be written to its slot.
+    return Or(
+        ExtractUint64(attestation_data, ATTESTATION_PUB_TIME_OFFSET) - slot_pub_time(slot_data) >= HEARTBEAT.load(),
+        deviation_exceeded(ExtractUint64(attestation_data, BLOCK1_OFFSET), ExtractUint64(slot_data, slot_field_offset(BLOCK1_OFFSET.value))),
+        deviation_exceeded(ExtractUint64(attestation_data, Int(BLOCK1_OFFSET.value + UINT64_SIZE.value)), 
+                           ExtractUint64(slot_data, slot_field_offset(BLOCK1_OFFSET.value + UINT64_SIZE.value))),
+    )
+
+def pack_slot(slot_data, normalized_price, attestation_data):
+    # The new slot contents, built in place over the current ones: the ASA ID and the cached
+    # decimals are kept, the normalized price and the attestation runs are replaced.
+    packed = Replace(slot_data, UINT64_SIZE, Itob(normalized_price))
+    position = UINT64_SIZE.value * 2
+    for offset, length in SLOT_ATTESTATION_RUNS[SLOT_FORMAT]:
+        packed = Replace(packed, Int(position), Extract(attestation_data, Int(offset), Int(length)))
+        position += length
+    assert position == slot_decimals_offset().value
+    return packed
+
+def normalize_price(pyth_price, exponent, asa_decimals, scale_up, scale_down, normalized_price):
+    # Initializes the normalized_price frame local from the pyth_price and exponent locals, for an
+    # ASA with asa_decimals decimals, through the scale_up and scale_down locals.
+    norm_exp = Int(0xffffffff) & (Int(0x100000000) - exponent.load())
+    return Seq([
         # Normalize price as price * 10^(12 + exponent - asset_decimals) with  -12 <= exponent < 12,  0 <= d <= 19 
-        #                                                  
-        # Branch as follows, if exp < 0     p' = p * 10^12
-        #                                     -----------------
-        #                                       10^d * 10^ABS(e)
+        # 
+        # The asset decimals d are cached in the slot at allocation time. Split the power of ten 
+        # as 10^(up - down), with  up = 12 + max(e, 0)  and  down = d + max(-e, 0),  then
+        #
+        #   if up >= down     p' = p * 10^(up - down)
         #
-        # otherwise,  p' = p * 10^12 * 10^e
-        #                  -----------------
-        #                        10^d
+        #   otherwise         p' = p / 10^(down - up)
         #
-        # where -12 <= e <= 12 ,  0 <= d <= 19
+        # where -12 <= e <= 12 ,  0 <= d <= 19,  so down - up <= 19 and 10^(down - up) fits in uint64.
+        # up - down reaches 24, beyond the 10^19 uint64 limit: a zero price normalizes to zero without 
+        # the power of ten, and any other result that does not fit in uint64 fails the call.
         #
 
         If (exponent.load() < Int(0x80000000),  # uint32, 2-compl positive 
-            normalized_price.store(WideRatio([pyth_price.load(), Exp(Int(10), PICO_DOLLARS_DECIMALS), Exp(Int(10), exponent.load())], 
-                                                [Exp(Int(10), asa_decimals.load())])),
+            Seq(scale_up.init(PICO_DOLLARS_DECIMALS + exponent.load()), scale_down.init(asa_decimals)),
+            Seq(scale_up.init(PICO_DOLLARS_DECIMALS), scale_down.init(asa_decimals + norm_exp))
+        ),
 
-            normalized_price.store(WideRatio([pyth_price.load(), Exp(Int(10), PICO_DOLLARS_DECIMALS)], 
-                                                [Exp(Int(10), asa_decimals.load()), Exp(Int(10), norm_exp)]))
+        If (scale_up.load() >= scale_down.load(),
+            normalized_price.init(If(pyth_price.load() == Int(0), Int(0),
+                                     pyth_price.load() * Exp(Int(10), scale_up.load() - scale_down.load()))),
+            normalized_price.init(pyth_price.load() / Exp(Int(10), scale_down.load() - scale_up.load()))
         ),
+    ])
 
-        # Concatenate all
-        packed_price_data.store(Concat(
-            Itob(asa_id),
-            Itob(normalized_price.load()),
-            Extract(attestation_data, BLOCK1_OFFSET, BLOCK1_LEN),   # price, confidence, exponent, price EMA, conf EMA
-            Extract(attestation_data, BLOCK2_OFFSET, BLOCK2_LEN),   # att_time,pub_time,prev_pub_time,prev_price,prev_conf
-        )),
+@Subroutine(TealType.none)
+def publish_data(attestation_data, slot, slot_data):
+    pyth_price = FrameLocal(0, TealType.uint64)
+    exponent = FrameLocal(1, TealType.uint64)
+    scale_up = FrameLocal(2, TealType.uint64)
+    scale_down = FrameLocal(3, TealType.uint64)
+    normalized_price = FrameLocal(4, TealType.uint64)
+    packed_price_data = FrameLocal(5, TealType.bytes)
+
+    return Seq([
+
+        pyth_price.init(ExtractUint64(attestation_data, BLOCK1_OFFSET)),
+        exponent.init(ExtractUint32(attestation_data, BLOCK1_EXPONENT_OFFSET)),
+        normalize_price(pyth_price, exponent, GetByte(slot_data, slot_decimals_offset()), scale_up, scale_down, normalized_price),
+
+        packed_price_data.init(pack_slot(slot_data, normalized_price.load(), attestation_data)),
 
         # Update blob entry
 
-        write_slot(slot, packed_price_data.load()),
+        (write_cached_slot if WRITE_COMBINING else write_slot)(slot, packed_price_data.load()),
+
+        track_slot(slot),
+        UPDATE_LOG.store(Concat(
+            UPDATE_LOG.load(),
+            Extract(Itob(slot), Int(6), Int(2)),
+            Extract(packed_price_data.load(), Int(0), Int(16)),     # ASA ID, normalized price
+            Extract(attestation_data, ATTESTATION_PUB_TIME_OFFSET, UINT64_SIZE)
+        )),
     ])
 
-def store():
+def vaa_group_check():
+    # Checks of the methods taking a verified VAA payload, made once per call:
     # * Sender must be owner
     # * This must be part of a transaction group
     # * All calls in group must be issued from authorized Wormhole core.
-    # * Argument 0 must be array of tuple (ASA ID, slot) corresponding to each of the attestations that corresponds
-    #   to valid prices to update. If an entry is -1 (unsigned 0xFFFF .... FFFF), the corresponding attestation entry is ignored and 
-    #   not published, otherwise the price entry is updated on it's specified slot.
-    # * Argument 1 must be Pyth payload.
+    op_pool = OpPool(BUDGET_POOL)
+    return Seq([
+        # If testing mode is active, ignore group checks
+        XAssert(Or(Tmpl.Int("TMPL_I_TESTING"), Global.group_size() > Int(1))),
+        XAssert(is_creator()),
 
-    pyth_payload = ScratchVar(TealType.bytes)
-    num_attestations = ScratchVar(TealType.uint64)
-    attestation_size = ScratchVar(TealType.uint64)
-    attestation_data = ScratchVar(TealType.bytes)
+        # A full group (16 transactions) costs more to check than a single call's budget.
+        op_pool.ensure_budget(Global.group_size() * GROUP_TXN_CHECK_BUDGET),
+        XAssert(Or(Tmpl.Int("TMPL_I_TESTING"), check_group_tx())),
+    ])
+
+def store_prologue(vaa_group=True):
+    # Setup shared by the store methods, made once per call, after the VAA group checks.  Methods
+    # publishing proven prices only need the sender to be the owner.
+    return Seq([
+        vaa_group_check() if vaa_group else XAssert(is_creator()),
+        UPDATE_LOG.store(UPDATE_LOG_HEADER),
+        track_begin(),
+        DEVIATION_MODE.store(GlobalBlob.get_byte(system_slot_offset(1)) & FLAG_DEVIATION),
+        If(DEVIATION_MODE.load(), Seq([
+            DEVIATION_BPS.store(Btoi(GlobalBlob.read_span(system_slot_offset(SYS_DEVIATION_BPS_OFFSET), Int(2)))),
+            HEARTBEAT.store(Btoi(GlobalBlob.read_span(system_slot_offset(SYS_HEARTBEAT_OFFSET), UINT32_SIZE))),
+        ])),
+    ])
+
+def store_epilogue():
+    # Completes the store methods: slot writes combined in scratch space are flushed, under a
+    # fresh budget as the cost grows with the keys touched, then changes are tracked and logged.
+    op_pool = OpPool(BUDGET_POOL)
+    return Seq([
+        Seq(op_pool.ensure_budget(ATTESTATION_BUDGET), GlobalBlob.cache_flush()) if WRITE_COMBINING else Seq(),
+        track_end(Len(UPDATE_LOG.load()) > Len(UPDATE_LOG_HEADER)),
+        Log(UPDATE_LOG.load()),
+    ])
+
+def publish_attestation(attestation_data, asaid_slot_array, i):
+    # Publishes the attestation in attestation_data to the slot of entry i of asaid_slot_array, see 
+    # store_payload.  Inlined in the attestation loops of the store methods: disabled, ignored, 
+    # stale and, in deviation threshold mode, unchanged attestations continue the loop unpublished.
     asa_id = ScratchVar(TealType.uint64)
     slot = ScratchVar(TealType.uint64)
     slot_data = ScratchVar(TealType.bytes)
-
-    i = ScratchVar(TealType.uint64)
-    op_pool = OpPool()
+    op_pool = OpPool(BUDGET_POOL)
+    tuple_size = asaid_slot_tuple_size()
     return Seq([
+        # Budget is topped up per attestation, only as needed.
+        op_pool.ensure_budget(Int(ATTESTATION_BUDGET.value + INDEX_SEARCH_BUDGET.value) if ASA_INDEX else ATTESTATION_BUDGET),
+        asa_id.store(ExtractUint64(asaid_slot_array, i * tuple_size)),
 
-        # Verify that we have an array of (Uint64, Uint64) tuple values
-        XAssert(Len(ASAID_SLOT_ARRAY) % ASAID_SLOT_TUPLE_SIZE == Int(0)),
+        # Ensure status == 1
+        If(Extract(attestation_data.load(), BLOCK1_STATUS_OFFSET, BLOCK1_STATUS_LEN) != Bytes("base16", "0x01"),
+            Log(Concat(Bytes("PRICE_DISABLED:"), Itob(asa_id.load()))),
 
-        pyth_payload.store(PYTH_PAYLOAD),
+            Seq([
+                # Ignore this attestation of no ASA ID available.
+                If(asa_id.load() == IGNORE_ATTESTATION, Continue()),
+
+                # The ASA must have a slot in the index, if built with it.
+                Seq(slot.store(find_asaid_index(asa_id.load())), XAssert(slot.load() != ENTRY_NOT_FOUND)) if ASA_INDEX else
+                slot.store(slot_index_at(asaid_slot_array, i * tuple_size + UINT64_SIZE)),
+
+                # Slot must be allocated already for this ASA
+                slot_data.store((read_cached_slot if WRITE_COMBINING else read_slot)(slot.load())),
+                XAssert(ExtractUint64(slot_data.load(), Int(0)) == asa_id.load()),
+
+                # An attestation not newer than the stored price is ignored.
+                If(ExtractUint64(attestation_data.load(), ATTESTATION_PUB_TIME_OFFSET) <= slot_pub_time(slot_data.load()),
+                    Seq(Log(Concat(Bytes("PRICE_IGNORED_OLD:"), Itob(asa_id.load()))), Continue())),
+
+                # In deviation threshold mode, so is a price within the threshold until the heartbeat.
+                If(DEVIATION_MODE.load(), If(Not(update_due(attestation_data.load(), slot_data.load())),
+                    Seq(Log(Concat(Bytes("PRICE_IGNORED_DEVIATION:"), Itob(asa_id.load()))), Continue()))),
+
+                # Valid status,  continue publication....
+                publish_data(attestation_data.load(), slot.load(), slot_data.load())
+            ])
+        )
+    ])
+
+@Subroutine(TealType.none)
+def store_payload(asaid_slot_array, pyth_payload):
+    # Validates a Pyth payload and publishes its attestations.
+    # * asaid_slot_array must be array of tuple (ASA ID, slot) corresponding to each of the attestations that corresponds
+    #   to valid prices to update. If an entry is -1 (unsigned 0xFFFF .... FFFF), the corresponding attestation entry is ignored and 
+    #   not published, otherwise the price entry is updated on it's specified slot.  With the ASA index, it must be an 
+    #   array of ASA IDs, and the slot of each ASA is looked up in the index.
+    # * pyth_payload must be the Pyth payload.
+
+    num_attestations = FrameLocal(0, TealType.uint64)
+    attestation_size = FrameLocal(1, TealType.uint64)
+    i = FrameLocal(2, TealType.uint64)
+
+    # Set in the attestation loop.
+    attestation_data = ScratchVar(TealType.bytes)
+    tuple_size = asaid_slot_tuple_size()
+    return Seq([
+
+        # Verify that we have an array of (Uint64, slot index) tuple values, or of Uint64 with the ASA index
+        XAssert(Len(asaid_slot_array) % tuple_size == Int(0)),
 
-        # If testing mode is active, ignore group checks
-        XAssert(Or(Tmpl.Int("TMPL_I_TESTING"), Global.group_size() > Int(1))),
-        XAssert(Txn.application_args.length() == Int(3)),
-        XAssert(is_creator()),
-        XAssert(Or(Tmpl.Int("TMPL_I_TESTING"), check_group_tx())),
-        
         # check magic header and version.
         # We dont check minor version as we expect minor-version changes to NOT affect
         # the wire-format compatibility.
         #
-        XAssert(Extract(pyth_payload.load(), PYTH_HEADER_OFFSET, PYTH_HEADER_LEN) == PYTH_MAGIC_HEADER),
-        XAssert(Extract(pyth_payload.load(), PYTH_FIELD_WIRE_FORMAT_VERSION_OFFSET, PYTH_FIELD_WIRE_FORMAT_VERSION_LEN) == PYTH_WIRE_FORMAT_MAJOR_VERSION),
+        XAssert(Extract(pyth_payload, PYTH_HEADER_OFFSET, PYTH_HEADER_LEN) == PYTH_MAGIC_HEADER),
+        XAssert(Extract(pyth_payload, PYTH_FIELD_WIRE_FORMAT_VERSION_OFFSET, PYTH_FIELD_WIRE_FORMAT_VERSION_LEN) == PYTH_WIRE_FORMAT_MAJOR_VERSION),
 
         # check number of remaining fields (this is constant 1)
-        XAssert(Extract(pyth_payload.load(), PYTH_FIELD_NUM_REMFIELDS_OFFSET, PYTH_FIELD_NUM_REMFIELDS_LEN) == PYTH_NUMFIELDS),
+        XAssert(Extract(pyth_payload, PYTH_FIELD_NUM_REMFIELDS_OFFSET, PYTH_FIELD_NUM_REMFIELDS_LEN) == PYTH_NUMFIELDS),
 
         # check payload-id (must be type 2: Attestation) 
-        XAssert(Extract(pyth_payload.load(), PYTH_FIELD_PAYLOAD_OFFSET, PYTH_FIELD_PAYLOAD_LEN) == PYTH_PAYLOAD_ID),
+        XAssert(Extract(pyth_payload, PYTH_FIELD_PAYLOAD_OFFSET, PYTH_FIELD_PAYLOAD_LEN) == PYTH_PAYLOAD_ID),
 
         # get attestation count
-        num_attestations.store(Btoi(Extract(pyth_payload.load(), PYTH_FIELD_ATTEST_COUNT_OFFSET, PYTH_FIELD_ATTEST_COUNT_LEN))),
-        XAssert(And(num_attestations.load() > Int(0), num_attestations.load() <= Int(5))),
+        num_attestations.init(Btoi(Extract(pyth_payload, PYTH_FIELD_ATTEST_COUNT_OFFSET, PYTH_FIELD_ATTEST_COUNT_LEN))),
+        XAssert(And(num_attestations.load() > Int(0), num_attestations.load() <= MAX_ATTESTATIONS)),
 
         # must be one ASA ID for each attestation
-        XAssert(Len(ASAID_SLOT_ARRAY) == ASAID_SLOT_TUPLE_SIZE * num_attestations.load()),
+        XAssert(Len(asaid_slot_array) == tuple_size * num_attestations.load()),
 
         # store attestation size present in this VAA.
-        attestation_size.store(Btoi(Extract(pyth_payload.load(), PYTH_FIELD_ATTESTATION_SIZE_OFFSET, PYTH_FIELD_ATTESTATION_SIZE_LEN))),
+        attestation_size.init(Btoi(Extract(pyth_payload, PYTH_FIELD_ATTESTATION_SIZE_OFFSET, PYTH_FIELD_ATTESTATION_SIZE_LEN))),
         
         # this message size must agree with data in fields
-        XAssert(attestation_size.load() * num_attestations.load() + PYTH_BEGIN_PAYLOAD_OFFSET == Len(pyth_payload.load())),
+        XAssert(attestation_size.load() * num_attestations.load() + PYTH_BEGIN_PAYLOAD_OFFSET == Len(pyth_payload)),
         
         # Read each attestation, store in global state.
         # Use each ASA IDs  passed in call.
+        # Budget is topped up per attestation, only as needed.
 
-        op_pool.maximize_budget( (Int(1300) * num_attestations.load()) - Int(1)),
-
-        For(i.store(Int(0)), i.load() < num_attestations.load(), i.store(i.load() + Int(1))).Do(
+        For(i.init(Int(0)), i.load() < num_attestations.load(), i.store(i.load() + Int(1))).Do(
             Seq([
-                attestation_data.store(Extract(pyth_payload.load(), PYTH_BEGIN_PAYLOAD_OFFSET + (attestation_size.load() * i.load()), attestation_size.load())),
-                asa_id.store(ExtractUint64(ASAID_SLOT_ARRAY, i.load() * ASAID_SLOT_TUPLE_SIZE)),
+                attestation_data.store(Extract(pyth_payload, PYTH_BEGIN_PAYLOAD_OFFSET + (attestation_size.load() * i.load()), attestation_size.load())),
+                publish_attestation(attestation_data, asaid_slot_array, i.load()),
+            ])
+        ),
+    ])
 
-                # Ensure status == 1
-                If(Extract(attestation_data.load(), BLOCK1_STATUS_OFFSET, BLOCK1_STATUS_LEN) != Bytes("base16", "0x01"),
-                    Log(Concat(Bytes("PRICE_DISABLED:"), Itob(asa_id.load()))),
+def store():
+    # * Argument 1 must be array of tuple (ASA ID, slot), see store_payload.
+    # * Argument 2 must be Pyth payload.
+    # With write-combining, slot updates are kept in scratch space and written once per key at the end.
+    assert not (WRITE_COMBINING and SLOT_LAYOUT == LAYOUT_BOX), "write-combining applies to global storage layouts only"
+    return Seq([
+        XAssert(Txn.application_args.length() == Int(3)),
+        store_prologue(),
+        GlobalBlob.cache_begin() if WRITE_COMBINING else Seq(),
+        store_payload(ASAID_SLOT_ARRAY, PYTH_PAYLOAD),
+        store_epilogue(),
+        Approve()])
 
-                    Seq([
-                        slot.store(Btoi(Extract(ASAID_SLOT_ARRAY, i.load() * ASAID_SLOT_TUPLE_SIZE + UINT64_SIZE, Int(1)))),
+def store_multi():
+    #
+    # Publishes several Pyth payloads, one for each VAA verified in the group, in one call.
+    # Arguments 1.. must be pairs of (ASA ID, slot) tuple array and Pyth payload, as in store.  
+    # The group checks and the opcode budget top-up are shared by all payloads.  All arguments 
+    # share the 2048-byte limit, so the attestations of all payloads are still bounded as in store.
+    #
+    j = ScratchVar(TealType.uint64)
+    num_args = Txn.application_args.length()
+    return Seq([
+        XAssert(And(num_args >= Int(3), num_args % Int(2) == Int(1))),
+        store_prologue(),
+        GlobalBlob.cache_begin() if WRITE_COMBINING else Seq(),
+        For(j.store(Int(1)), j.load() < num_args, j.store(j.load() + Int(2))).Do(
+            store_payload(Txn.application_args[j.load()], Txn.application_args[j.load() + Int(1)])
+        ),
+        store_epilogue(),
+        Approve()])
 
-                        # Ignore this attestation of no ASA ID available.
-                        If(asa_id.load() == IGNORE_ATTESTATION, Continue()),
+#
+# Pyth accumulator updates.
+#
 
-                        # Slot must be allocated already for this ASA
-                        slot_data.store(read_slot(slot.load())),
-                        XAssert(ExtractUint64(slot_data.load(), Int(0)) == asa_id.load()),
+def merkle_hash(prefix, data):
+    return Extract(Keccak256(Concat(prefix, data)), Int(0), MERKLE_HASH_SIZE)
 
-                        # If an attestation has an older timestamp must be ignored.
-                        If(ExtractUint64(slot_data.load(), PUB_TIME_FIELD_OFFSET) < ExtractUint64(attestation_data.load(), PUB_TIME_FIELD_OFFSET),
-                            Log(Concat(Bytes("PRICE_IGNORED_OLD:"), Itob(asa_id.load())))),
+@Subroutine(TealType.none)
+def merkle_verify(message, proof):
+    # Verifies a price message against MERKLE_ROOT with its proof, the sibling hashes from the leaf
+    # up.  The hashes on the path of the last message verified in the call are kept in MERKLE_PATH,
+    # by level: a path reaching one of them at the same level goes on as that one, so it is verified
+    # there without hashing up to the root.  Updates sorted by feed share all but the lowest levels.
+    hash = FrameLocal(0, TealType.bytes)
+    path = FrameLocal(1, TealType.bytes)
+    sibling = FrameLocal(2, TealType.bytes)
+    position = FrameLocal(3, TealType.uint64)      # of the level hashed next, in the proof and the path
+    joined = FrameLocal(4, TealType.uint64)
+    op_pool = OpPool(BUDGET_POOL)
+    return Seq([
+        op_pool.ensure_budget(MERKLE_LEVEL_BUDGET),
+        hash.init(merkle_hash(MERKLE_LEAF_PREFIX, message)),
+        path.init(Bytes("")),
+        sibling.init(Bytes("")),
+        position.init(Int(0)),
+        joined.init(Int(0)),
+        While(position.load() < Len(proof)).Do(Seq([
+            If(position.load() < Len(MERKLE_PATH.load()), 
+                If(Extract(MERKLE_PATH.load(), position.load(), MERKLE_HASH_SIZE) == hash.load(), Seq(joined.store(Int(1)), Break()))),
+            op_pool.ensure_budget(MERKLE_LEVEL_BUDGET),
+            path.store(Concat(path.load(), hash.load())),
+            sibling.store(Extract(proof, position.load(), MERKLE_HASH_SIZE)),
+            hash.store(merkle_hash(MERKLE_NODE_PREFIX, If(BytesLt(hash.load(), sibling.load()), 
+                                                          Concat(hash.load(), sibling.load()), 
+                                                          Concat(sibling.load(), hash.load())))),
+            position.store(position.load() + MERKLE_HASH_SIZE),
+        ])),
+        If(joined.load(),
+            MERKLE_PATH.store(Concat(path.load(), Suffix(MERKLE_PATH.load(), position.load()))),
+            Seq(XAssert(hash.load() == MERKLE_ROOT.load()), MERKLE_PATH.store(path.load()))),
+    ])
+
+def price_message_attestation(message):
+    # A P2W v3 attestation with the fields of a price message, published as a batched one.  The 
+    # product id and publisher counts are zero, the status is trading, the attestation time is the 
+    # publish time, and the previous price and confidence, not in the message, are zero.
+    return Concat(
+        BytesZero(Int(32)),                     # product id
+        Extract(message, Int(1), Int(52)),      # feed id, price, confidence, exponent
+        Extract(message, Int(69), Int(16)),     # price EMA, conf EMA
+        Bytes("base16", "0x01"),                # status
+        BytesZero(Int(8)),                      # publisher counts
+        Extract(message, Int(53), UINT64_SIZE), # att_time
+        Extract(message, Int(53), Int(16)),     # pub_time, prev_pub_time
+        BytesZero(Int(16)),                     # prev_price, prev_conf
+    )
+
+def set_root():
+    #
+    # Stores the Merkle root of a Pyth accumulator update, for storeproofs.  Argument 1 must be 
+    # the payload of the VAA carrying it, verified in the group as for store.  The root replaces 
+    # the one stored: prices proven against an older root are still refused as stale by storeproofs.
+    #
+    return Seq([
+        XAssert(Txn.application_args.length() == Int(2)),
+        vaa_group_check(),
+        XAssert(Len(ROOT_PAYLOAD_ARG) == ACCUMULATOR_ROOT_PAYLOAD_LEN),
+        XAssert(Extract(ROOT_PAYLOAD_ARG, Int(0), ACCUMULATOR_ROOT_HEADER_LEN) == ACCUMULATOR_ROOT_HEADER),
+        GlobalBlob.write_span(system_slot_offset(SYS_MERKLE_ROOT_OFFSET), Extract(ROOT_PAYLOAD_ARG, ACCUMULATOR_ROOT_OFFSET, MERKLE_HASH_SIZE)),
+        Approve()])
 
-                        # Valid status,  continue publication....
-                        publish_data(asa_id.load(), attestation_data.load(), slot.load())
-                    ])
-                )
+def store_proofs():
+    #
+    # Publishes the price messages of a Pyth accumulator update, each verified with its proof 
+    # against the root stored by setroot, so the call needs no VAA verification group.
+    # * Argument 1 must be the array of (ASA ID, slot) tuples, one for each update, as in store.
+    # * Argument 2 must be the updates, as they follow the VAA in the accumulator update data: 
+    #   the number of updates (uint8), then for each, the message size (uint16), the message, 
+    #   the number of proof nodes (uint8) and the nodes.  Messages must be price messages.
+    # Each message is published as an attestation, see price_message_attestation.  The updates of
+    # a call are bounded as in store, and cheaper to verify in feed order, see merkle_verify.
+    #
+    num_updates = ScratchVar(TealType.uint64)
+    position = ScratchVar(TealType.uint64)
+    message_size = ScratchVar(TealType.uint64)
+    message = ScratchVar(TealType.bytes)
+    proof_size = ScratchVar(TealType.uint64)
+    attestation_data = ScratchVar(TealType.bytes)
+    i = ScratchVar(TealType.uint64)
+    tuple_size = asaid_slot_tuple_size()
+    assert not (WRITE_COMBINING and SLOT_LAYOUT == LAYOUT_BOX), "write-combining applies to global storage layouts only"
+    return Seq([
+        XAssert(Txn.application_args.length() == Int(3)),
+        store_prologue(vaa_group=False),
+        GlobalBlob.cache_begin() if WRITE_COMBINING else Seq(),
+        MERKLE_ROOT.store(GlobalBlob.read_span(system_slot_offset(SYS_MERKLE_ROOT_OFFSET), MERKLE_HASH_SIZE)),
+        XAssert(MERKLE_ROOT.load() != BytesZero(MERKLE_HASH_SIZE)),
+        MERKLE_PATH.store(Bytes("")),
+
+        num_updates.store(GetByte(PROOF_UPDATES_ARG, Int(0))),
+        XAssert(And(num_updates.load() > Int(0), num_updates.load() <= MAX_ATTESTATIONS)),
+        XAssert(Len(ASAID_SLOT_ARRAY) == tuple_size * num_updates.load()),
+        position.store(Int(1)),
+        For(i.store(Int(0)), i.load() < num_updates.load(), i.store(i.load() + Int(1))).Do(
+            Seq([
+                message_size.store(ExtractUint16(PROOF_UPDATES_ARG, position.load())),
+                message.store(Extract(PROOF_UPDATES_ARG, position.load() + Int(2), message_size.load())),
+                XAssert(And(message_size.load() >= PRICE_MESSAGE_LEN, GetByte(message.load(), Int(0)) == PRICE_MESSAGE_TYPE)),
+                position.store(position.load() + Int(2) + message_size.load()),
+                proof_size.store(GetByte(PROOF_UPDATES_ARG, position.load()) * MERKLE_HASH_SIZE),
+                merkle_verify(message.load(), Extract(PROOF_UPDATES_ARG, position.load() + Int(1), proof_size.load())),
+                position.store(position.load() + Int(1) + proof_size.load()),
+
+                attestation_data.store(price_message_attestation(message.load())),
+                publish_attestation(attestation_data, ASAID_SLOT_ARRAY, i.load()),
             ])
         ),
+        XAssert(position.load() == Len(PROOF_UPDATES_ARG)),
+        store_epilogue(),
         Approve()])
 
+def asa_decimals(asaId):
+    # ALGO (ASA 0) has no asset parameters: its decimals are known.  Other ASAs must be in the 
+    # foreign assets array.
+    ad = AssetParam.decimals(asaId)
+    return If(asaId == Int(0), ALGO_DECIMALS, Seq([ad, XAssert(ad.hasValue()), ad.value()]))
+
+@Subroutine(TealType.uint64)
+def alloc_slot(asaId, decimals):
+    # Allocates a slot for an ASA, the last freed slot if any, otherwise a new one, and returns
+    # it.  The ASA decimals are cached in the slot.  The change is tracked (see track_begin).
+    link = FrameLocal(0, TealType.uint64)
+    slot = FrameLocal(1, TealType.uint64)
+    return Seq([
+        link.init(free_list_head()),
+        If(link.load() == Int(0),
+           Seq([
+               slot.init(get_entry_count()),
+               XAssert(slot.load() < Int(max_price_slots())),
+               set_entry_count(slot.load() + Int(1)),
+               create_slot_storage(slot.load()),
+           ]),
+           Seq([
+               slot.init(link.load() - Int(1)),
+               set_free_list_head(free_slot_link(read_slot(slot.load()))),
+           ])),
+        write_slot(slot.load(), SetByte(Replace(BytesZero(Int(slot_size())), Int(0), Itob(asaId)), slot_decimals_offset(), decimals)),
+        asa_index_insert(asaId, slot.load()) if ASA_INDEX else Seq(),
+        track_slot(slot.load()),
+        Return(slot.load())
+    ])
+
 def alloc_new_slot():
     #
-    # Allocates a new slot for a particular ASA.
-    # Argument 1 must be ASA identifier.
+    # Allocates a slot for a particular ASA: the last freed slot, if any, otherwise the next one.
+    # Argument 1 must be ASA identifier. The ASA must be in the foreign assets array, as its
+    # decimals are read once here and cached in the slot for price normalization.  With the ASA
+    # index, the slot is indexed, and an ASA already indexed cannot be allocated another slot.
+    # The slot is logged as "ALLOC@" and the slot (uint64).
     #
-    entryCount = ScratchVar(TealType.uint64)
+    slot = ScratchVar(TealType.uint64)
     return Seq([
         XAssert(is_creator()),
-        entryCount.store(get_entry_count()),
-        XAssert(entryCount.load() <= Int(MAX_PRICE_SLOTS)),
-        inc_entry_count(entryCount.load()),
-        write_slot(entryCount.load(), Replace(FREE_ENTRY, Int(0), ALLOC_ASA_ID)),
-        Log(Concat(Bytes("ALLOC@"), Itob(entryCount.load()))),
+        XAssert(Len(ALLOC_ASA_ID) == UINT64_SIZE),
+        track_begin(),
+        slot.store(alloc_slot(Btoi(ALLOC_ASA_ID), asa_decimals(Btoi(ALLOC_ASA_ID)))),
+        track_end(),
+        Log(Concat(Bytes("ALLOC@"), Itob(slot.load()))),
+        Approve()
+    ])
+
+def alloc_many_slots():
+    #
+    # Allocates a slot for each of several ASAs, as alloc, in one call.
+    # Argument 1 must be an array of ASA IDs (uint64), at most MAX_ALLOC_BATCH.  The ASAs must 
+    # be in the foreign assets array.  The slots are logged in one log, "ALLOC@" and the slot of 
+    # each ASA (uint64) in argument order.  The opcode budget is topped up as needed, so the call
+    # fee must cover any inner transactions.
+    #
+    op_pool = OpPool(BUDGET_POOL)
+    i = ScratchVar(TealType.uint64)
+    count = ScratchVar(TealType.uint64)
+    asa_id = ScratchVar(TealType.uint64)
+    slots = ScratchVar(TealType.bytes)
+    return Seq([
+        XAssert(is_creator()),
+        XAssert(Len(ALLOC_MANY_ARG) % UINT64_SIZE == Int(0)),
+        count.store(Len(ALLOC_MANY_ARG) / UINT64_SIZE),
+        XAssert(And(count.load() > Int(0), count.load() <= MAX_ALLOC_BATCH)),
+        track_begin(),
+        slots.store(Bytes("ALLOC@")),
+        For(i.store(Int(0)), i.load() < count.load(), i.store(i.load() + Int(1))).Do(
+            Seq([
+                op_pool.ensure_budget(ALLOC_BUDGET),
+                asa_id.store(ExtractUint64(ALLOC_MANY_ARG, i.load() * UINT64_SIZE)),
+                slots.store(Concat(slots.load(), Itob(alloc_slot(asa_id.load(), asa_decimals(asa_id.load()))))),
+            ])
+        ),
+        track_end(),
+        Log(slots.load()),
         Approve()
     ])
 
 def reset(): 
     #
-    # Resets all contract info to zero
+    # Frees the allocated slots from argument 1, the first slot to free (uint64), or from slot 0 
+    # if absent.  Their storage is zeroed and the entry count set to the first slot freed, so 
+    # the cost grows with the number of slots freed.  Configuration flags and the accumulator root are kept.  Slots freed
+    # with free before are dropped from the free list from the first slot on, and with the ASA 
+    # index, the freed slots are removed from it.
     #
-    op_pool = OpPool()
-    sys_flag = ScratchVar(TealType.uint64)
+    first = ScratchVar(TealType.uint64)
+    entry_count = ScratchVar(TealType.uint64)
     return Seq([
         XAssert(is_creator()),
-        op_pool.maximize_budget(Int(2000)),
-        sys_flag.store(GetByte(read_slot(SYSTEM_SLOT_INDEX), Int(1))),
-        GlobalBlob.zero(),
-        GlobalBlob.set_byte(SYSTEM_SLOT_INDEX * Int(SLOT_SIZE) + Int(1), sys_flag.load()),
+        first.store(If(Txn.application_args.length() > Int(1), Btoi(RESET_ARG), Int(0))),
+        entry_count.store(get_entry_count()),
+        XAssert(first.load() <= entry_count.load()),
+        If(first.load() < entry_count.load(), Seq([
+            If(free_list_head() != Int(0), If(first.load() == Int(0), set_free_list_head(Int(0)), free_list_truncate(first.load()))),
+            zero_slots(first.load(), entry_count.load()),
+            asa_index_truncate(first.load()) if ASA_INDEX else Seq(),
+        ])),
+        set_entry_count(first.load()),
+        track_begin(),
+        track_all(),
+        track_end(),
+        Approve()
+    ])
+
+def free_slot():
+    #
+    # Frees a price slot: its storage is zeroed and its ASA ID set to FREE_SLOT_ASA_ID, so it 
+    # takes no more prices, and it is added to the free list for reuse by alloc.  The entry count
+    # is unchanged.  A slot cannot be freed twice.  With the ASA index, the slot is removed from it.
+    # Argument 1 must be the slot index (uint64).  With the box layout, the box holding the slot
+    # must be referenced.
+    #
+    slot = ScratchVar(TealType.uint64)
+    asa_id = ScratchVar(TealType.bytes)
+    return Seq([
+        XAssert(is_creator()),
+        slot.store(Btoi(FREE_ARG)),
+        asa_id.store(Extract(read_slot(slot.load()), Int(0), UINT64_SIZE)),
+        XAssert(asa_id.load() != FREE_SLOT_ASA_ID),
+        asa_index_remove(Btoi(asa_id.load())) if ASA_INDEX else Seq(),
+        write_slot(slot.load(), free_slot_data(free_list_head())),
+        set_free_list_head(slot.load() + Int(1)),
+        track_begin(),
+        track_slot(slot.load()),
+        track_end(),
         Approve()
     ])
 
 @Subroutine(TealType.none)
 def set_sys_flag(flag):
-    sys_slot = ScratchVar(TealType.bytes)
-    return Seq(
-        sys_slot.store(SetByte(read_slot(SYSTEM_SLOT_INDEX), Int(1), flag & Int(0xFF))),
-        write_system_slot(sys_slot.load()),
-    )
+    return GlobalBlob.set_byte(system_slot_offset(1), flag & Int(0xFF))
 
 def set_flags():
     #
-    # Sets configuration flags 
+    # Sets configuration flags.
+    # Optional arguments 2 and 3 set the deviation threshold in basis points (at most 10000) and 
+    # the heartbeat interval in seconds (uint32), see FLAG_DEVIATION.
     #
+    bps = ScratchVar(TealType.uint64)
+    heartbeat = ScratchVar(TealType.uint64)
     return Seq(
         XAssert(is_creator()),
         # mask-out the testing mode set in bootstrap call
         set_sys_flag(Int(0x7F) & Btoi(FLAGS_ARG)),
+        If(Txn.application_args.length() > Int(2), Seq([
+            XAssert(Txn.application_args.length() == Int(4)),
+            bps.store(Btoi(DEVIATION_BPS_ARG)),
+            heartbeat.store(Btoi(HEARTBEAT_ARG)),
+            XAssert(And(bps.load() <= MAX_DEVIATION_BPS, heartbeat.load() <= Int(0xFFFFFFFF))),
+            GlobalBlob.write_span(system_slot_offset(SYS_DEVIATION_BPS_OFFSET), 
+                                  Concat(Extract(Itob(bps.load()), Int(6), Int(2)), Extract(Itob(heartbeat.load()), Int(4), Int(4)))),
+        ])),
         Approve()
     )
 
+def alias_asa():
+    #
+    # Aliases an ASA to the slot of the ASA tracking the same feed, see ALIAS_BOX.  Argument 1 
+    # must be the ASA ID (uint64), in the foreign assets array but for ALGO, and argument 2 the 
+    # canonical slot (uint64), allocated.  An ASA has one alias at most, and is read from a slot 
+    # of its own first.  The alias box must be referenced, and is created with the first alias.  
+    # The slot is not written.
+    #
+    asa_id = ScratchVar(TealType.uint64)
+    slot = ScratchVar(TealType.uint64)
+    canonical_asa_id = ScratchVar(TealType.bytes)
+    aliases = ScratchVar(TealType.bytes)
+    count = ScratchVar(TealType.uint64)
+    return Seq([
+        XAssert(is_creator()),
+        XAssert(Txn.application_args.length() == Int(3)),
+        asa_id.store(Btoi(ALIAS_ASA_ARG)),
+        slot.store(Btoi(ALIAS_SLOT_ARG)),
+        XAssert(slot.load() < get_entry_count()),
+        canonical_asa_id.store(Extract(read_slot(slot.load()), Int(0), UINT64_SIZE)),
+        XAssert(And(canonical_asa_id.load() != FREE_SLOT_ASA_ID, Btoi(canonical_asa_id.load()) != asa_id.load())),
+
+        Pop(App.box_create(ALIAS_BOX, Int(ALIAS_CAPACITY * ALIAS_ENTRY_SIZE + ALIAS_COUNT_SIZE))),
+        aliases.store(read_alias_table()),
+        count.store(alias_count(aliases.load())),
+        XAssert(count.load() < Int(ALIAS_CAPACITY)),
+        XAssert(alias_search(aliases.load(), asa_id.load()) == ENTRY_NOT_FOUND),
+        App.box_replace(ALIAS_BOX, alias_entry_offset(count.load()), Concat(
+            Itob(asa_id.load()), canonical_asa_id.load(), Extract(Itob(slot.load()), Int(6), Int(2)),
+            Extract(Itob(asa_decimals(asa_id.load())), Int(7), Int(1)))),
+        write_alias_count(count.load() + Int(1)),
+        Approve()
+    ])
+
+def unalias_asa():
+    #
+    # Removes the alias of an ASA.  Argument 1 must be the ASA ID (uint64).  The last alias takes
+    # its place in the table.  The alias box must be referenced.
+    #
+    aliases = ScratchVar(TealType.bytes)
+    count = ScratchVar(TealType.uint64)
+    position = ScratchVar(TealType.uint64)
+    return Seq([
+        XAssert(is_creator()),
+        aliases.store(read_alias_table()),
+        count.store(alias_count(aliases.load())),
+        position.store(alias_search(aliases.load(), Btoi(ALIAS_ASA_ARG))),
+        XAssert(position.load() != ENTRY_NOT_FOUND),
+        App.box_replace(ALIAS_BOX, alias_entry_offset(position.load()),
+                        Extract(aliases.load(), alias_entry_offset(count.load() - Int(1)), Int(ALIAS_ENTRY_SIZE))),
+        App.box_replace(ALIAS_BOX, alias_entry_offset(count.load() - Int(1)), BytesZero(Int(ALIAS_ENTRY_SIZE))),
+        write_alias_count(count.load() - Int(1)),
+        Approve()
+    ])
+
+def get_slot():
+    #
+    # Read-only: logs the data of a price slot. 
+    # Argument 1 must be the slot index (uint64).  With the box layout, the box holding the slot
+    # must be referenced.
+    #
+    slot = ScratchVar(TealType.uint64)
+    return Seq([
+        slot.store(Btoi(GET_ARG)),
+        XAssert(slot.load() < get_entry_count()),
+        Log(read_slot(slot.load())),
+        Approve()
+    ])
+
+def get_many_slots():
+    #
+    # Read-only: logs the data of several price slots, one log per slot, in argument order.
+    # Argument 1 must be an array of slot indexes (uint64), at most getmany_max_slots().
+    # The opcode budget is topped up as needed, so the call fee must cover any inner transactions.
+    #
+    op_pool = OpPool(BUDGET_POOL)
+    i = ScratchVar(TealType.uint64)
+    count = ScratchVar(TealType.uint64)
+    entry_count = ScratchVar(TealType.uint64)
+    slot = ScratchVar(TealType.uint64)
+    return Seq([
+        XAssert(Len(GET_ARG) % UINT64_SIZE == Int(0)),
+        count.store(Len(GET_ARG) / UINT64_SIZE),
+        XAssert(And(count.load() > Int(0), count.load() <= Int(getmany_max_slots()))),
+        entry_count.store(get_entry_count()),
+        For(i.store(Int(0)), i.load() < count.load(), i.store(i.load() + Int(1))).Do(
+            Seq([
+                op_pool.ensure_budget(GET_SLOT_BUDGET),
+                slot.store(ExtractUint64(GET_ARG, i.load() * UINT64_SIZE)),
+                XAssert(slot.load() < entry_count.load()),
+                Log(read_slot(slot.load()))
+            ])
+        ),
+        Approve()
+    ])
+
+def get_asa():
+    #
+    # Read-only: logs the data of the price slot of an ASA, searching all allocated slots.
+    # Argument 1 must be the ASA ID (uint64).  The search tops up the opcode budget as it goes,
+    # so the call fee must cover the inner transactions for the slots scanned.  With the ASA 
+    # index, the search is a binary search that needs no budget top-up.  An ASA without a slot
+    # is looked up in the aliases, see read_aliased_slot: the alias box and the canonical slot
+    # must then be referenced.
+    #
+    index = ScratchVar(TealType.uint64)
+    return Seq([
+        index.store(find_asaid_index(Btoi(GET_ARG))),
+        Log(If(index.load() != ENTRY_NOT_FOUND, read_slot(index.load()), read_aliased_slot(Btoi(GET_ARG)))),
+        Approve()
+    ])
+
 @Subroutine(TealType.uint64)
 # Arg0: Bootstrap with the authorized VAA Processor appid.
 def bootstrap():
-    op_pool = OpPool()
+    op_pool = OpPool(BUDGET_POOL)
     return Seq(
-        op_pool.maximize_budget(Int(2000)),
+        op_pool.ensure_budget(ZERO_BUDGET),
         App.globalPut(Bytes("coreid"), Btoi(Txn.application_args[0])),
         GlobalBlob.zero(),
+        write_layout_id(),
 
         # Enable the testing-mode flag.
         If(Tmpl.Int("TMPL_I_TESTING"), set_sys_flag(Int(128))),
@@ -473,8 +1648,18 @@ def pricecaster_program():
     handle_noop = Cond(
         [METHOD == Bytes("store"), store()],
         [METHOD == Bytes("alloc"), alloc_new_slot()],
+        [METHOD == Bytes("allocmany"), alloc_many_slots()],
         [METHOD == Bytes("reset"), reset()],
-        [METHOD == Bytes("setflags"), set_flags()]
+        [METHOD == Bytes("free"), free_slot()],
+        [METHOD == Bytes("setflags"), set_flags()],
+        [METHOD == Bytes("get"), get_slot()],
+        [METHOD == Bytes("getmany"), get_many_slots()],
+        [METHOD == Bytes("getasa"), get_asa()],
+        [METHOD == Bytes("storemulti"), store_multi()],
+        [METHOD == Bytes("setroot"), set_root()],
+        [METHOD == Bytes("storeproofs"), store_proofs()],
+        [METHOD == Bytes("alias"), alias_asa()],
+        [METHOD == Bytes("unalias"), unalias_asa()]
     )
     return Seq([
         # XAssert(Txn.rekey_to() == Global.zero_address()),
@@ -495,26 +1680,64 @@ def clear_state_program():
 
 if __name__ == "__main__":
 
-    approval_outfile = "teal/build/pricecaster-v2-approval.teal"
-    clear_state_outfile = "teal/build/pricecaster-v2-clear.teal"
-
-    if len(sys.argv) >= 2:
-        approval_outfile = sys.argv[1]
-
-    if len(sys.argv) >= 3:
-        clear_state_outfile = sys.argv[2]
-
-    print("Pricecaster V2 TEAL Program     Version 7.5, (c) 2022-23 C3")
-    print("Compiling approval program...")
+    parser = argparse.ArgumentParser(description="Pricecaster V2 TEAL compiler")
+    parser.add_argument("approval_outfile", nargs="?", default="teal/build/pricecaster-v2-approval.teal")
+    parser.add_argument("clear_state_outfile", nargs="?", default="teal/build/pricecaster-v2-clear.teal")
+    parser.add_argument("--layout", choices=LAYOUT_IDS.keys(), default=SLOT_LAYOUT, help="slot layout in global storage")
+    parser.add_argument("--budget-pool", choices=OpPool.MODES, default=BUDGET_POOL, 
+                        help="opcode budget pooling: create/delete inner apps, or call the budget pad app (TMPL_I_PAD_APP_ID)")
+    parser.add_argument("--slot-format", choices=SLOT_FORMAT_IDS.keys(), default=SLOT_FORMAT, help="price slot format")
+    parser.add_argument("--write-combining", action="store_true", default=WRITE_COMBINING,
+                        help="combine store slot writes in scratch space, one global write per key")
+    parser.add_argument("--asa-index", action="store_true", default=ASA_INDEX,
+                        help="keep a sorted ASA ID index of the slots in a box, store takes ASA IDs only")
+    parser.add_argument("--source-map", action="store_true",
+                        help="also write a TEAL line/pc to PyTeal file:line and subroutine map (.map.json)")
+    parser.add_argument("--profile", action="store_true",
+                        help="profiling build: log opcode cost per subroutine (see profiling.py). Never deploy it")
+    args = parser.parse_args()
+    if args.source_map and args.profile:
+        parser.error("the source map describes the program without profiling probes: use --source-map or --profile")
+    if args.write_combining and args.layout == LAYOUT_BOX:
+        parser.error("write-combining applies to global storage layouts only: --write-combining cannot be used with --layout box")
+
+    approval_outfile = args.approval_outfile
+    clear_state_outfile = args.clear_state_outfile
+    SLOT_LAYOUT = args.layout
+    BUDGET_POOL = args.budget_pool
+    SLOT_FORMAT = args.slot_format
+    WRITE_COMBINING = args.write_combining
+    ASA_INDEX = args.asa_index
+
+    print("Pricecaster V2 TEAL Program     Version 9.6, (c) 2022-23 C3")
+    print(f"Compiling approval program ({SLOT_LAYOUT} layout, {SLOT_FORMAT} slots, {BUDGET_POOL} budget pool{', write-combining' if WRITE_COMBINING else ''}{', ASA index' if ASA_INDEX else ''})...")
 
     optimize_options = OptimizeOptions(scratch_slots=True)
 
     with open(approval_outfile, "w") as f:
-        compiled = compileTeal(pricecaster_program(),
-                               mode=Mode.Application, version=8, assembleConstants=True, optimize=optimize_options)
+        if args.source_map:
+            result = Compilation(pricecaster_program(), mode=Mode.Application, version=8, assemble_constants=True,
+                                 optimize=optimize_options).compile(with_sourcemap=True, teal_filename=approval_outfile)
+            compiled = result.teal
+        else:
+            compiled = compileTeal(pricecaster_program(),
+                                   mode=Mode.Application, version=8, assembleConstants=True, optimize=optimize_options)
+        check_scratch_slots(compiled)
+        if args.profile:
+            compiled, profile_table = profiling.instrument(compiled)
         f.write(compiled)
 
     print("Written to " + approval_outfile)
+
+    if args.source_map:
+        with open(approval_outfile + ".map.json", "w") as f:
+            json.dump(profiling.source_map(result), f, indent=1)
+        print("Source map written to " + approval_outfile + ".map.json")
+
+    if args.profile:
+        with open(approval_outfile + ".profile.json", "w") as f:
+            json.dump(profile_table, f, indent=1)
+        print("PROFILING BUILD, NOT FOR DEPLOYMENT. Profile table written to " + approval_outfile + ".profile.json")
     print("Compiling clear state program...")
 
     with open(clear_state_outfile, "w") as f:
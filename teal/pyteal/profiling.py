@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+"""
+================================================================================================
+
+Pricecaster Onchain Program -- Cost Profiling Build and Source Map
+
+(c) 2022-23 C3
+
+------------------------------------------------------------------------------------------------
+
+Attributes opcode cost back to the PyTeal source of the approval program:
+
+source map      One entry per TEAL line: program counter, PyTeal file and line that produced it
+                and the subroutine it belongs to.  Requires PyTeal source mapping, which must be
+                enabled before pyteal is imported (see pricecaster-v2.py --source-map).
+
+profiling build The compiled TEAL with Global.opcode_budget() probes at the entry and exit of
+                every subroutine.  Each probe accumulates, per subroutine, the number of calls
+                and the opcodes executed between entry and exit (nested calls included) in a
+                scratch table, logged as the last log of the call:
+
+                    "PROF" + for each subroutine (in profile table order): calls (uint32),
+                                                                          opcodes (uint32)
+
+                Probe costs and the budget added by inner transactions are discounted, so the
+                figures are the opcodes the uninstrumented program executes.  Subroutines must
+                not be recursive.
+
+THE PROFILING BUILD IS FOR MEASUREMENT ONLY.  It must never be deployed.
+
+------------------------------------------------------------------------------------------------
+"""
+import re
+
+from avmsim import Program
+from globalblob import reserved_scratch_base
+
+PROFILE_LOG_HEADER = b"PROF"
+
+# Scratch slots reserved for the probes, just below the write-combining page cache (slots 192 to
+# 254, see globalblob.py).  check_scratch_slots verifies the program does not use them.
+PROBE_TABLE_SLOT = reserved_scratch_base + 3    # calls, opcodes per subroutine
+PROBE_OFFSET_SLOT = reserved_scratch_base + 2   # probe opcodes minus budget added, plus PROBE_OFFSET_BIAS
+PROBE_ENTRY_SLOT = reserved_scratch_base + 1    # adjusted budget at the last entry, per subroutine
+PROBE_SUBMIT_SLOT = reserved_scratch_base       # budget before the last inner transaction submission
+PROBE_OFFSET_BIAS = 1 << 32
+
+RECORD_SIZE = 8
+
+_LABEL = re.compile(r"^([A-Za-z0-9_]+):$")
+
+
+def _ops(lines):
+    return [l for l in lines if l and not l.startswith("//") and not _LABEL.match(l)]
+
+
+# The probe reads the budget after executing `before` opcodes (the caller's pushint and callsub
+# included, Global.opcode_budget() itself included) of `total` opcodes.
+
+def _enter_probe():
+    return [
+        "profile_enter:",
+        "proto 1 0",
+        "load %d" % PROBE_TABLE_SLOT,
+        "frame_dig -1",
+        "load %d" % PROBE_TABLE_SLOT,
+        "frame_dig -1",
+        "extract_uint32",
+        "pushint 1",
+        "+",
+        "itob",
+        "extract 4 4",
+        "replace3",
+        "store %d" % PROBE_TABLE_SLOT,
+        "load %d" % PROBE_ENTRY_SLOT,
+        "frame_dig -1",
+        "global OpcodeBudget",
+    ]
+
+
+def _exit_probe():
+    return [
+        "profile_exit:",
+        "proto 1 0",
+        "load %d" % PROBE_TABLE_SLOT,
+        "frame_dig -1",
+        "pushint 4",
+        "+",
+        "load %d" % PROBE_TABLE_SLOT,
+        "frame_dig -1",
+        "pushint 4",
+        "+",
+        "extract_uint32",
+        "load %d" % PROBE_ENTRY_SLOT,
+        "frame_dig -1",
+        "extract_uint64",
+        "global OpcodeBudget",
+    ]
+
+
+def _probe_routines():
+    """
+    TEAL of the enter and exit probe subroutines, appended to the program.
+    """
+    enter = _enter_probe()
+    enter_tail = [
+        "load %d" % PROBE_OFFSET_SLOT,
+        "+",
+        "pushint %d",
+        "+",
+        "itob",
+        "replace3",
+        "store %d" % PROBE_ENTRY_SLOT,
+        "load %d" % PROBE_OFFSET_SLOT,
+        "pushint %d",
+        "+",
+        "store %d" % PROBE_OFFSET_SLOT,
+        "retsub",
+    ]
+    exit_ = _exit_probe()
+    exit_tail = [
+        "load %d" % PROBE_OFFSET_SLOT,
+        "+",
+        "pushint %d",
+        "+",
+        "-",
+        "+",
+        "itob",
+        "extract 4 4",
+        "replace3",
+        "store %d" % PROBE_TABLE_SLOT,
+        "load %d" % PROBE_OFFSET_SLOT,
+        "pushint %d",
+        "+",
+        "store %d" % PROBE_OFFSET_SLOT,
+        "retsub",
+    ]
+
+    def finish(head, tail, program_ops):
+        # Caller's pushint and callsub, then the probe up to and including the budget read.
+        # `program_ops` moves the read to account the subroutine's callsub and proto (entry) or
+        # retsub (exit) to it.
+        before = 2 + len(_ops(head))
+        total = before + len(_ops(tail))
+        return head + [l % (before + program_ops if i == 2 else total) if "%d" in l else l
+                       for i, l in enumerate(tail)]
+
+    return finish(enter, enter_tail, 2) + finish(exit_, exit_tail, -1)
+
+
+def _submit_probe():
+    """
+    TEAL replacing itxn_submit: the budget added by the submission is discounted.
+    """
+    head = ["global OpcodeBudget", "store %d" % PROBE_SUBMIT_SLOT, "itxn_submit", "global OpcodeBudget"]
+    tail = [
+        "load %d" % PROBE_OFFSET_SLOT,
+        "load %d" % PROBE_SUBMIT_SLOT,
+        "+",
+        "swap",
+        "-",
+        "pushint %d",
+        "+",
+        "store %d" % PROBE_OFFSET_SLOT,
+    ]
+    # Opcodes executed between the two budget reads, the second read included, and probe
+    # opcodes in all (itxn_submit excluded).
+    between = 3
+    probe = len(head) + len(tail) - 1
+    return head + [l % (probe - between) if "%d" in l else l for l in tail]
+
+
+def teal_subroutines(teal: str):
+    """
+    Subroutines of a compiled program, in program order: a list of (label, name, first_line,
+    last_line) with 1-based TEAL line numbers.  `name` is the PyTeal subroutine name.
+    """
+    lines = teal.splitlines()
+    targets = set(l.split()[1] for l in lines if l.startswith("callsub "))
+    subroutines = []
+    for lineno, line in enumerate(lines, start=1):
+        m = _LABEL.match(line)
+        if not m or m.group(1) not in targets:
+            continue
+        name = m.group(1)
+        prev = lines[lineno - 2] if lineno > 1 else ""
+        if prev.startswith("// "):
+            name = prev[3:]
+        if subroutines:
+            label, sname, first, _ = subroutines[-1]
+            subroutines[-1] = (label, sname, first, lineno - 1)
+        subroutines.append((m.group(1), name, lineno, len(lines)))
+    return subroutines
+
+
+def subroutine_of_line(subroutines, lineno) -> str:
+    """
+    Name of the subroutine holding TEAL line `lineno`, or "main".
+    """
+    for _, name, first, last in subroutines:
+        if first <= lineno <= last:
+            return name
+    return "main"
+
+
+def instrument(teal: str):
+    """
+    Profiling build of the compiled program `teal`.  Returns the instrumented TEAL and the
+    profile table: the subroutine names, in log record order.
+    """
+    lines = teal.splitlines()
+    for line in lines:
+        for slot in (PROBE_TABLE_SLOT, PROBE_OFFSET_SLOT, PROBE_ENTRY_SLOT, PROBE_SUBMIT_SLOT):
+            if line.split()[:2] in (["load", str(slot)], ["store", str(slot)]):
+                raise ValueError("scratch slot %d is reserved for profiling probes" % slot)
+
+    subroutines = teal_subroutines(teal)
+    index = {label: i for i, (label, _, _, _) in enumerate(subroutines)}
+    size = RECORD_SIZE * len(subroutines)
+
+    out = []
+    current = None
+    for lineno, line in enumerate(lines, start=1):
+        op = line.split(" ", 1)[0]
+        m = _LABEL.match(line)
+        if m and m.group(1) in index:
+            current = m.group(1)
+        if op == "retsub" and current is not None:
+            out += ["pushint %d" % (RECORD_SIZE * index[current]), "callsub profile_exit"]
+        if op == "return":
+            if current is not None:
+                out += ["pushint %d" % (RECORD_SIZE * index[current]), "callsub profile_exit"]
+            out += ["pushbytes 0x%s" % PROFILE_LOG_HEADER.hex(), "load %d" % PROBE_TABLE_SLOT, "concat", "log"]
+        if op == "itxn_submit":
+            out += _submit_probe()
+            continue
+        out.append(line)
+        if line.startswith("#pragma"):
+            out += [
+                "pushint %d" % PROBE_OFFSET_BIAS,
+                "store %d" % PROBE_OFFSET_SLOT,
+                "pushint %d" % size,
+                "bzero",
+                "dup",
+                "store %d" % PROBE_TABLE_SLOT,
+                "store %d" % PROBE_ENTRY_SLOT,
+            ]
+        next_line = lines[lineno] if lineno < len(lines) else ""
+        if op == "proto" or m and m.group(1) in index and not next_line.startswith("proto "):
+            out += ["pushint %d" % (RECORD_SIZE * index[current]), "callsub profile_enter"]
+
+    out += ["", "// profiling probes"] + _probe_routines()
+    return "\n".join(out) + "\n", [name for _, name, _, _ in subroutines]
+
+
+def read_profile(logs, table):
+    """
+    Decode the profile log of a profiling build call: a dict of subroutine name ->
+    {"calls", "opcode_cost"}, for the subroutines called.  None if the call logged no profile.
+    """
+    if not logs or not logs[-1].startswith(PROFILE_LOG_HEADER):
+        return None
+    records = logs[-1][len(PROFILE_LOG_HEADER):]
+    profile = {}
+    for i, name in enumerate(table):
+        record = records[RECORD_SIZE * i:RECORD_SIZE * (i + 1)]
+        calls = int.from_bytes(record[:4], "big")
+        if calls:
+            profile[name] = {"calls": calls, "opcode_cost": int.from_bytes(record[4:], "big")}
+    return profile
+
+
+def source_map(result, template_values=None):
+    """
+    Source map of a PyTeal compilation made with `with_sourcemap=True`: one entry per TEAL line
+    with the TEAL line number and text, the program counter, the PyTeal file and line and the
+    subroutine.  Program counters depend on the values bound to the template variables (default
+    zero).
+    """
+    if template_values is None:
+        template_values = {name: 0 for name in set(re.findall(r"TMPL_[A-Z0-9_]+", result.teal))}
+    program = Program(result.teal, template_values)
+    pcs = {ins.line: ins.pc for ins in program.instructions}
+    subroutines = teal_subroutines(result.teal)
+    mappings = result.sourcemap.r3_sourcemap.entries
+    entries = []
+    for lineno, line in enumerate(result.teal.splitlines(), start=1):
+        mapping = mappings.get((lineno - 1, 0))
+        entries.append({
+            "teal_line": lineno,
+            "teal": line,
+            "pc": pcs.get(lineno),
+            "file": mapping.source if mapping else None,
+            "line": mapping.source_line + 1 if mapping else None,
+            "subroutine": subroutine_of_line(subroutines, lineno),
+        })
+    return entries
@@ -1,7 +1,8 @@
 /* eslint-disable no-unused-expressions */
-import PricecasterLib, { PRICECASTER_CI, PriceSlotData } from '../lib/pricecaster'
+import PricecasterLib, { PRICECASTER_CI, PriceSlotData, SlotLayout, MAX_STORE_ATTESTATIONS, MAX_ALLOC_BATCH, ProofUpdate } from '../lib/pricecaster'
 import tools from '../tools/app-tools'
 import algosdk, { Account, generateAccount, makePaymentTxnWithSuggestedParams, Transaction } from 'algosdk'
+import { ethers } from 'ethers'
 const { expect } = require('chai')
 const chai = require('chai')
 const spawnSync = require('child_process').spawnSync
@@ -25,7 +26,7 @@ const assetMap1 = [
 ]
 
 const SYSTEM_SLOT_INDEX = 85
-const SLOT_SIZE = 92
+const SLOT_SIZE = 93
 
 // ===============================================================================================================
 
@@ -149,6 +150,47 @@ function prepareStoreTxArgs (assetMap: AssetMapEntry[],
   return { payload, flatU8ArrayAssetIds, assetIds }
 }
 
+function makePriceMessage (feed: number, price: number, exponent: number, pubTime: number): Buffer {
+  const message = Buffer.alloc(85)
+  message.writeUInt8(0, 0)
+  message.writeUInt32BE(feed, 29)
+  message.writeBigInt64BE(BigInt(price), 33)
+  message.write('cc000000000000ff', 41, 'hex')
+  message.writeInt32BE(exponent, 49)
+  message.writeBigInt64BE(BigInt(pubTime), 53)
+  message.writeBigInt64BE(BigInt(pubTime - 1), 61)
+  message.write('111111111111111f222222222222222f', 69, 'hex')
+  return message
+}
+
+function keccak160 (data: Buffer): Buffer {
+  return Buffer.from(ethers.utils.keccak256(data).slice(2, 42), 'hex')
+}
+
+/**
+ * Build the accumulator Merkle tree of the messages, padded with empty leaves to a power of two.
+ * @returns The root, and the update of each message with its proof.
+ */
+function makeProofUpdates (messages: Buffer[]): { root: Buffer, updates: ProofUpdate[] } {
+  let level = messages.map(m => keccak160(Buffer.concat([Buffer.from([0]), m])))
+  while (level.length & (level.length - 1)) {
+    level.push(keccak160(Buffer.from([0])))
+  }
+  const updates = messages.map(message => ({ priceId: message.subarray(1, 33).toString('hex'), message, proof: [] as Buffer[] }))
+  let positions = messages.map((m, i) => i)
+  while (level.length > 1) {
+    updates.forEach((update, i) => update.proof.push(level[positions[i] ^ 1]))
+    const next = []
+    for (let i = 0; i < level.length; i += 2) {
+      const [a, b] = Buffer.compare(level[i], level[i + 1]) < 0 ? [level[i], level[i + 1]] : [level[i + 1], level[i]]
+      next.push(keccak160(Buffer.concat([Buffer.from([1]), a, b])))
+    }
+    level = next
+    positions = positions.map(p => Math.floor(p / 2))
+  }
+  return { root: level[0], updates }
+}
+
 async function createAssets (assetMap: AssetMapEntry[]) {
   for (const [i, val] of assetMap.entries()) {
     if (assetMap[i].assetId === undefined) {
@@ -223,8 +265,10 @@ async function testOkCase (decimals: number,
   const prevPubTime = dataBuf.subarray(68, 76).readBigUint64BE()
   const prevPrice = dataBuf.subarray(76, 84).readBigUint64BE()
   const prevConf = dataBuf.subarray(84, 92).readBigUInt64BE()
+  const decimals = dataBuf.readUInt8(92)
 
   // console.log(normalizedPrice)
+  expect(decimals).to.equal(assetIdOverride === 0 ? 6 : assetMap[0].decimals)
   expect(pythPrice).to.equal(BigInt(assetMap[0].samplePrice))
   expect(normalizedPrice).to.equal(BigInt(Math.round(assetMap[0].samplePrice * Math.pow(10, (12 + assetMap[0].exponent - (assetIdOverride === 0 ? 6 : assetMap[0].decimals))))))
   expect(exp).to.equal(assetMap[0].exponent)
@@ -250,7 +294,8 @@ async function testOkCase (decimals: number,
     pubTime,
     prevPubTime,
     prevPrice,
-    prevConf
+    prevConf,
+    decimals
   }
 }
 
@@ -465,9 +510,56 @@ describe('Pricecaster App Tests', function () {
       const priceData = await pclib.readSlot(Number(v.slot!))
       expect(priceData.readBigInt64BE(0)).to.deep.equal(BigInt(v.assetId!))
     }
+
+    const updates = pclib.parseUpdateLog(txResponse.logs)
+    expect(updates!.map(u => u.slot)).to.deep.equal(assetMap1.map(v => Number(v.slot!)))
+    expect(updates!.map(u => u.asaId)).to.deep.equal(assetMap1.map(v => v.assetId!))
+    expect(updates!.every(u => u.pubTime === BigInt(0x6283efc3))).to.equal(true)
+  })
+
+  it('Must handle two payloads with storemulti call', async function () {
+    const batches = [assetMap1.slice(0, 2), assetMap1.slice(2)].map(assets => {
+      return {
+        asaIdSlots: assets.map(v => { return { asaid: v.assetId!, slot: Number(v.slot!) } }),
+        payload: prepareStoreTxArgs(assets, '01', '000000006283efc4').payload
+      }
+    })
+
+    const params = await algodClient.getTransactionParams().do()
+    params.fee = 7000
+
+    const tx = pclib.makePriceStoreMultiTx(ownerAccount.addr, batches, params)
+    const { txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do()
+    const txResponse = await pclib.waitForTransactionResponse(txId)
+    expect(txResponse['pool-error']).to.equal('')
+
+    for (const v of assetMap1) {
+      const priceData = await pclib.readSlot(Number(v.slot!))
+      expect(priceData.readBigInt64BE(0)).to.deep.equal(BigInt(v.assetId!))
+      expect(priceData.readBigUInt64BE(60)).to.equal(BigInt(0x6283efc4))
+    }
     await deleteAssets(assetMap1)
   })
 
+  it('Must return slot data with get and getmany', async function () {
+    const params = await algodClient.getTransactionParams().do()
+    const slot = Number(assetMap1[0].slot!)
+    let tx = pclib.makeGetSlotTx(ownerAccount.addr, slot, params)
+    let { txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do()
+    let txResponse = await pclib.waitForTransactionResponse(txId)
+    expect(txResponse.logs[0]).to.deep.equal(await pclib.readSlot(slot))
+
+    params.fee = 2000
+    params.flatFee = true
+    const slots = assetMap1.map(v => Number(v.slot!))
+    tx = pclib.makeGetManySlotsTx(ownerAccount.addr, slots, params);
+    ({ txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do())
+    txResponse = await pclib.waitForTransactionResponse(txId)
+    for (const [i, s] of slots.entries()) {
+      expect(txResponse.logs[i]).to.deep.equal(await pclib.readSlot(s))
+    }
+  })
+
   it('Must handle boundary case d=19 e=12', async function () {
     await testOkCase(19, 1, 12)
   })
@@ -480,6 +572,10 @@ describe('Pricecaster App Tests', function () {
     await testFailCase(0, 1, 12)
   })
 
+  it('Must handle zero price at boundary case d=0 e=12', async function () {
+    await testOkCase(0, 0, 12)
+  })
+
   it('Must handle boundary case d=0 e=-12', async function () {
     await testOkCase(0, 1, -12)
   })
@@ -518,6 +614,14 @@ describe('Pricecaster App Tests', function () {
     await expect(algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do()).to.be.rejectedWith(regex)
   })
 
+  it('Must refuse to build a store call over the maximum batch size', async function () {
+    const txParams = prepareStoreTxArgs(assetMap1)
+    const params = await algodClient.getTransactionParams().do()
+    const asaIdSlots = Array(MAX_STORE_ATTESTATIONS + 1).fill({ asaid: assetMap1[0].assetId!, slot: assetMap1[0].slot! })
+
+    expect(() => pclib.makePriceStoreTx(ownerAccount.addr, asaIdSlots, txParams.payload, params)).to.throw()
+  })
+
   it('Must ignore publication where an attestation has older publish time', async function () {
     const assetMap = [
       { decimals: 5, assetId: asaInSlot[0], samplePrice: 10000, exponent: -8, slot: 0 }
@@ -551,12 +655,199 @@ describe('Pricecaster App Tests', function () {
       expect(txResponse['pool-error']).to.equal('')
 
       expect(txResponse.logs[0]).to.deep.equal(Buffer.concat([Buffer.from('PRICE_IGNORED_OLD:'), Buffer.from(algosdk.encodeUint64(txParams.assetIds[0]))]))
+      expect((await pclib.readSlot(assetMap[0].slot!)).readBigUInt64BE(60)).to.equal(BigInt(0x6283efc3))
     }
   })
 
+  it('Must free a slot', async function () {
+    const params = await algodClient.getTransactionParams().do()
+    const slot = Number(assetMap1[assetMap1.length - 1].slot!)
+    const snapshot = await pclib.readParseGlobalStateChanges()
+
+    const tx = pclib.makeFreeSlotTx(ownerAccount.addr, slot, params)
+
+    const { txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do()
+    const txResponse = await pclib.waitForTransactionResponse(txId)
+    expect(txResponse['pool-error']).to.equal('')
+
+    const freeSlot = Buffer.alloc(SLOT_SIZE)
+    freeSlot.fill(0xff, 0, 8)
+    expect(await pclib.readSlot(slot)).to.deep.equal(freeSlot)
+
+    // Change tracking: one more update, and the freed slot parsed again.
+    const changes = await pclib.readParseGlobalStateChanges(snapshot)
+    expect(changes.updateSeq).to.equal(snapshot.updateSeq + BigInt(1))
+    expect(changes.slots[slot].asaId).to.not.equal(snapshot.slots[slot].asaId)
+    expect(await pclib.readFreeSlots()).to.deep.equal([slot])
+  })
+
+  it('Must fail to free a slot twice', async function () {
+    const params = await algodClient.getTransactionParams().do()
+    const tx = pclib.makeFreeSlotTx(ownerAccount.addr, Number(assetMap1[assetMap1.length - 1].slot!), params)
+
+    await expect(algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do()).to.be.rejectedWith(/logic eval error/)
+  })
+
+  it('Must reuse a freed slot at allocation', async function () {
+    const slot = Number(assetMap1[assetMap1.length - 1].slot!)
+    const entryCount = (await pclib.readSystemSlot()).entryCount
+    expect(await pclib.nextAllocSlots(2)).to.deep.equal([slot, entryCount])
+
+    const assetMap = [
+      { decimals: 4, assetId: undefined, samplePrice: 10000, exponent: -8, slot: undefined }
+    ]
+    await createAssets(assetMap)
+    const txResponse = await sendAllocSlotTx(assetMap[0].assetId!)
+    expect(txResponse['pool-error']).to.equal('')
+
+    expect(pclib.parseAllocLog(txResponse.logs)).to.deep.equal([slot])
+    expect((await pclib.readSystemSlot()).entryCount).to.equal(entryCount)
+    expect((await pclib.readSlot(slot)).readBigUInt64BE(0)).to.equal(BigInt(assetMap[0].assetId!))
+    expect(await pclib.readFreeSlots()).to.deep.equal([])
+  })
+
+  it('Must free slots from a given slot with reset call', async function () {
+    const params = await algodClient.getTransactionParams().do()
+    params.flatFee = true
+    params.fee = pclib.resetFee((await pclib.readSystemSlot()).entryCount)
+
+    const tx = pclib.makeResetTx(ownerAccount.addr, params, 1)
+
+    const { txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do()
+    const txResponse = await pclib.waitForTransactionResponse(txId)
+    expect(txResponse['pool-error']).to.equal('')
+
+    expect((await pclib.readSystemSlot()).entryCount).to.equal(1)
+    expect((await pclib.readSlot(0)).readBigUInt64BE(0)).to.equal(BigInt(asaInSlot[0]))
+    expect(await pclib.readSlot(1)).to.deep.equal(Buffer.alloc(SLOT_SIZE))
+  })
+
+  it('Must allocate several slots in one call', async function () {
+    const assetMap = [
+      { decimals: 5, assetId: undefined, samplePrice: 10000, exponent: -8, slot: undefined },
+      { decimals: 6, assetId: undefined, samplePrice: 10000, exponent: -8, slot: undefined },
+      { decimals: 7, assetId: undefined, samplePrice: 10000, exponent: -8, slot: undefined }
+    ]
+    await createAssets(assetMap)
+    const asaids = [...assetMap.map(v => v.assetId!), 0]
+
+    const batches = await pclib.planAllocBatches(asaids)
+    expect(batches).to.deep.equal([{ asaids, slots: [1, 2, 3, 4] }])
+
+    const params = await algodClient.getTransactionParams().do()
+    params.flatFee = true
+    params.fee = pclib.allocManyFee(asaids.length)
+    const tx = pclib.makeAllocManySlotsTx(ownerAccount.addr, asaids, params)
+    const { txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do()
+    const txResponse = await pclib.waitForTransactionResponse(txId)
+    expect(txResponse['pool-error']).to.equal('')
+
+    expect(txResponse.logs.length).to.equal(1)
+    expect(pclib.parseAllocLog(txResponse.logs)).to.deep.equal([1, 2, 3, 4])
+    expect((await pclib.readSystemSlot()).entryCount).to.equal(5)
+    for (const [i, asaid] of asaids.entries()) {
+      const slot = await pclib.readParsePriceSlot(i + 1)
+      expect(slot.asaId).to.equal(asaid)
+      expect(slot.decimals).to.equal(asaid === 0 ? 6 : assetMap[i].decimals)
+    }
+  })
+
+  it('Must refuse to build an allocmany call over the maximum batch size', async function () {
+    const params = await algodClient.getTransactionParams().do()
+    expect(() => pclib.makeAllocManySlotsTx(ownerAccount.addr, Array(MAX_ALLOC_BATCH + 1).fill(0), params)).to.throw()
+  })
+
+  it('Must publish prices proven against the accumulator root', async function () {
+    const asaIdSlots = []
+    for (const slot of [1, 2, 3]) {
+      asaIdSlots.push({ asaid: (await pclib.readParsePriceSlot(slot)).asaId, slot })
+    }
+    const messages = [...Array(5).keys()].map(feed => makePriceMessage(feed, 20000 + feed, -8, 0x6283f000))
+    const { root, updates } = makeProofUpdates(messages)
+
+    const params = await algodClient.getTransactionParams().do()
+    params.flatFee = true
+    params.fee = 1000
+    const rootPayload = Buffer.concat([Buffer.from('AUWV'), Buffer.from('00', 'hex'), Buffer.from(algosdk.encodeUint64(1)),
+      Buffer.from('00000005', 'hex'), root])
+    let tx = pclib.makeSetRootTx(ownerAccount.addr, rootPayload, params)
+    let { txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do()
+    let txResponse = await pclib.waitForTransactionResponse(txId)
+    expect(txResponse['pool-error']).to.equal('')
+    expect((await pclib.readSystemSlot()).merkleRoot).to.deep.equal(root)
+
+    params.fee = pclib.storeProofsFee(updates.slice(1, 4))
+    tx = pclib.makeStoreProofsTx(ownerAccount.addr, asaIdSlots, updates.slice(1, 4), params);
+    ({ txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do())
+    txResponse = await pclib.waitForTransactionResponse(txId)
+    expect(txResponse['pool-error']).to.equal('')
+
+    expect(pclib.parseUpdateLog(txResponse.logs)!.map(u => u.slot)).to.deep.equal([1, 2, 3])
+    for (const [i, v] of asaIdSlots.entries()) {
+      const slot = await pclib.readParsePriceSlot(v.slot)
+      expect(slot.pythPrice).to.equal(BigInt(20001 + i))
+      expect(slot.pubTime).to.equal(BigInt(0x6283f000))
+      expect(slot.attTime).to.equal(BigInt(0x6283f000))
+    }
+
+    // A message changed after the root was set is not proven.
+    const forged = { ...updates[4], message: makePriceMessage(4, 1, -8, 0x6283f001) }
+    tx = pclib.makeStoreProofsTx(ownerAccount.addr, asaIdSlots.slice(0, 1), [forged], params)
+    await expect(algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do()).to.be.rejectedWith(/logic eval error/)
+  })
+
+  it('Must read an aliased ASA from the slot of its canonical ASA', async function () {
+    // Minimum balance of the alias box, created by the first alias.
+    const paymentTx = makePaymentTxnWithSuggestedParams(ownerAccount.addr,
+      algosdk.getApplicationAddress(PRICECASTER_CI.appId), 410000, undefined, undefined, await algodClient.getTransactionParams().do())
+    let { txId } = await algodClient.sendRawTransaction(paymentTx.signTxn(ownerAccount.sk)).do()
+    await pclib.waitForTransactionResponse(txId)
+
+    const canonical = await pclib.readParsePriceSlot(1)
+    const assetMap = [
+      { decimals: 1, assetId: undefined, samplePrice: 10000, exponent: -8, slot: undefined }
+    ]
+    await createAssets(assetMap)
+    const asaid = assetMap[0].assetId!
+
+    const params = await algodClient.getTransactionParams().do()
+    params.flatFee = true
+    params.fee = pclib.aliasFee(0)
+    let tx = pclib.makeAliasTx(ownerAccount.addr, asaid, 1, params);
+    ({ txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do())
+    let txResponse = await pclib.waitForTransactionResponse(txId)
+    expect(txResponse['pool-error']).to.equal('')
+
+    const aliases = await pclib.fetchAliases()
+    expect(aliases).to.deep.equal([{ asaid, canonicalAsaId: canonical.asaId, slot: 1, decimals: 1 }])
+
+    // The price is normalized for the decimals of the alias, and the slot is left as is.
+    params.fee = pclib.aliasFee(1) + 1000
+    tx = pclib.makeGetAsaTx(ownerAccount.addr, asaid, params, undefined, aliases[0]);
+    ({ txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do())
+    txResponse = await pclib.waitForTransactionResponse(txId)
+    const aliased = pclib.parseSlotBuffer(txResponse.logs[0])
+    expect(aliased).to.deep.equal(pclib.aliasSlotData(canonical, aliases[0]))
+    expect(aliased.normalizedPrice).to.equal(canonical.pythPrice * BigInt(1000))
+    expect(await pclib.readParsePriceSlot(1)).to.deep.equal(canonical)
+
+    // Aliasing an ASA twice is refused.
+    tx = pclib.makeAliasTx(ownerAccount.addr, asaid, 2, params)
+    await expect(algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do()).to.be.rejectedWith(/logic eval error/)
+
+    params.fee = pclib.aliasFee(1)
+    tx = pclib.makeUnaliasTx(ownerAccount.addr, asaid, params);
+    ({ txId } = await algodClient.sendRawTransaction(tx.signTxn(ownerAccount.sk)).do())
+    txResponse = await pclib.waitForTransactionResponse(txId)
+    expect(txResponse['pool-error']).to.equal('')
+    expect(await pclib.fetchAliases()).to.deep.equal([])
+    await deleteAssets(assetMap)
+  })
+
   it('Must zero contract with reset call', async function () {
     const params = await algodClient.getTransactionParams().do()
     params.fee = 2000
+    const updateSeq = (await pclib.readSystemSlot()).updateSeq
 
     const tx = pclib.makeResetTx(ownerAccount.addr, params)
 
@@ -564,14 +855,25 @@ describe('Pricecaster App Tests', function () {
     const txResponse = await pclib.waitForTransactionResponse(txId)
     expect(txResponse['pool-error']).to.equal('')
 
+    // Change tracking: reset is one more update, and every change table entry holds its low byte.
     const global = await pclib.fetchGlobalSpace()
+    const sysOffset = SLOT_SIZE * SYSTEM_SLOT_INDEX
+    expect(global.readBigUInt64BE(sysOffset + 16)).to.equal(updateSeq + BigInt(1))
+    expect(global.subarray(sysOffset + 24, sysOffset + 56)).to.deep.equal(Buffer.alloc(32, Number((updateSeq + BigInt(1)) & BigInt(0xff))))
+
     const buf = Buffer.alloc(127 * 63)
-    // Flags must be present, but entry count set to zero
-    buf.writeUint8(0, SLOT_SIZE * SYSTEM_SLOT_INDEX)
-    buf.writeUint8(0x80, SLOT_SIZE * SYSTEM_SLOT_INDEX + 1)
+    // Flags, change tracking and the accumulator root must be present, but entry count set to zero
+    buf.writeUint8(0, sysOffset)
+    buf.writeUint8(0x80, sysOffset + 1)
+    global.copy(buf, sysOffset + 16, sysOffset + 16, sysOffset + 56)
+    global.copy(buf, sysOffset + 58, sysOffset + 58, sysOffset + 78)
     expect(global).to.deep.equal(buf)
   })
 
+  it('Must report linear slot layout with default build', async function () {
+    expect(await pclib.readSlotLayout()).to.equal(SlotLayout.Linear)
+  })
+
   it('Must fail to store from non-creator account', async function () {
     const altAccount = generateAccount()
     const paymentTx = makePaymentTxnWithSuggestedParams(ownerAccount.addr, altAccount.addr, 400000, undefined, undefined, await algodClient.getTransactionParams().do())
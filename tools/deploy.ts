@@ -21,7 +21,7 @@
 /* eslint-disable linebreak-style */
 
 import algosdk from 'algosdk'
-import PricecasterLib, { PRICECASTER_CI } from '../lib/pricecaster'
+import PricecasterLib, { BUDGETPAD_CI, PRICECASTER_CI } from '../lib/pricecaster'
 const { exit } = require('process')
 const readline = require('readline')
 const rl = readline.createInterface({
@@ -45,10 +45,16 @@ function signCallback (sender: string, tx: algosdk.Transaction) {
   return tx.signTxn(algosdk.mnemonicToSecretKey(globalMnemo).sk)
 }
 
-async function startOp (algodClient: algosdk.Algodv2, fromAddress: string, coreId: string, testModeEnable: boolean) {
+async function startOp (algodClient: algosdk.Algodv2, fromAddress: string, coreId: string, testModeEnable: boolean, padAppId?: string) {
   const pclib = new PricecasterLib(algodClient, fromAddress)
 
-  const out = spawnSync(PYTHON_BIN, [config.sources.pricecaster_pyteal])
+  const buildArgs = [config.sources.pricecaster_pyteal]
+  if (padAppId !== undefined) {
+    buildArgs.push('--budget-pool', 'pad')
+    pclib.setAppId(BUDGETPAD_CI, parseInt(padAppId))
+  }
+
+  const out = spawnSync(PYTHON_BIN, buildArgs)
   if (out.error) {
     throw out.error
   }
@@ -78,13 +84,14 @@ async function startOp (algodClient: algosdk.Algodv2, fromAddress: string, coreI
   console.log('\nPricecaster v2   Version 7.1  Algorand Application Deployment Tool')
   console.log('Copyright 2022 Randlabs Inc.\n')
 
-  if (process.argv.length !== 6) {
-    console.log('Usage: deploy <coreid> <network> <keyfile>\n')
+  if (process.argv.length !== 6 && process.argv.length !== 7) {
+    console.log('Usage: deploy <coreid> <network> <keyfile> <testmode> [padappid]\n')
     console.log('where:\n')
     console.log('coreid                 The application id of the Wormhole core contract')
     console.log('network                Testnet, betanet, mainnet or dev (look in deploy.config.ts)')
     console.log('keyfile                Secret file containing deployer signing key mnemonic')
     console.log('testmode               Deploy test-mode contract to skip VAA/security checks')
+    console.log('padappid               Optional. Budget pad application id; builds with the "pad" budget pool')
     exit(0)
   }
 
@@ -92,6 +99,7 @@ async function startOp (algodClient: algosdk.Algodv2, fromAddress: string, coreI
   const network: string = process.argv[3]
   const keyfile: string = process.argv[4]
   const testmode: string = process.argv[5] 
+  const padAppId: string | undefined = process.argv[6]
 
   const netconfig = config.networks[network]
   if (config === undefined) {
@@ -110,12 +118,15 @@ async function startOp (algodClient: algosdk.Algodv2, fromAddress: string, coreI
     console.log('Network: ' + network)
     console.log('Wormhole Core AppId: ' + coreId)
     console.log('Testmode: ' + testModeEnable)
+    if (padAppId !== undefined) {
+      console.log('Budget pad AppId: ' + padAppId)
+    }
     const answer = await ask('\nEnter YES to confirm parameters, anything else to abort. ')
     if (answer !== 'YES') {
       console.warn('Aborted by user.')
       exit(1)
     }
-    await startOp(algodClient, fromAddress, coreId, testModeEnable)
+    await startOp(algodClient, fromAddress, coreId, testModeEnable, padAppId)
   } catch (e: any) {
     console.error('(!) Deployment Failed: ' + e.toString())
   }